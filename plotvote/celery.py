@@ -3,6 +3,7 @@ Celery configuration for PlotVote
 """
 import os
 from celery import Celery
+from celery.signals import worker_init
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'plotvote.settings')
@@ -19,6 +20,17 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+@worker_init.connect
+def require_shared_cache(**kwargs):
+    """Refuse to start a worker whose cache the web processes can't see"""
+    from django.core.exceptions import ImproperlyConfigured
+    from stories.checks import shared_cache_errors
+
+    errors = shared_cache_errors()
+    if errors:
+        raise ImproperlyConfigured(f'{errors[0].msg} {errors[0].hint}')
+
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
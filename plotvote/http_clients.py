@@ -0,0 +1,191 @@
+"""
+Shared outbound HTTP clients
+
+OpenAI, Stripe and cover image downloads each used to open a fresh connection
+(and TLS handshake) per call. Every outbound service now gets one pooled
+httpx.Client per process, with keep-alive connections, its own timeouts and
+connect retries, and a transport that records request latency and errors.
+
+Clients are created lazily and dropped in forked children (gunicorn and
+Celery prefork workers), since a connection pool must never be shared across
+processes.
+"""
+import logging
+import os
+import threading
+import time
+
+import httpx
+import stripe
+from django.conf import settings
+from openai import OpenAI
+
+
+logger = logging.getLogger(__name__)
+
+# Per-service timeouts (seconds), connect retries and pool size
+SERVICES = {
+    'openai': {
+        'timeout': httpx.Timeout(120.0, connect=5.0),
+        'retries': 2,
+        'max_connections': 20,
+    },
+    'stripe': {
+        'timeout': httpx.Timeout(30.0, connect=5.0),
+        'retries': 2,
+        'max_connections': 10,
+    },
+    'download': {
+        'timeout': httpx.Timeout(30.0, connect=5.0),
+        'retries': 2,
+        'max_connections': 10,
+    },
+}
+
+# Idle keep-alive connections are closed after this long
+KEEPALIVE_EXPIRY = 30.0
+
+# Requests slower than this (to response headers) are logged
+SLOW_REQUEST_SECONDS = 10.0
+
+_lock = threading.Lock()
+_clients = {}
+_openai_clients = {}
+_metrics = {}
+
+
+def _reset_after_fork():
+    """Forget the parent's clients; their sockets belong to the parent process"""
+    global _lock
+    _lock = threading.Lock()
+    _clients.clear()
+    _openai_clients.clear()
+    _metrics.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _record(service, elapsed, error):
+    with _lock:
+        stats = _metrics.setdefault(service, {'requests': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        stats['requests'] += 1
+        stats['errors'] += int(error)
+        stats['total_seconds'] += elapsed
+        stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+
+
+class MeteredTransport(httpx.HTTPTransport):
+    """Connection-pooling transport that records latency and errors per service"""
+
+    def __init__(self, service, **kwargs):
+        super().__init__(**kwargs)
+        self.service = service
+
+    def handle_request(self, request):
+        start = time.monotonic()
+        try:
+            response = super().handle_request(request)
+        except Exception as e:
+            _record(self.service, time.monotonic() - start, error=True)
+            logger.warning(f"{self.service} request to {request.url.host} failed: {e!r}")
+            raise
+
+        elapsed = time.monotonic() - start
+        _record(self.service, elapsed, error=response.status_code >= 500)
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            logger.warning(f"Slow {self.service} request to {request.url.host}: {elapsed:.1f}s")
+        return response
+
+
+def get_http_client(service):
+    """
+    Get the process-wide pooled client for an outbound service
+
+    Args:
+        service: Key of SERVICES ('openai', 'stripe' or 'download')
+
+    Returns:
+        httpx.Client
+    """
+    client = _clients.get(service)
+    if client is None:
+        config = SERVICES[service]
+        with _lock:
+            client = _clients.get(service)
+            if client is None:
+                transport = MeteredTransport(
+                    service,
+                    retries=config['retries'],
+                    limits=httpx.Limits(
+                        max_connections=config['max_connections'],
+                        max_keepalive_connections=config['max_connections'],
+                        keepalive_expiry=KEEPALIVE_EXPIRY,
+                    ),
+                )
+                client = httpx.Client(transport=transport, timeout=config['timeout'], follow_redirects=True)
+                _clients[service] = client
+    return client
+
+
+def get_openai_client(base_url=None, api_key=None):
+    """
+    Get a process-wide OpenAI client, sending requests through the pooled 'openai' client
+
+    Args:
+        base_url: API root of an OpenAI-compatible server (default: OpenAI)
+        api_key: Key for that server (default: settings.OPENAI_API_KEY)
+
+    Returns:
+        openai.OpenAI
+    """
+    client = _openai_clients.get(base_url)
+    if client is None:
+        config = SERVICES['openai']
+        http_client = get_http_client('openai')
+        with _lock:
+            client = _openai_clients.get(base_url)
+            if client is None:
+                client = OpenAI(
+                    api_key=api_key or settings.OPENAI_API_KEY,
+                    base_url=base_url,
+                    http_client=http_client,
+                    timeout=config['timeout'],
+                    max_retries=config['retries'],
+                )
+                _openai_clients[base_url] = client
+    return client
+
+
+def get_metrics():
+    """
+    Snapshot of this process's outbound request metrics
+
+    Returns:
+        dict: {service: {'requests', 'errors', 'total_seconds', 'max_seconds'}}
+    """
+    with _lock:
+        return {service: dict(stats) for service, stats in _metrics.items()}
+
+
+class PooledStripeClient(stripe.HTTPXClient):
+    """Stripe's httpx adapter, backed by the current process's pooled 'stripe' client"""
+
+    def __init__(self):
+        super().__init__(timeout=SERVICES['stripe']['timeout'])
+
+    # HTTPXClient keeps its sync client in _client; resolve it per process instead
+    @property
+    def _client(self):
+        return get_http_client('stripe')
+
+    @_client.setter
+    def _client(self, value):
+        pass
+
+
+def configure_stripe():
+    """Point the stripe library at the pooled 'stripe' client"""
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.max_network_retries = SERVICES['stripe']['retries']
+    stripe.default_http_client = PooledStripeClient()
@@ -33,6 +33,34 @@ DEBUG = os.getenv('DEBUG', 'True') == 'True'
 # OpenAI API Key
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 
+# Chapter generation backend (see stories/chapter_engine.py): 'openai',
+# 'openai-compatible' (a self-hosted server at CHAPTER_GENERATION_BASE_URL)
+# or 'fake' (deterministic offline text after CHAPTER_GENERATION_FAKE_LATENCY seconds)
+CHAPTER_GENERATION_BACKEND = os.getenv('CHAPTER_GENERATION_BACKEND', 'openai')
+CHAPTER_GENERATION_MODEL = os.getenv('CHAPTER_GENERATION_MODEL', 'gpt-4o')
+CHAPTER_GENERATION_BASE_URL = os.getenv('CHAPTER_GENERATION_BASE_URL', '')
+CHAPTER_GENERATION_API_KEY = os.getenv('CHAPTER_GENERATION_API_KEY', '')
+CHAPTER_GENERATION_FAKE_LATENCY = float(os.getenv('CHAPTER_GENERATION_FAKE_LATENCY', '0'))
+# Ask for title, content and summary as one JSON-schema response (needs a server supporting
+# response_format json_schema); streamed personal chapters always use plain text
+CHAPTER_GENERATION_STRUCTURED_OUTPUT = os.getenv('CHAPTER_GENERATION_STRUCTURED_OUTPUT', 'True') == 'True'
+
+# Requests and tokens per minute allowed per model (see stories/rate_limit.py),
+# shared by every process through the Redis at OPENAI_RATE_LIMIT_URL. Leave the
+# URL empty to limit each process on its own (development). Models without an
+# entry of their own get the 'default' limits.
+OPENAI_RATE_LIMITS = {
+    CHAPTER_GENERATION_MODEL: {
+        'rpm': int(os.getenv('CHAPTER_GENERATION_RPM', '500')),
+        'tpm': int(os.getenv('CHAPTER_GENERATION_TPM', '30000')),
+    },
+    'default': {
+        'rpm': int(os.getenv('OPENAI_DEFAULT_RPM', '500')),
+        'tpm': int(os.getenv('OPENAI_DEFAULT_TPM', '30000')),
+    },
+}
+OPENAI_RATE_LIMIT_URL = os.getenv('OPENAI_RATE_LIMIT_URL', '')
+
 # Stripe API Keys
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
@@ -218,6 +246,19 @@ META_IMAGE_URL = f"{SITE_PROTOCOL}://{SITE_DOMAIN}/static/images/plotvote-og-ima
 # END SEO CONFIGURATION
 # ============================================================================
 
+# Cache shared by the web and Celery processes (streamed chapter text, vote
+# tally snapshots, generation locks). Without CACHE_URL every process has its
+# own in-memory cache: fine for tests, but Celery workers refuse to start with
+# it (stories.E001, also reported by `manage.py check --deploy`).
+CACHE_URL = os.getenv('CACHE_URL', '')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
@@ -225,3 +266,51 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+
+# Chapter generation runs for minutes: acknowledge a message only once its task
+# has finished (tasks are idempotent), so a worker that dies mid-task hands it
+# back, and reserve one message per worker process at a time, so queued work is
+# not stuck behind a long generation while other processes are idle
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Unacknowledged (and delayed retry) messages are redelivered after this long
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 60 * 60}
+
+# Celery Beat (periodic tasks) - run with: celery -A plotvote beat
+CELERY_BEAT_SCHEDULE = {
+    'refresh-story-rankings': {
+        'task': 'stories.tasks.refresh_story_rankings',
+        'schedule': 60 * 10,  # every 10 minutes
+    },
+    'flush-engagement-events': {
+        'task': 'users.tasks.flush_engagement_events',
+        'schedule': 5.0,  # every 5 seconds
+    },
+    'flush-vote-ledger': {
+        'task': 'stories.tasks.flush_vote_ledger',
+        'schedule': 10.0,  # every 10 seconds
+    },
+    'relay-outbox': {
+        'task': 'stories.tasks.relay_outbox',
+        'schedule': 5.0,  # every 5 seconds
+    },
+    'close-expired-voting-rounds': {
+        'task': 'stories.tasks.close_expired_voting_rounds',
+        'schedule': 60.0,  # every minute
+    },
+    'reap-stale-generation-jobs': {
+        'task': 'stories.tasks.reap_stale_generation_jobs',
+        'schedule': 60.0,  # every minute
+    },
+}
+
+# Chapter views and ad impressions are buffered here and written in batches by
+# users.tasks.flush_engagement_events. Leave empty to buffer in-process and
+# flush after each response (development).
+ENGAGEMENT_BUFFER_URL = os.getenv('ENGAGEMENT_BUFFER_URL', '')
+
+# Record votes in a Redis ledger (live tallies served from Redis, Vote rows
+# flushed by stories.tasks.flush_vote_ledger). Leave empty to write votes
+# straight to the database.
+VOTE_LEDGER_URL = os.getenv('VOTE_LEDGER_URL', '')
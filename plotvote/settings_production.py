@@ -104,3 +104,12 @@ CACHES = {
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/0'
 CELERY_RESULT_BACKEND = 'redis://127.0.0.1:6379/0'
+
+# Engagement event buffer (see users/engagement.py)
+ENGAGEMENT_BUFFER_URL = 'redis://127.0.0.1:6379/2'
+
+# Redis vote ledger (see stories/voting.py); votes go straight to the database unless set
+VOTE_LEDGER_URL = os.getenv('VOTE_LEDGER_URL', '')
+
+# OpenAI rate limit buckets shared by all processes (see stories/rate_limit.py)
+OPENAI_RATE_LIMIT_URL = 'redis://127.0.0.1:6379/2'
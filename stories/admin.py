@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Story, Chapter, Prompt, Vote, Comment, Feedback, SiteSettings
+from .models import Story, Chapter, Prompt, Vote, Comment, Feedback, SiteSettings, StoryRanking, OutboxMessage, GenerationJob, StoryArcSummary, ChapterDraft
 
 
 @admin.register(Story)
@@ -22,6 +22,18 @@ class StoryAdmin(admin.ModelAdmin):
     activate_story.short_description = 'Activate selected stories'
 
 
+@admin.register(StoryRanking)
+class StoryRankingAdmin(admin.ModelAdmin):
+    list_display = ['story', 'status', 'language', 'score', 'upvotes', 'subscribers', 'recent_reads', 'recent_chapters', 'computed_at']
+    list_filter = ['status', 'language']
+    search_fields = ['story__title']
+    readonly_fields = ['story', 'status', 'language', 'score', 'upvotes', 'subscribers', 'recent_reads', 'recent_chapters', 'computed_at']
+
+    def has_add_permission(self, request):
+        # Rankings are computed by the refresh_story_rankings task
+        return False
+
+
 @admin.register(Chapter)
 class ChapterAdmin(admin.ModelAdmin):
     list_display = ['story', 'chapter_number', 'title', 'word_count', 'status', 'published_at']
@@ -43,7 +55,7 @@ class VoteAdmin(admin.ModelAdmin):
     list_display = ['user', 'prompt', 'created_at']
     list_filter = ['created_at', 'prompt__story']
     search_fields = ['user__username', 'prompt__prompt_text']
-    readonly_fields = ['created_at']
+    readonly_fields = ['story', 'chapter_number', 'created_at']
 
 
 @admin.register(Comment)
@@ -91,3 +103,45 @@ class SiteSettingsAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         # Prevent deletion
         return False
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ['id', 'task_name', 'args', 'attempts', 'available_at', 'created_at', 'sent_at']
+    list_filter = ['task_name', 'sent_at']
+    readonly_fields = ['task_name', 'args', 'kwargs', 'dedupe_key', 'attempts', 'last_error', 'created_at', 'sent_at']
+
+    def has_add_permission(self, request):
+        # Messages are written by stories.outbox.enqueue
+        return False
+
+
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'story', 'chapter_number', 'status', 'attempts', 'worker', 'latency_ms', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'created_at']
+    search_fields = ['story__title', 'worker', 'task_id']
+    raw_id_fields = ['story', 'prompt', 'user', 'chapter']
+    readonly_fields = ['attempts', 'worker', 'task_id', 'error', 'credits_charged', 'prompt_tokens', 'cached_tokens',
+                       'completion_tokens', 'latency_ms', 'created_at', 'updated_at', 'started_at', 'finished_at']
+
+    def has_add_permission(self, request):
+        # Jobs are created when generation is queued
+        return False
+
+
+@admin.register(StoryArcSummary)
+class StoryArcSummaryAdmin(admin.ModelAdmin):
+    list_display = ['story', 'level', 'first_chapter', 'last_chapter', 'created_at']
+    list_filter = ['level']
+    search_fields = ['story__title', 'summary']
+    raw_id_fields = ['story']
+    readonly_fields = ['created_at']
+
+
+@admin.register(ChapterDraft)
+class ChapterDraftAdmin(admin.ModelAdmin):
+    list_display = ['story', 'chapter_number', 'locked_by', 'locked_until', 'drafted_at']
+    search_fields = ['story__title']
+    raw_id_fields = ['story']
+    readonly_fields = ['prompt_hash', 'draft', 'drafted_at']
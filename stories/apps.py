@@ -7,3 +7,4 @@ class StoriesConfig(AppConfig):
 
     def ready(self):
         import stories.signals  # noqa
+        import stories.checks  # noqa
@@ -0,0 +1,89 @@
+"""
+Cache helpers for PlotVote
+
+Cached pages are keyed by a version number that is bumped whenever the
+underlying data changes, so invalidation is a single cache write instead of
+hunting down every key that might be stale.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+# Rendered homepage sections live this long even without an invalidation
+HOMEPAGE_CACHE_TIMEOUT = 60 * 15
+
+
+def _version_key(name):
+    return f'cache_version:{name}'
+
+
+def get_cache_version(name):
+    """
+    Get the current version number for a cache namespace
+
+    A missing version (first use, or evicted) is seeded from the clock so it
+    can never collide with a version that was in use before the eviction.
+    """
+    key = _version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(name):
+    """Invalidate every entry in a cache namespace by moving to a new version"""
+    key = _version_key(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Version was never set or has been evicted
+        cache.set(key, int(time.time() * 1000), None)
+
+
+def bump_cache_version_on_commit(name):
+    """
+    Bump a cache version once the current transaction commits
+
+    Bumping earlier would let a concurrent request re-fill the new version
+    with data it read before the commit.
+    """
+    transaction.on_commit(lambda: bump_cache_version(name))
+
+
+def get_homepage_version():
+    return get_cache_version('homepage')
+
+
+def invalidate_homepage():
+    """Drop all cached homepage sections (for every language filter)"""
+    bump_cache_version_on_commit('homepage')
+
+
+# Rendered chapter bodies are keyed on the chapter's updated_at, so an edit
+# simply moves the chapter to a new key and the old one expires on its own
+CHAPTER_BODY_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_rendered_chapter_body(chapter):
+    """
+    Get a chapter's content rendered to HTML paragraphs
+
+    Args:
+        chapter: Published Chapter instance
+
+    Returns:
+        SafeString: Same output as the |linebreaks template filter
+    """
+    from django.utils.html import linebreaks
+    from django.utils.safestring import mark_safe
+
+    key = f'chapter_body:{chapter.id}:{chapter.updated_at.timestamp()}'
+    body = cache.get(key)
+    if body is None:
+        body = linebreaks(chapter.content, autoescape=True)
+        cache.set(key, body, CHAPTER_BODY_CACHE_TIMEOUT)
+    return mark_safe(body)
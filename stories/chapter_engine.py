@@ -0,0 +1,585 @@
+"""
+Chapter generation engine
+
+One prompt, one parser and one model call path for every chapter, whether
+it is streamed to a personal-story writer (stories.personal_generation),
+written up from a winning prompt by Celery (stories.tasks) or generated by
+the generate_chapter management command.
+
+The model is reached through a backend chosen by CHAPTER_GENERATION_BACKEND:
+
+- 'openai': the OpenAI API
+- 'openai-compatible': any server speaking the OpenAI chat API (vLLM,
+  Ollama, llama.cpp, ...) at CHAPTER_GENERATION_BASE_URL
+- 'fake': deterministic text generated in-process after
+  CHAPTER_GENERATION_FAKE_LATENCY seconds, for tests and offline load tests
+  of the whole generation pipeline
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+
+import openai
+from django.conf import settings
+from django.utils import timezone
+
+from plotvote.http_clients import get_openai_client
+from .models import Chapter, count_words, calculate_read_time
+from .context_budget import CONTEXT_TOKENS, count_tokens, fit_history, framework_sections
+from .rate_limit import RateLimited, throttle
+from .summaries import story_so_far
+
+
+logger = logging.getLogger(__name__)
+
+
+CHAPTER_MAX_TOKENS = 3000
+CHAPTER_TEMPERATURE = 0.8
+
+# Budget for the plain-text retry after structured output was cut off or
+# malformed; JSON escaping costs tokens, and CJK chapters run long
+CHAPTER_FALLBACK_MAX_TOKENS = 2 * CHAPTER_MAX_TOKENS
+
+# Structured output: title, body and recap in one schema-constrained JSON response
+CHAPTER_SCHEMA = {
+    'type': 'json_schema',
+    'json_schema': {
+        'name': 'chapter',
+        'strict': True,
+        'schema': {
+            'type': 'object',
+            'properties': {
+                'title': {'type': 'string', 'description': 'Chapter title'},
+                'content': {'type': 'string', 'description': 'Full chapter text'},
+                'summary': {'type': 'string', 'description': 'Recap of the chapter in at most 120 words'},
+            },
+            'required': ['title', 'content', 'summary'],
+            'additionalProperties': False,
+        },
+    },
+}
+
+
+class InvalidChapterOutput(ValueError):
+    """The model's structured output is cut off or is not a chapter object"""
+
+
+class OpenAIBackend:
+    """Chat completions on the OpenAI API"""
+
+    name = 'openai'
+
+    # Send prompt_cache_key so calls sharing a prefix are routed to the same cache
+    sends_cache_key = True
+
+    def __init__(self, model):
+        self.model = model
+
+    def _client(self):
+        if not settings.OPENAI_API_KEY:
+            raise ValueError('OpenAI API key not configured. Please add OPENAI_API_KEY to your .env file.')
+        return get_openai_client()
+
+    def _options(self, cache_key):
+        return {'prompt_cache_key': cache_key} if cache_key and self.sends_cache_key else {}
+
+    def _create(self, messages, max_tokens, **options):
+        """
+        Send a chat completion request within the model's shared rate limit
+
+        Raises:
+            RateLimited: No capacity soon enough, or the provider still answered 429 after retries
+        """
+        # Providers count max_tokens against the token limit up front, so reserve it too
+        throttle(self.model, sum(count_tokens(message['content']) for message in messages) + max_tokens)
+        try:
+            return self._client().chat.completions.create(
+                model=self.model, messages=messages, max_tokens=max_tokens, **options
+            )
+        except openai.RateLimitError as e:
+            try:
+                retry_after = float(e.response.headers.get('retry-after'))
+            except (TypeError, ValueError):
+                retry_after = None
+            raise RateLimited(f'{self.model} rate limited by the provider: {e}', retry_after=retry_after) from e
+
+    @staticmethod
+    def _usage(usage):
+        details = usage.prompt_tokens_details if usage else None
+        return {
+            'prompt_tokens': usage.prompt_tokens if usage else None,
+            'completion_tokens': usage.completion_tokens if usage else None,
+            'cached_tokens': details.cached_tokens if details else None,
+        }
+
+    def complete(self, messages, max_tokens=CHAPTER_MAX_TOKENS, temperature=CHAPTER_TEMPERATURE, cache_key=None,
+                 response_format=None):
+        """
+        Run a completion
+
+        Args:
+            cache_key: Optional key shared by calls with the same prompt prefix
+            response_format: Optional response format, e.g. CHAPTER_SCHEMA
+
+        Returns:
+            dict: {'text': str, 'finish_reason': str ('length' if cut off at max_tokens),
+                   'prompt_tokens', 'completion_tokens', 'cached_tokens': int or None}
+        """
+        options = self._options(cache_key)
+        if response_format:
+            options['response_format'] = response_format
+        response = self._create(messages, max_tokens, temperature=temperature, **options)
+        choice = response.choices[0]
+        return dict(self._usage(response.usage), text=choice.message.content or '', finish_reason=choice.finish_reason)
+
+    def stream(self, messages, max_tokens=CHAPTER_MAX_TOKENS, temperature=CHAPTER_TEMPERATURE, usage=None,
+               cache_key=None):
+        """
+        Run a completion, yielding text deltas as they arrive
+
+        Args:
+            usage: Optional dict, filled with prompt_tokens/completion_tokens/cached_tokens when the stream ends
+            cache_key: Optional key shared by calls with the same prompt prefix
+        """
+        stream = self._create(
+            messages,
+            max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={'include_usage': True},
+            **self._options(cache_key),
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage and usage is not None:
+                usage.update(self._usage(chunk.usage))
+
+
+class OpenAICompatibleBackend(OpenAIBackend):
+    """Chat completions on a self-hosted server that implements the OpenAI API"""
+
+    name = 'openai-compatible'
+
+    # Servers like vLLM cache prefixes on their own and may reject unknown parameters
+    sends_cache_key = False
+
+    def __init__(self, model, base_url, api_key=''):
+        super().__init__(model)
+        self.base_url = base_url
+        # Local servers usually ignore the key, but the client requires one
+        self.api_key = api_key or 'not-needed'
+
+    def _client(self):
+        return get_openai_client(base_url=self.base_url, api_key=self.api_key)
+
+
+class FakeBackend:
+    """
+    Deterministic in-process backend
+
+    The same messages always produce the same chapter, delivered over
+    `latency` seconds, so the pipeline around the model can be exercised
+    and load-tested without an API key or network access.
+    """
+
+    name = 'fake'
+
+    # Words per streamed chunk
+    CHUNK_WORDS = 8
+
+    def __init__(self, latency=0.0, words=300):
+        self.latency = latency
+        self.words = words
+
+    def _text(self, messages, max_tokens, response_format=None):
+        digest = hashlib.sha256(repr(messages).encode()).hexdigest()
+        count = min(self.words, max_tokens)
+        vocabulary = ['the', 'storm', 'gathered', 'over', 'a', 'quiet', 'harbour', 'while', 'lanterns',
+                      'flickered', 'and', 'old', 'friends', 'whispered', 'of', 'secrets', 'long', 'buried']
+        words = [vocabulary[int(digest[i % 64], 16) + i % 3] for i in range(count)]
+        paragraphs = [' '.join(words[i:i + 60]).capitalize() + '.' for i in range(0, len(words), 60)]
+        if response_format:
+            return json.dumps({
+                'title': f"Chapter {digest[:6]}",
+                'content': '\n\n'.join(paragraphs),
+                'summary': ' '.join(words[:30]).capitalize() + '.',
+            })
+        return f"TITLE: Chapter {digest[:6]}\nCONTENT:\n" + '\n\n'.join(paragraphs)
+
+    def _usage(self, messages, text):
+        return {
+            'prompt_tokens': sum(count_words(message['content']) for message in messages),
+            'completion_tokens': count_words(text),
+            'cached_tokens': 0,
+        }
+
+    def complete(self, messages, max_tokens=CHAPTER_MAX_TOKENS, temperature=CHAPTER_TEMPERATURE, cache_key=None,
+                 response_format=None):
+        text = self._text(messages, max_tokens, response_format)
+        if self.latency:
+            time.sleep(self.latency)
+        return dict(self._usage(messages, text), text=text, finish_reason='stop')
+
+    def stream(self, messages, max_tokens=CHAPTER_MAX_TOKENS, temperature=CHAPTER_TEMPERATURE, usage=None,
+               cache_key=None):
+        text = self._text(messages, max_tokens)
+        words = text.split(' ')
+        chunks = [' '.join(words[i:i + self.CHUNK_WORDS]) + ' ' for i in range(0, len(words), self.CHUNK_WORDS)]
+        chunks[-1] = chunks[-1].rstrip(' ')
+        for chunk in chunks:
+            if self.latency:
+                time.sleep(self.latency / len(chunks))
+            yield chunk
+        if usage is not None:
+            usage.update(self._usage(messages, text))
+
+
+_backend = None
+_backend_config = None
+_backend_lock = threading.Lock()
+
+
+def build_backend(name=None):
+    """
+    Create a backend from settings
+
+    Args:
+        name: Backend name (default: settings.CHAPTER_GENERATION_BACKEND)
+    """
+    name = name or getattr(settings, 'CHAPTER_GENERATION_BACKEND', 'openai')
+    model = getattr(settings, 'CHAPTER_GENERATION_MODEL', 'gpt-4o')
+    if name == 'openai':
+        return OpenAIBackend(model)
+    if name == 'openai-compatible':
+        return OpenAICompatibleBackend(
+            model,
+            settings.CHAPTER_GENERATION_BASE_URL,
+            getattr(settings, 'CHAPTER_GENERATION_API_KEY', ''),
+        )
+    if name == 'fake':
+        return FakeBackend(latency=getattr(settings, 'CHAPTER_GENERATION_FAKE_LATENCY', 0.0))
+    raise ValueError(f"Unknown chapter generation backend: {name!r}")
+
+
+def _backend_settings():
+    return tuple(getattr(settings, name, None) for name in (
+        'CHAPTER_GENERATION_BACKEND',
+        'CHAPTER_GENERATION_MODEL',
+        'CHAPTER_GENERATION_BASE_URL',
+        'CHAPTER_GENERATION_API_KEY',
+        'CHAPTER_GENERATION_FAKE_LATENCY',
+    ))
+
+
+def get_backend():
+    """Get the process-wide backend, rebuilt if the generation settings change"""
+    global _backend, _backend_config
+    config = _backend_settings()
+    if _backend is None or _backend_config != config:
+        with _backend_lock:
+            if _backend is None or _backend_config != config:
+                _backend = build_backend()
+                _backend_config = config
+    return _backend
+
+
+STRUCTURED_FORMAT = """Respond with a JSON object with these fields:
+- "title": the chapter title
+- "content": the full chapter text
+- "summary": a recap of the chapter in at most 120 words (key events, changes to characters, open threads)"""
+
+MARKER_FORMAT = """Format your response EXACTLY as follows:
+TITLE: [Your chapter title here]
+CONTENT:
+[Your chapter content here]"""
+
+
+def build_system_prompt(story, structured=False):
+    """
+    Instructions and story framework for every chapter of a story
+
+    Nothing in here depends on the chapter being written, so consecutive
+    chapters share it byte for byte as the leading block of their prompt and
+    providers can serve it from their prompt cache.
+
+    Args:
+        structured: Ask for a CHAPTER_SCHEMA JSON object instead of TITLE:/CONTENT: text
+    """
+    # Story framework (story bible), trimmed to its token budget
+    framework = story.get_story_framework_context(sections=framework_sections(story))
+
+    return f"""You are a creative fiction writer specializing in {story.get_genre_display()} stories.
+Your task is to write the next chapter of an ongoing story based on the context provided and the user's prompt.
+
+CRITICAL GUIDELINES:
+- Write in {story.get_language_display()} language
+- **MAINTAIN STRICT CONSISTENCY** with the Story Framework provided (characters, plot outline, world rules)
+- Reference characters by their established names and traits
+- Follow the story outline and planned story arc
+- Respect the world building rules (magic system, technology, setting, etc.)
+- Match the themes and tone specified in the framework
+- Aim for 800-1500 words
+- Create engaging, descriptive prose with vivid descriptions and dialogue
+- End with a hook that makes readers want to continue
+- If character details are provided, use them exactly as described
+
+{STRUCTURED_FORMAT if structured else MARKER_FORMAT}
+
+{"=" * 70}
+STORY FRAMEWORK (maintain consistency with these details)
+{"=" * 70}
+
+{framework}"""
+
+
+def prompt_cache_key(story):
+    """Key grouping a story's generation calls, which share the build_system_prompt() prefix"""
+    return f'story-{story.id}'
+
+
+def build_messages(story, prompt_text, chapter_number, structured=False):
+    """
+    Build the chat messages for generating a chapter
+
+    The story-wide system prompt comes first; everything that changes from
+    chapter to chapter follows in the user message, most volatile last.
+
+    Args:
+        story: Story model instance
+        prompt_text: What should happen in the chapter
+        chapter_number: Number of the chapter being written
+        structured: Ask for a CHAPTER_SCHEMA JSON object (see build_system_prompt)
+
+    Returns:
+        list: OpenAI chat messages
+    """
+    system_prompt = build_system_prompt(story, structured)
+
+    # Summaries of everything before the last few chapters, in what is left of the budget
+    so_far = story_so_far(story, chapter_number)
+    recaps, recent = fit_history(so_far['recaps'], so_far['recent'], CONTEXT_TOKENS - count_tokens(system_prompt))
+
+    context = ""
+    if recaps:
+        context += "=" * 70 + "\n"
+        context += "STORY SO FAR\n"
+        context += "=" * 70 + "\n\n"
+
+        for label, summary in recaps:
+            context += f"{label}\n{summary}\n\n"
+
+    if recent:
+        context += "=" * 70 + "\n"
+        context += "RECENT CHAPTERS (for continuity; how each one ends)\n"
+        context += "=" * 70 + "\n\n"
+
+        for number, title, ending in recent:
+            context += f"Chapter {number}: {title}\n"
+            context += "-" * 50 + "\n"
+            context += ending
+            context += "\n\n"
+
+    if not recaps and not recent:
+        context += "This is the first chapter of the story.\n\n"
+
+    if story.planned_chapters:
+        progress = (chapter_number - 1) / story.planned_chapters * 100
+        context += f"STORY PROGRESS: Chapter {chapter_number} of {story.planned_chapters} ({progress:.0f}%)\n\n"
+
+    user_prompt = f"""{context}Direction for chapter {chapter_number}: {prompt_text}
+
+Please generate the chapter with a compelling title and engaging content."""
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def parse_chapter_response(content, chapter_number=None):
+    """
+    Split a TITLE:/CONTENT: formatted completion into title and content
+
+    Returns:
+        dict: {'title': str, 'content': str}
+    """
+    content = content.strip()
+    default_title = f"Chapter {chapter_number}" if chapter_number else "Untitled Chapter"
+    title = default_title
+    chapter_content = content
+
+    # Try to find TITLE: marker (case insensitive)
+    title_match = re.search(r'^TITLE:\s*(.+?)$', content, re.MULTILINE | re.IGNORECASE)
+    content_match = re.search(r'^CONTENT:\s*\n(.+)', content, re.MULTILINE | re.IGNORECASE | re.DOTALL)
+
+    if title_match:
+        title = title_match.group(1).strip().strip('"*').strip() or default_title
+
+    if content_match:
+        chapter_content = content_match.group(1).strip()
+    elif title_match:
+        # If we found title but not explicit CONTENT marker, take everything after title
+        chapter_content = content[title_match.end():].strip()
+        chapter_content = re.sub(r'^CONTENT:\s*\n?', '', chapter_content, flags=re.IGNORECASE)
+
+    # If no markers found, try to extract first line as title
+    if not title_match and '\n\n' in content:
+        first, rest = content.split('\n\n', 1)
+        # If first line is short enough to be a title (less than 100 chars), use it
+        if len(first.strip()) < 100 and not first.strip().endswith('.'):
+            title = first.strip()
+            chapter_content = rest.strip()
+
+    return {
+        'title': title[:200],
+        'content': chapter_content
+    }
+
+
+def parse_structured_response(content, chapter_number=None):
+    """
+    Read a CHAPTER_SCHEMA JSON completion
+
+    Returns:
+        dict: {'title': str, 'content': str, 'summary': str}
+
+    Raises:
+        InvalidChapterOutput: The output is not a complete chapter object
+            (truncated JSON, or a model that ignored the format)
+    """
+    try:
+        data = json.loads(content)
+        title, body, summary = data['title'], data['content'], data.get('summary') or ''
+        if not (isinstance(title, str) and isinstance(body, str) and isinstance(summary, str)) or not body.strip():
+            raise ValueError('Missing or invalid chapter fields')
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidChapterOutput(f'Malformed structured output for chapter {chapter_number}: {e}') from e
+
+    default_title = f"Chapter {chapter_number}" if chapter_number else "Untitled Chapter"
+    return {
+        'title': (title.strip() or default_title)[:200],
+        'content': body.strip(),
+        'summary': summary.strip(),
+    }
+
+
+def finish_draft(text, chapter_number, usage, latency_ms, structured=False):
+    """
+    Turn completion text into a chapter draft
+
+    Args:
+        structured: The text is a CHAPTER_SCHEMA JSON object
+
+    Returns:
+        dict: {'title', 'content', 'summary', 'word_count', 'read_time_minutes',
+               'prompt_tokens', 'completion_tokens', 'cached_tokens', 'latency_ms'}
+    """
+    if structured:
+        draft = parse_structured_response(text, chapter_number)
+    else:
+        draft = dict(parse_chapter_response(text, chapter_number), summary='')
+    word_count = count_words(draft['content'])
+    draft.update(
+        word_count=word_count,
+        read_time_minutes=calculate_read_time(word_count),
+        prompt_tokens=usage.get('prompt_tokens'),
+        completion_tokens=usage.get('completion_tokens'),
+        cached_tokens=usage.get('cached_tokens'),
+        latency_ms=latency_ms,
+    )
+    return draft
+
+
+def generate_chapter(story, prompt_text, chapter_number=None, backend=None, structured=None,
+                     max_tokens=CHAPTER_MAX_TOKENS):
+    """
+    Generate a chapter in one call
+
+    Structured output that is cut off at the token limit or is not a valid
+    chapter object is never published: the chapter is generated once more in
+    the TITLE:/CONTENT: text format with CHAPTER_FALLBACK_MAX_TOKENS, and its
+    summary is then written by the summarize_chapter task.
+
+    Args:
+        story: Story model instance
+        prompt_text: What should happen in the chapter
+        chapter_number: Chapter being written (default: the story's next chapter)
+        backend: Backend to use (default: get_backend())
+        structured: Get title, content and summary as one JSON object
+            (default: settings.CHAPTER_GENERATION_STRUCTURED_OUTPUT)
+        max_tokens: Completion token limit
+
+    Returns:
+        dict: Chapter draft (see finish_draft)
+
+    Raises:
+        Exception: Whatever the backend raises; nothing is saved
+    """
+    chapter_number = chapter_number or story.current_chapter_number
+    backend = backend or get_backend()
+    if structured is None:
+        structured = getattr(settings, 'CHAPTER_GENERATION_STRUCTURED_OUTPUT', True)
+
+    started = time.monotonic()
+    result = backend.complete(
+        build_messages(story, prompt_text, chapter_number, structured),
+        max_tokens=max_tokens,
+        cache_key=prompt_cache_key(story),
+        response_format=CHAPTER_SCHEMA if structured else None,
+    )
+    latency_ms = int((time.monotonic() - started) * 1000)
+    if not structured:
+        return finish_draft(result['text'], chapter_number, result, latency_ms)
+
+    try:
+        # A JSON object cut off at max_tokens is never a whole chapter, even if it happens to parse
+        if result.get('finish_reason') == 'length':
+            raise InvalidChapterOutput(f'Structured output for chapter {chapter_number} was cut off at the token limit')
+        return finish_draft(result['text'], chapter_number, result, latency_ms, structured)
+    except InvalidChapterOutput as e:
+        logger.warning(f"{e}; generating it again as plain text")
+    return generate_chapter(story, prompt_text, chapter_number, backend=backend, structured=False,
+                            max_tokens=CHAPTER_FALLBACK_MAX_TOKENS)
+
+
+def save_draft(story, chapter_number, draft, prompt=None):
+    """
+    Publish a chapter draft
+
+    Returns:
+        Chapter: The saved chapter
+    """
+    return Chapter.objects.create(
+        story=story,
+        chapter_number=chapter_number,
+        title=draft['title'],
+        content=draft['content'],
+        summary=draft.get('summary', ''),
+        prompt_used=prompt,
+        status='published',
+        published_at=timezone.now()
+    )
+
+
+def stream_chapter(story, prompt_text, chapter_number=None, usage=None, backend=None):
+    """
+    Generate a chapter, yielding the raw completion text as the model writes it
+
+    Streams use the TITLE:/CONTENT: format rather than JSON, so the partial
+    text can be shown to the reader as it arrives. Pass the joined text to
+    finish_draft() once the stream ends.
+
+    Args:
+        usage: Optional dict, filled with prompt_tokens/completion_tokens/cached_tokens when the stream ends
+
+    Yields:
+        str: Text deltas
+    """
+    chapter_number = chapter_number or story.current_chapter_number
+    backend = backend or get_backend()
+    yield from backend.stream(build_messages(story, prompt_text, chapter_number), usage=usage,
+                              cache_key=prompt_cache_key(story))
@@ -0,0 +1,36 @@
+"""
+System checks for the stories app
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+# Cache backends whose contents other processes can't see
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def shared_cache_errors():
+    """Errors if the default cache is not shared between processes"""
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            f'The default cache ({backend}) is not shared between processes.',
+            hint='Set CACHE_URL (or CACHES) to a Redis cache used by both the web and Celery processes.',
+            id='stories.E001',
+        )]
+    return []
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The default cache must be shared between web and Celery processes
+
+    Streamed chapter text, vote tally snapshots and generation locks are
+    handed between processes through it. Celery workers run this check when
+    they start (see plotvote.celery) and refuse to start if it fails.
+    """
+    return shared_cache_errors()
@@ -0,0 +1,227 @@
+"""
+Token budgets for chapter generation prompts
+
+Context used to be cut by characters, and 2,000 characters is roughly 500
+tokens of English but 2,000 of Chinese, Japanese or Korean, while the story
+bible was not limited at all. Prompt sections are now measured in tokens and
+trimmed to a fixed budget, given out in priority order:
+
+1. the story framework (FRAMEWORK_TOKENS, each section at most
+   FRAMEWORK_SECTION_TOKENS until every section has had its share)
+2. the endings of the most recent chapters
+3. summaries of everything before them
+
+Tokens are counted with tiktoken when it is installed and its encoding can
+be loaded (the first load downloads it), and estimated otherwise (one token
+per CJK character, four characters per token for other scripts), which errs
+on the side of shorter prompts.
+
+The trimmed framework block only depends on the story bible, so it is
+rendered once per story version and cached.
+"""
+import hashlib
+import logging
+import re
+
+from django.core.cache import cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# Whole generation context (framework, summaries and recent chapters)
+CONTEXT_TOKENS = 6000
+
+# Story bible as a whole, and each of its sections while others still need room
+FRAMEWORK_TOKENS = 2500
+FRAMEWORK_SECTION_TOKENS = 800
+
+# Each recent chapter's ending is trimmed to this before the section budgets apply
+RECENT_CHAPTER_TOKENS = 600
+
+# Framework sections in the order they are given tokens
+FRAMEWORK_PRIORITY = ['premise', 'characters', 'outline', 'world_building', 'themes', 'writing_style']
+
+FRAMEWORK_CACHE_TIMEOUT = 60 * 60 * 24
+
+TIKTOKEN_ENCODING = 'o200k_base'
+
+# Han, kana, Hangul and full-width forms: about one token per character
+_WIDE_CHARS = re.compile(r'[\u1100-\u11ff\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """tiktoken encoding, or None to estimate; a failed load is not retried by this process"""
+    global _encoding, _encoding_failed
+    if _encoding is None and tiktoken is not None and not _encoding_failed:
+        try:
+            _encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+        except Exception:
+            _encoding_failed = True
+            logger.exception("Could not load tiktoken encoding %s, estimating token counts", TIKTOKEN_ENCODING)
+    return _encoding
+
+
+def _char_cost(char):
+    return 1.0 if _WIDE_CHARS.match(char) else 0.25
+
+
+def count_tokens(text):
+    """
+    Number of tokens the model will see for `text`
+
+    Args:
+        text: Any string
+
+    Returns:
+        int: Exact count with tiktoken, otherwise an estimate
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + -(-(len(text) - wide) // 4)
+
+
+def truncate_tokens(text, max_tokens, keep='start'):
+    """
+    Trim text to at most `max_tokens` tokens
+
+    Args:
+        text: Text to trim
+        max_tokens: Token limit
+        keep: 'start' keeps the beginning, 'end' keeps the ending
+
+    Returns:
+        str: The text, with '...' marking where it was cut
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 1:
+        return ''
+
+    # Leave a token for the ellipsis
+    limit = max_tokens - 1
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        kept = encoding.decode(tokens[:limit] if keep == 'start' else tokens[-limit:])
+    else:
+        chars = text if keep == 'start' else reversed(text)
+        cost = 0.0
+        length = 0
+        for char in chars:
+            cost += _char_cost(char)
+            if cost > limit:
+                break
+            length += 1
+        kept = text[:length] if keep == 'start' else text[len(text) - length:]
+
+    return kept.rstrip() + '...' if keep == 'start' else '...' + kept.lstrip()
+
+
+def allocate(budget, requests):
+    """
+    Share a token budget between sections in priority order
+
+    Every section first gets up to its cap; tokens left over then go to
+    sections that wanted more, highest priority first.
+
+    Args:
+        budget: Tokens available
+        requests: [(name, tokens wanted, cap)] highest priority first
+
+    Returns:
+        dict: {name: tokens granted}
+    """
+    granted = {}
+    remaining = budget
+    for name, wanted, cap in requests:
+        granted[name] = min(wanted, cap, remaining)
+        remaining -= granted[name]
+    for name, wanted, cap in requests:
+        extra = min(wanted - granted[name], remaining)
+        granted[name] += extra
+        remaining -= extra
+    return granted
+
+
+def _framework_key(story):
+    sections = story.get_framework_sections()
+    digest = hashlib.sha1(repr((story.title, story.genre, story.language, sections)).encode()).hexdigest()
+    return f'story_framework:{story.id}:{digest}:{FRAMEWORK_TOKENS}'
+
+
+def framework_sections(story):
+    """
+    The story bible's sections trimmed to FRAMEWORK_TOKENS
+
+    Cached per story version: the key changes whenever any section does.
+
+    Returns:
+        dict: {section key: text}
+    """
+    key = _framework_key(story)
+    sections = cache.get(key)
+    if sections is None:
+        texts = {section: text for section, heading, text in story.get_framework_sections()}
+        sizes = {section: count_tokens(text) for section, text in texts.items()}
+        granted = allocate(FRAMEWORK_TOKENS, [
+            (section, sizes[section], FRAMEWORK_SECTION_TOKENS)
+            for section in FRAMEWORK_PRIORITY if section in texts
+        ])
+        sections = {section: truncate_tokens(text, granted[section]) for section, text in texts.items()}
+        cache.set(key, sections, FRAMEWORK_CACHE_TIMEOUT)
+    return sections
+
+
+def fit_history(recaps, recent, budget):
+    """
+    Trim chapter history to a token budget
+
+    Recent chapter endings are kept first, trimmed from the front; summaries
+    get what is left, dropping the oldest first.
+
+    Args:
+        recaps: [(label, summary)] oldest first
+        recent: [(chapter_number, title, ending)] oldest first
+        budget: Tokens available
+
+    Returns:
+        tuple: (recaps, recent) in the same shapes
+    """
+    endings = [truncate_tokens(ending, RECENT_CHAPTER_TOKENS, keep='end') for number, title, ending in recent]
+    recap_sizes = [count_tokens(label) + count_tokens(summary) for label, summary in recaps]
+    granted = allocate(budget, [
+        ('recent', sum(count_tokens(ending) for ending in endings), budget),
+        ('recaps', sum(recap_sizes), budget),
+    ])
+
+    # Chapters share the recent budget evenly, short endings passing on what they do not use
+    share = granted['recent'] // max(len(recent), 1)
+    shares = allocate(granted['recent'], [(i, count_tokens(ending), share) for i, ending in enumerate(endings)])
+    fitted_recent = [
+        (number, title, truncate_tokens(ending, shares[i], keep='end'))
+        for i, ((number, title, _), ending) in enumerate(zip(recent, endings))
+    ]
+
+    fitted_recaps = []
+    remaining = granted['recaps']
+    for recap, size in zip(reversed(recaps), reversed(recap_sizes)):
+        if size > remaining:
+            break
+        fitted_recaps.append(recap)
+        remaining -= size
+    fitted_recaps.reverse()
+
+    return fitted_recaps, fitted_recent
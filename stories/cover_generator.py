@@ -1,13 +1,14 @@
 """
 Cover image generation using OpenAI DALL-E 3
 """
-from openai import OpenAI
 from django.conf import settings
-import requests
+import httpx
 from django.core.files.base import ContentFile
 import logging
 import re
 
+from plotvote.http_clients import get_http_client, get_openai_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -182,8 +183,8 @@ def generate_story_cover(title, description, genre, characters='', world_buildin
         logger.error("OPENAI_API_KEY not configured in settings")
         return False, "OpenAI API key not configured. Please contact support."
 
-    # Initialize OpenAI client
-    client = OpenAI(api_key=api_key)
+    # Shared, connection-pooled OpenAI client
+    client = get_openai_client()
 
     # Try with full detailed prompt first
     try:
@@ -254,7 +255,7 @@ def download_and_save_cover(story, image_url):
     """
     try:
         # Download the image
-        response = requests.get(image_url, timeout=30)
+        response = get_http_client('download').get(image_url)
         if response.status_code != 200:
             return False, f"Failed to download image: HTTP {response.status_code}"
 
@@ -269,7 +270,7 @@ def download_and_save_cover(story, image_url):
         logger.info(f"Successfully saved cover image for story: {story.slug}")
         return True, "Cover image saved successfully"
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error("Timeout downloading cover image")
         return False, "Timeout downloading image. Please try again."
     except Exception as e:
@@ -0,0 +1,126 @@
+"""
+Queueing and supervision of chapter generation jobs
+
+Every chapter generation is tracked by a GenerationJob row. Winning-prompt
+jobs are created here together with their outbox message, personal jobs by
+stories.personal_generation. Workers move jobs through their states, and
+reap_stale_jobs (run every minute by stories.tasks.reap_stale_generation_jobs)
+deals with jobs whose worker died or whose message was lost.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import GenerationJob
+
+
+logger = logging.getLogger(__name__)
+
+# A running job that has not finished after this long is presumed dead
+RUNNING_TIMEOUT = timedelta(minutes=15)
+
+# A queued or retrying job that no worker has picked up after this long is re-sent
+QUEUED_TIMEOUT = timedelta(minutes=10)
+
+# Prompt jobs are given up after this many attempts
+MAX_ATTEMPTS = 3
+
+
+def queue_prompt_generation(prompt):
+    """
+    Queue generation of a winning prompt's chapter, unless it is already queued
+
+    Call inside the transaction that makes the prompt a winner: the job and
+    its outbox message are only committed with it.
+
+    Returns:
+        GenerationJob or None: The new job, or None if one is already in progress
+    """
+    from .outbox import enqueue
+    from .tasks import generate_chapter_from_prompt
+
+    with transaction.atomic():
+        if GenerationJob.objects.filter(prompt=prompt, status__in=GenerationJob.ACTIVE_STATUSES).exists():
+            return None
+        job = GenerationJob.objects.create(
+            kind='prompt',
+            story_id=prompt.story_id,
+            chapter_number=prompt.chapter_number,
+            prompt=prompt,
+        )
+        if not enqueue(generate_chapter_from_prompt, args=[prompt.id], kwargs={'job_id': job.id},
+                       dedupe_key=f'generate-chapter:{prompt.id}'):
+            transaction.set_rollback(True)
+            return None
+    return job
+
+
+def stale_jobs(now=None):
+    """Jobs that should have made progress by now (one range scan per status on the stale-job index)"""
+    now = now or timezone.now()
+    return GenerationJob.objects.filter(
+        Q(status=GenerationJob.RUNNING, updated_at__lt=now - RUNNING_TIMEOUT)
+        | Q(status__in=[GenerationJob.QUEUED, GenerationJob.RETRYING], updated_at__lt=now - QUEUED_TIMEOUT)
+    )
+
+
+def refund_job(job, amount):
+    """
+    Give back the credits a failed personal job charged
+
+    Only call after winning the transition to FAILED, so a job is refunded once.
+    """
+    from users.models import CreditTransaction
+
+    profile = job.user.profile
+    profile.add_credits(amount, source='earned')
+    CreditTransaction.objects.create(
+        user=job.user,
+        amount=amount,
+        transaction_type='refund',
+        description=f'Refund for failed chapter generation: {job.error[:100]}',
+        story=job.story,
+        balance_after=profile.credits
+    )
+
+
+def reap_stale_jobs(now=None):
+    """
+    Re-queue or fail jobs that stopped making progress
+
+    Prompt jobs are re-sent until they reach MAX_ATTEMPTS. Personal jobs are
+    failed straight away, since the writer is waiting on them, and refunded.
+
+    Returns:
+        dict: {'requeued': int, 'failed': int}
+    """
+    from .outbox import enqueue
+    from .tasks import generate_chapter_from_prompt
+
+    requeued = failed = 0
+    for job in stale_jobs(now).select_related('user__profile', 'story'):
+        if job.kind == 'prompt' and job.prompt_id and job.attempts < MAX_ATTEMPTS:
+            with transaction.atomic():
+                stalled_in = job.status
+                if job.transition(GenerationJob.RETRYING, from_status=stalled_in, error=f'Stalled in {stalled_in}; re-queued'):
+                    # A message still waiting in the outbox keeps its place
+                    enqueue(generate_chapter_from_prompt, args=[job.prompt_id], kwargs={'job_id': job.id},
+                            dedupe_key=f'generate-chapter:{job.prompt_id}')
+                    requeued += 1
+            continue
+
+        charged = job.credits_charged
+        with transaction.atomic():
+            if not job.transition(GenerationJob.FAILED, from_status=job.status, credits_charged=0,
+                                  error=f'Stalled in {job.status} after {job.attempts} attempt(s)'):
+                continue
+            if charged and job.user:
+                refund_job(job, charged)
+            failed += 1
+
+    if requeued or failed:
+        logger.warning(f"Reaped stale generation jobs: {requeued} re-queued, {failed} failed")
+    return {'requeued': requeued, 'failed': failed}
@@ -0,0 +1,133 @@
+"""
+One generation per chapter
+
+A chapter can be asked for more than once at the same time: a Celery message
+delivered twice, a retried task, or an admin running the generate_chapter
+command while the worker is on it. Without coordination each caller pays for
+its own completion and all but one then fail on the (story, chapter_number)
+unique constraint.
+
+generate_chapter_once() takes a lock on the chapter's ChapterDraft row, shared
+by every process through the database. The caller holding it generates the
+draft and stores it on the row with a hash of its prompt; callers asking for
+the same chapter from the same prompt reuse it instead of calling the model.
+Nobody waits for the lock: a caller that finds it taken gets
+GenerationInProgress and comes back later (Celery tasks retry).
+save_draft_once() then lets whoever publishes second pick up the existing
+chapter.
+"""
+import hashlib
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .chapter_engine import generate_chapter, save_draft
+from .models import Chapter, ChapterDraft
+
+
+# Longer than a generation call may take; a crashed holder's lock is free after this
+LOCK_TIMEOUT = timedelta(minutes=10)
+
+# Generated drafts are reused this long by callers arriving late or retrying
+RESULT_TIMEOUT = timedelta(hours=1)
+
+# A caller that finds the lock taken is told to come back after at most this long (seconds)
+RETRY_INTERVAL = 30
+
+
+class GenerationInProgress(Exception):
+    """Another caller is generating the chapter; try again after retry_after seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _prompt_hash(prompt_text):
+    return hashlib.sha256(prompt_text.encode()).hexdigest()
+
+
+def forget_draft(story_id, chapter_number):
+    """Drop a chapter's stored draft, so it is generated afresh next time"""
+    ChapterDraft.objects.filter(story_id=story_id, chapter_number=chapter_number).update(
+        draft=None, prompt_hash='', drafted_at=None
+    )
+
+
+def _claim(story, chapter_number, prompt_hash, token):
+    """
+    Take the chapter's lock, unless a draft for this prompt is already stored
+
+    Returns:
+        dict or None: The stored draft, or None once the lock is ours
+
+    Raises:
+        GenerationInProgress: Someone else holds the lock
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ChapterDraft.objects.get_or_create(story=story, chapter_number=chapter_number)
+        record = ChapterDraft.objects.select_for_update().get(story=story, chapter_number=chapter_number)
+
+        if record.draft is not None and record.prompt_hash == prompt_hash and record.drafted_at > now - RESULT_TIMEOUT:
+            return record.draft
+        if record.locked_by and record.locked_until > now:
+            retry_after = min(RETRY_INTERVAL, (record.locked_until - now).total_seconds())
+            raise GenerationInProgress(
+                f'Chapter {chapter_number} of story {story.id} is being generated', retry_after=retry_after
+            )
+
+        record.locked_by = token
+        record.locked_until = now + LOCK_TIMEOUT
+        record.save(update_fields=['locked_by', 'locked_until'])
+    return None
+
+
+def generate_chapter_once(story, prompt_text, chapter_number, backend=None):
+    """
+    Generate a chapter unless another caller already is, or already has from the same prompt
+
+    Args:
+        story: Story model instance
+        prompt_text: What should happen in the chapter
+        chapter_number: Chapter being written
+        backend: Backend to use (default: get_backend())
+
+    Returns:
+        tuple: (draft, reused) - reused is True when the draft came from another caller
+
+    Raises:
+        GenerationInProgress: Another caller is generating the chapter right now
+        Exception: Whatever the backend raises; the lock is released for the next caller
+    """
+    prompt_hash = _prompt_hash(prompt_text)
+    token = uuid.uuid4().hex
+    draft = _claim(story, chapter_number, prompt_hash, token)
+    if draft is not None:
+        return draft, True
+
+    mine = ChapterDraft.objects.filter(story=story, chapter_number=chapter_number, locked_by=token)
+    try:
+        draft = generate_chapter(story, prompt_text, chapter_number, backend=backend)
+    except BaseException:
+        mine.update(locked_by='', locked_until=None)
+        raise
+    # Not stored if the lock expired and someone else took it meanwhile
+    mine.update(draft=draft, prompt_hash=prompt_hash, drafted_at=timezone.now(), locked_by='', locked_until=None)
+    return draft, False
+
+
+def save_draft_once(story, chapter_number, draft, prompt=None):
+    """
+    Publish a chapter draft unless the chapter already exists
+
+    Returns:
+        tuple: (chapter, created) - the existing chapter if another caller published first
+    """
+    try:
+        with transaction.atomic():
+            return save_draft(story, chapter_number, draft, prompt=prompt), True
+    except IntegrityError:
+        return Chapter.objects.get(story=story, chapter_number=chapter_number), False
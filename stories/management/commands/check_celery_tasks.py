@@ -1,16 +1,15 @@
 """
-Management command to check Celery task status for chapter generation
+Management command to check chapter generation status from GenerationJob records
 """
 from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
 from django.utils import timezone
-from stories.models import Prompt, Chapter
-from celery.result import AsyncResult
-from plotvote.celery import app
-import redis
+from stories.generation_jobs import stale_jobs
+from stories.models import GenerationJob, Prompt, Chapter
 
 
 class Command(BaseCommand):
-    help = 'Check Celery task status and verify chapter generation for winning prompts'
+    help = 'Check chapter generation jobs and verify chapters for winning prompts'
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -29,31 +28,37 @@ class Command(BaseCommand):
         prompt_id = options['prompt_id']
         show_all = options['show_all']
 
-        self.stdout.write(self.style.SUCCESS('\n=== Celery Task Status Checker ===\n'))
+        self.stdout.write(self.style.SUCCESS('\n=== Chapter Generation Status ===\n'))
 
-        # Check Redis connection
-        try:
-            redis_client = redis.Redis.from_url('redis://localhost:6379/0')
-            redis_client.ping()
-            self.stdout.write(self.style.SUCCESS('✓ Redis connection: OK'))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'✗ Redis connection: FAILED - {e}'))
-            self.stdout.write(self.style.WARNING('\nMake sure Redis is running: redis-server'))
-            return
-
-        # Check Celery worker
-        try:
-            inspector = app.control.inspect()
-            active_workers = inspector.active()
-            if active_workers:
-                self.stdout.write(self.style.SUCCESS(f'✓ Celery workers: {len(active_workers)} active'))
-                for worker_name in active_workers.keys():
-                    self.stdout.write(f'  - {worker_name}')
-            else:
-                self.stdout.write(self.style.ERROR('✗ Celery workers: No active workers found'))
-                self.stdout.write(self.style.WARNING('\nStart Celery worker: celery -A plotvote worker --loglevel=info'))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'✗ Celery worker check failed: {e}'))
+        # Job counts for the last day (status, updated_at index)
+        since = timezone.now() - timezone.timedelta(hours=24)
+        counts = dict(
+            GenerationJob.objects.filter(updated_at__gte=since)
+            .order_by().values_list('status').annotate(n=Count('id'))
+        )
+        summary = ', '.join(f'{label}: {counts.get(status, 0)}' for status, label in GenerationJob.STATUS_CHOICES)
+        self.stdout.write(f'Jobs updated in the last 24h - {summary}')
+
+        # Share of prompt tokens served from the provider's prompt cache
+        tokens = GenerationJob.objects.filter(
+            updated_at__gte=since, status=GenerationJob.SUCCEEDED, cached_tokens__isnull=False
+        ).aggregate(prompt=Sum('prompt_tokens'), cached=Sum('cached_tokens'))
+        if tokens['prompt']:
+            self.stdout.write(
+                f'Prompt cache: {tokens["cached"]} of {tokens["prompt"]} prompt tokens cached'
+                f' ({tokens["cached"] / tokens["prompt"]:.0%})'
+            )
+
+        stuck = list(stale_jobs().select_related('story'))
+        if stuck:
+            self.stdout.write(self.style.ERROR(f'✗ {len(stuck)} stuck job(s) (the reaper re-queues or fails these every minute):'))
+            for job in stuck:
+                self.stdout.write(
+                    f'  - Job {job.id}: {job.story.title} ch.{job.chapter_number} {job.status} since {job.updated_at}'
+                    f' (attempt {job.attempts}, worker {job.worker or "-"})'
+                )
+        else:
+            self.stdout.write(self.style.SUCCESS('✓ No stuck jobs'))
 
         self.stdout.write('')
 
@@ -84,6 +89,17 @@ class Command(BaseCommand):
             self.stdout.write(f'Created: {prompt.created_at}')
             self.stdout.write(f'Prompt: {prompt.prompt_text[:80]}...')
 
+            job = prompt.generation_jobs.order_by('-created_at').first()
+            if job:
+                self.stdout.write(f'Job: {job.id} {job.status} (attempts: {job.attempts}, worker: {job.worker or "-"})')
+                if job.latency_ms is not None:
+                    self.stdout.write(f'  Latency: {job.latency_ms} ms, tokens: {job.prompt_tokens} in'
+                                      f' ({job.cached_tokens or 0} cached) / {job.completion_tokens} out')
+                if job.error:
+                    self.stdout.write(self.style.WARNING(f'  Error: {job.error}'))
+            else:
+                self.stdout.write(self.style.WARNING('Job: none recorded'))
+
             # Check if chapter was generated
             chapter = Chapter.objects.filter(
                 story=prompt.story,
@@ -112,30 +128,12 @@ class Command(BaseCommand):
                     self.stdout.write(f'    Used prompt: {existing_chapter.prompt_used_id}')
                 else:
                     self.stdout.write(self.style.WARNING(
-                        '  Task may still be running or failed. Check Celery logs.'
+                        '  See the job status above; check Celery logs for details.'
                     ))
 
             self.stdout.write('-' * 60)
             self.stdout.write('')
 
-        # Show active tasks
-        try:
-            inspector = app.control.inspect()
-            active_tasks = inspector.active()
-
-            if active_tasks:
-                task_count = sum(len(tasks) for tasks in active_tasks.values())
-                if task_count > 0:
-                    self.stdout.write(self.style.SUCCESS(f'\nActive tasks: {task_count}'))
-                    for worker, tasks in active_tasks.items():
-                        for task in tasks:
-                            self.stdout.write(f'  Worker: {worker}')
-                            self.stdout.write(f'  Task: {task["name"]}')
-                            self.stdout.write(f'  Args: {task.get("args", [])}')
-                            self.stdout.write('')
-        except Exception as e:
-            self.stdout.write(self.style.WARNING(f'Could not check active tasks: {e}'))
-
         # Helpful tips
         self.stdout.write(self.style.SUCCESS('\n=== Helpful Commands ==='))
         self.stdout.write('Check Celery worker logs: celery -A plotvote worker --loglevel=info')
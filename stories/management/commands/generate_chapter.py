@@ -2,8 +2,9 @@
 Management command to generate a chapter from the winning prompt
 """
 from django.core.management.base import BaseCommand
+from stories.chapter_engine import build_backend
+from stories.generation_lock import GenerationInProgress, generate_chapter_once, save_draft_once
 from stories.models import Story, Prompt
-from stories.ai_service import generate_chapter_from_prompt
 
 
 class Command(BaseCommand):
@@ -27,6 +28,12 @@ class Command(BaseCommand):
             help='Specific prompt ID to use (default: highest voted)',
             default=None
         )
+        parser.add_argument(
+            '--backend',
+            choices=['openai', 'openai-compatible', 'fake'],
+            help='Generation backend (default: CHAPTER_GENERATION_BACKEND)',
+            default=None
+        )
 
     def handle(self, *args, **options):
         story_slug = options['story_slug']
@@ -71,13 +78,29 @@ class Command(BaseCommand):
 
         # Generate chapter
         try:
-            chapter = generate_chapter_from_prompt(prompt)
+            draft, reused = generate_chapter_once(story, prompt.prompt_text, prompt.chapter_number,
+                                                  backend=build_backend(options['backend']))
+            if reused:
+                self.stdout.write(self.style.WARNING('Chapter was already being generated; using that result'))
+            chapter, created = save_draft_once(story, prompt.chapter_number, draft, prompt=prompt)
+            if not created:
+                self.stdout.write(self.style.WARNING(f'Chapter {chapter.chapter_number} already exists; keeping it'))
+                return
+
+            # Mark the prompt as the winner; generation for it is skipped since the chapter exists
+            prompt.status = 'winner'
+            prompt.save()
 
             self.stdout.write(self.style.SUCCESS(f'\n✓ Chapter generated successfully!'))
             self.stdout.write(f'Title: {chapter.title}')
             self.stdout.write(f'Words: {chapter.word_count}')
             self.stdout.write(f'Reading time: {chapter.read_time_minutes} minutes')
+            self.stdout.write(f'Tokens: {draft["prompt_tokens"]} in ({draft["cached_tokens"] or 0} cached)'
+                              f' / {draft["completion_tokens"]} out in {draft["latency_ms"]} ms')
             self.stdout.write(f'\nView at: /story/{story.slug}/chapter/{chapter.chapter_number}/')
 
+        except GenerationInProgress as e:
+            self.stdout.write(self.style.WARNING(f'{e}; run the command again in {e.retry_after:.0f}s to use its result'))
+
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'\n✗ Error generating chapter: {e}'))
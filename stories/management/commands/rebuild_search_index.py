@@ -0,0 +1,18 @@
+"""
+Management command to rebuild the full-text search index
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from stories.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild search documents for all stories and published chapters'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding search index...')
+
+        with transaction.atomic():
+            count = rebuild_index()
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Indexed {count} document(s)'))
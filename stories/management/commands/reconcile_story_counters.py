@@ -0,0 +1,59 @@
+"""
+Management command to reconcile denormalized story counters with the source tables
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from stories.models import Story
+
+
+class Command(BaseCommand):
+    help = 'Recompute Story.total_chapters, subscriber_count, upvote_count and reader_count and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--story',
+            type=str,
+            help='Only reconcile the story with this slug',
+            default=None
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drifted stories without fixing them',
+        )
+
+    def handle(self, *args, **options):
+        story_slug = options['story']
+        dry_run = options['dry_run']
+
+        stories = Story.objects.all()
+        if story_slug:
+            stories = stories.filter(slug=story_slug)
+
+        fields = Story.COUNTER_FIELDS
+        expected = {f'expected_{field}': expr for field, expr in Story.counter_expressions().items()}
+
+        drifted = []
+        for row in stories.annotate(**expected).values('id', 'slug', *fields, *expected):
+            diffs = {
+                field: (row[field], row[f'expected_{field}'])
+                for field in fields
+                if row[field] != row[f'expected_{field}']
+            }
+            if diffs:
+                drifted.append(row['id'])
+                changes = ', '.join(f'{field}: {old} -> {new}' for field, (old, new) in diffs.items())
+                self.stdout.write(f'{row["slug"]}: {changes}')
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('✓ All story counters are in sync'))
+            return
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f'{len(drifted)} story/stories drifted (dry run, nothing changed)'))
+            return
+
+        with transaction.atomic():
+            Story.refresh_counters(drifted)
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Reconciled {len(drifted)} story/stories'))
@@ -0,0 +1,50 @@
+"""
+Management command to reconcile cached prompt vote counts with the Vote table
+"""
+from django.core.management.base import BaseCommand
+from stories.models import Prompt
+from stories.voting import reconcile_vote_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute Prompt.vote_count from the Vote table and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--story',
+            type=str,
+            help='Only reconcile prompts of the story with this slug',
+            default=None
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drifted prompts without fixing them',
+        )
+
+    def handle(self, *args, **options):
+        story_slug = options['story']
+        dry_run = options['dry_run']
+
+        prompts = Prompt.objects.all()
+        if story_slug:
+            prompts = prompts.filter(story__slug=story_slug)
+
+        if dry_run:
+            drifted = [
+                (row['id'], row['vote_count'], row['actual'])
+                for row in prompts.annotate(actual=Prompt.vote_count_expression()).values('id', 'vote_count', 'actual')
+                if row['vote_count'] != row['actual']
+            ]
+        else:
+            drifted = reconcile_vote_counts(prompts)
+
+        for prompt_id, cached, actual in drifted:
+            self.stdout.write(f'prompt {prompt_id}: vote_count {cached} -> {actual}')
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('✓ All prompt vote counts are in sync'))
+        elif dry_run:
+            self.stdout.write(self.style.WARNING(f'{len(drifted)} prompt(s) drifted (dry run, nothing changed)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'✓ Reconciled {len(drifted)} prompt(s)'))
@@ -0,0 +1,26 @@
+"""
+Management command to write the summaries used as generation context
+"""
+from django.core.management.base import BaseCommand
+from stories.models import Chapter
+from stories.summaries import summarize_chapter
+
+
+class Command(BaseCommand):
+    help = 'Summarize published chapters that have no summary yet and roll them up into arcs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--story', help='Only summarize chapters of the story with this slug')
+
+    def handle(self, *args, **options):
+        chapters = Chapter.objects.filter(status='published', summary='').order_by('story_id', 'chapter_number')
+        if options['story']:
+            chapters = chapters.filter(story__slug=options['story'])
+
+        count = 0
+        for chapter in chapters.iterator():
+            self.stdout.write(f'Summarizing {chapter}...')
+            summarize_chapter(chapter)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Summarized {count} chapter(s)'))
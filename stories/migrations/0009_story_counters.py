@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:49
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    """Populate the new counter columns from the existing rows"""
+    Story = apps.get_model('stories', 'Story')
+    Chapter = apps.get_model('stories', 'Chapter')
+
+    def count_of(qs):
+        return Coalesce(
+            Subquery(qs.order_by().values('story').annotate(c=Count('*')).values('c')[:1]),
+            0,
+        )
+
+    Story.objects.update(
+        total_chapters=count_of(Chapter.objects.filter(story=OuterRef('pk'), status='published')),
+        subscriber_count=count_of(Story.subscribers.through.objects.filter(story=OuterRef('pk'))),
+        upvote_count=count_of(Story.upvoters.through.objects.filter(story=OuterRef('pk'))),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0008_sitesettings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='subscriber_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Cached number of subscribers'),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='total_chapters',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Cached number of published chapters'),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='upvote_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Cached number of upvotes'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
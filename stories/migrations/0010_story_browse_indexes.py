@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0009_story_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['story_type', 'status', '-is_featured', '-created_at', 'id'], name='story_browse_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['story_type', 'genre', '-is_featured', '-created_at', 'id'], name='story_browse_genre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['story_type', 'language', '-is_featured', '-created_at', 'id'], name='story_browse_language_idx'),
+        ),
+    ]
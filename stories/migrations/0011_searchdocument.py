@@ -0,0 +1,80 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+SQLITE_CREATE = [
+    # External-content FTS5 table over stories_searchdocument, kept in sync by triggers
+    """CREATE VIRTUAL TABLE stories_searchdocument_fts USING fts5(
+        title, body,
+        content='stories_searchdocument', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER stories_searchdocument_ai AFTER INSERT ON stories_searchdocument BEGIN
+        INSERT INTO stories_searchdocument_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    """CREATE TRIGGER stories_searchdocument_ad AFTER DELETE ON stories_searchdocument BEGIN
+        INSERT INTO stories_searchdocument_fts(stories_searchdocument_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    """CREATE TRIGGER stories_searchdocument_au AFTER UPDATE ON stories_searchdocument BEGIN
+        INSERT INTO stories_searchdocument_fts(stories_searchdocument_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO stories_searchdocument_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS stories_searchdocument_ai",
+    "DROP TRIGGER IF EXISTS stories_searchdocument_ad",
+    "DROP TRIGGER IF EXISTS stories_searchdocument_au",
+    "DROP TABLE IF EXISTS stories_searchdocument_fts",
+]
+
+# The ngram parser tokenizes CJK text (and everything else) into bigrams
+MYSQL_CREATE = [
+    "ALTER TABLE stories_searchdocument ADD FULLTEXT INDEX stories_search_title_body_ft (title, body) WITH PARSER ngram",
+    "ALTER TABLE stories_searchdocument ADD FULLTEXT INDEX stories_search_title_ft (title) WITH PARSER ngram",
+]
+
+MYSQL_DROP = [
+    "ALTER TABLE stories_searchdocument DROP INDEX stories_search_title_body_ft",
+    "ALTER TABLE stories_searchdocument DROP INDEX stories_search_title_ft",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+create_fulltext_index = _run({'sqlite': SQLITE_CREATE, 'mysql': MYSQL_CREATE})
+drop_fulltext_index = _run({'sqlite': SQLITE_DROP, 'mysql': MYSQL_DROP})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0010_story_browse_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=500)),
+                ('body', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('chapter', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='stories.chapter')),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_documents', to='stories.story')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['story', 'chapter'], name='stories_sea_story_i_7d4bf1_idx')],
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0011_searchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoryRanking',
+            fields=[
+                ('story', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='stories.story')),
+                ('status', models.CharField(max_length=20)),
+                ('language', models.CharField(max_length=5)),
+                ('score', models.FloatField(default=0, help_text='Time-decayed trending score')),
+                ('upvotes', models.PositiveIntegerField(default=0)),
+                ('subscribers', models.PositiveIntegerField(default=0)),
+                ('recent_reads', models.FloatField(default=0, help_text='Decay-weighted chapter reads')),
+                ('recent_chapters', models.FloatField(default=0, help_text='Decay-weighted chapter publishes')),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['-score'],
+                'indexes': [models.Index(fields=['status', '-score'], name='ranking_status_score_idx'), models.Index(fields=['status', 'language', '-score'], name='ranking_status_lang_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:02
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+
+def backfill_updated_at(apps, schema_editor):
+    """Existing chapters were last modified when they were published"""
+    Chapter = apps.get_model('stories', 'Chapter')
+    Chapter.objects.update(updated_at=Coalesce(F('published_at'), F('created_at')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0012_storyranking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, help_text='Last edit; drives ETags and the rendered-body cache'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
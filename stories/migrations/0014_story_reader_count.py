@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0013_chapter_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='reader_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Cached number of unique qualified readers'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_vote_rounds(apps, schema_editor):
+    """
+    Copy story/chapter_number from each vote's prompt, keep only the latest
+    vote per user per round, and recount every prompt
+    """
+    Vote = apps.get_model('stories', 'Vote')
+    Prompt = apps.get_model('stories', 'Prompt')
+
+    prompts = Prompt.objects.filter(pk=OuterRef('prompt_id'))
+    Vote.objects.update(
+        story_id=Subquery(prompts.values('story_id')[:1]),
+        chapter_number=Subquery(prompts.values('chapter_number')[:1]),
+    )
+
+    seen = set()
+    duplicates = []
+    for vote in Vote.objects.order_by('-created_at', '-id').values('id', 'story_id', 'chapter_number', 'user_id').iterator():
+        key = (vote['story_id'], vote['chapter_number'], vote['user_id'])
+        if key in seen:
+            duplicates.append(vote['id'])
+        else:
+            seen.add(key)
+    for start in range(0, len(duplicates), 500):
+        Vote.objects.filter(id__in=duplicates[start:start + 500]).delete()
+
+    Prompt.objects.update(vote_count=Coalesce(Subquery(
+        Vote.objects.filter(prompt=OuterRef('pk')).order_by().values('prompt')
+        .annotate(c=Count('*')).values('c')[:1]
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0014_story_reader_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='story',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='stories.story', help_text='Copied from prompt'),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='chapter_number',
+            field=models.PositiveIntegerField(null=True, help_text='Copied from prompt'),
+        ),
+        migrations.RunPython(backfill_vote_rounds, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='vote',
+            name='story',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='stories.story', help_text='Copied from prompt'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='chapter_number',
+            field=models.PositiveIntegerField(help_text='Copied from prompt'),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('story', 'chapter_number', 'user'), name='one_vote_per_round'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0015_vote_round'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prompt',
+            index=models.Index(fields=['status', 'voting_ends_at'], name='prompt_status_deadline_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0016_prompt_deadline_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_name', models.CharField(help_text='Registered Celery task name', max_length=200)),
+                ('args', models.JSONField(blank=True, default=list)),
+                ('kwargs', models.JSONField(blank=True, default=dict)),
+                ('dedupe_key', models.CharField(blank=True, help_text='Pending messages with the same key are only queued once', max_length=200, null=True, unique=True)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='Failed publish attempts')),
+                ('last_error', models.TextField(blank=True)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Not published before this time (retry backoff)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['sent_at', 'available_at'], name='outbox_pending_idx')],
+            },
+        ),
+    ]
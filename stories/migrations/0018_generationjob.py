@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0017_outboxmessage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('prompt', 'Winning prompt'), ('personal', 'Personal story')], max_length=20)),
+                ('chapter_number', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('retrying', 'Retrying'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='Times the job has started running')),
+                ('worker', models.CharField(blank=True, help_text='Celery worker that ran the last attempt', max_length=255)),
+                ('task_id', models.CharField(blank=True, max_length=255)),
+                ('error', models.TextField(blank=True)),
+                ('credits_charged', models.PositiveIntegerField(default=0, help_text='Credits deducted and not yet refunded')),
+                ('prompt_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('completion_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('latency_ms', models.PositiveIntegerField(blank=True, help_text='Model call duration', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Last state change; drives the stale-job reaper')),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('chapter', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='stories.chapter')),
+                ('prompt', models.ForeignKey(blank=True, help_text='Winning prompt being written up (prompt jobs)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generation_jobs', to='stories.prompt')),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to='stories.story')),
+                ('user', models.ForeignKey(blank=True, help_text='Who asked for the chapter (personal jobs)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generation_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='generation_job_stale_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0018_generationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='summary',
+            field=models.TextField(blank=True, help_text='Short recap used as context when generating later chapters'),
+        ),
+        migrations.CreateModel(
+            name='StoryArcSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveSmallIntegerField(help_text='1 = merged chapter summaries, 2 = merged level 1 arcs, ...')),
+                ('first_chapter', models.PositiveIntegerField()),
+                ('last_chapter', models.PositiveIntegerField()),
+                ('summary', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='arc_summaries', to='stories.story')),
+            ],
+            options={
+                'ordering': ['story', 'first_chapter', '-level'],
+                'constraints': [models.UniqueConstraint(fields=('story', 'level', 'first_chapter'), name='one_arc_per_span_start')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0019_chapter_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='cached_tokens',
+            field=models.PositiveIntegerField(blank=True, help_text='Prompt tokens the provider served from its prompt cache', null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0020_generation_job_cached_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChapterDraft',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chapter_number', models.PositiveIntegerField()),
+                ('locked_by', models.CharField(blank=True, help_text='Token of the caller generating the chapter', max_length=32)),
+                ('locked_until', models.DateTimeField(blank=True, help_text="A crashed holder's lock is free after this", null=True)),
+                ('prompt_hash', models.CharField(blank=True, help_text='SHA-256 of the prompt the draft was written from', max_length=64)),
+                ('draft', models.JSONField(blank=True, null=True)),
+                ('drafted_at', models.DateTimeField(blank=True, null=True)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='stories.story')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('story', 'chapter_number'), name='one_draft_per_chapter')],
+            },
+        ),
+    ]
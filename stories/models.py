@@ -2,8 +2,13 @@
 Database models for PlotVote stories, chapters, prompts, and votes
 """
 import re
-from django.db import models
+from django.apps import apps
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.text import slugify
 from django.urls import reverse
 
@@ -66,6 +71,9 @@ class Story(models.Model):
         ('paused', 'Paused'),
     ]
 
+    # Statuses that are publicly listed (browse pages, search)
+    PUBLIC_STATUSES = ['active', 'completed', 'pitch']
+
     LANGUAGE_CHOICES = [
         ('en', 'English'),
         ('zh', 'Chinese'),
@@ -108,12 +116,26 @@ class Story(models.Model):
     is_featured = models.BooleanField(default=False)
     votes_needed = models.PositiveIntegerField(default=10, help_text="Votes needed to activate story")
 
+    # Denormalized counters, kept in sync by stories.signals (see refresh_counters)
+    total_chapters = models.PositiveIntegerField(default=0, editable=False, help_text="Cached number of published chapters")
+    subscriber_count = models.PositiveIntegerField(default=0, editable=False, help_text="Cached number of subscribers")
+    upvote_count = models.PositiveIntegerField(default=0, editable=False, help_text="Cached number of upvotes")
+    reader_count = models.PositiveIntegerField(default=0, editable=False, help_text="Cached number of unique qualified readers")
+
+    COUNTER_FIELDS = ('total_chapters', 'subscriber_count', 'upvote_count', 'reader_count')
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = "Stories"
         ordering = ['-created_at']
+        indexes = [
+            # Browse pages: keyset pagination on (-is_featured, -created_at, id)
+            models.Index(fields=['story_type', 'status', '-is_featured', '-created_at', 'id'], name='story_browse_status_idx'),
+            models.Index(fields=['story_type', 'genre', '-is_featured', '-created_at', 'id'], name='story_browse_genre_idx'),
+            models.Index(fields=['story_type', 'language', '-is_featured', '-created_at', 'id'], name='story_browse_language_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -134,32 +156,84 @@ class Story(models.Model):
                 counter += 1
 
             self.slug = slug
+
+        # Never write counters back from a possibly stale in-memory instance;
+        # they are only changed through refresh_counters()
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.COUNTER_FIELDS
+            ]
         super().save(*args, **kwargs)
 
     def get_absolute_url(self):
         return reverse('stories:story_detail', kwargs={'slug': self.slug})
 
-    @property
-    def total_chapters(self):
-        return self.chapters.filter(status='published').count()
-
     @property
     def current_chapter_number(self):
         """Next chapter number to be written"""
         return self.total_chapters + 1
 
-    @property
-    def subscriber_count(self):
-        return self.subscribers.count()
+    @classmethod
+    def counter_expressions(cls, fields=None):
+        """
+        Subquery expressions computing the true value of each counter field
 
-    @property
-    def upvote_count(self):
-        return self.upvoters.count()
+        Used both to keep counters in sync and to reconcile drift.
+        """
+        fields = fields or cls.COUNTER_FIELDS
+        sources = {
+            'total_chapters': Chapter.objects.filter(story=OuterRef('pk'), status='published'),
+            'subscriber_count': cls.subscribers.through.objects.filter(story=OuterRef('pk')),
+            'upvote_count': cls.upvoters.through.objects.filter(story=OuterRef('pk')),
+            'reader_count': apps.get_model('users', 'StoryReader').objects.filter(story=OuterRef('pk')),
+        }
+        return {
+            field: Coalesce(
+                Subquery(
+                    sources[field].order_by().values('story').annotate(c=Count('*')).values('c')[:1]
+                ),
+                0,
+            )
+            for field in fields
+        }
+
+    @classmethod
+    def refresh_counters(cls, story_ids, fields=None):
+        """
+        Recompute cached counters for the given stories in a single UPDATE
+
+        Runs inside the caller's transaction, so counters commit (or roll back)
+        together with the chapter/subscriber/upvote change that triggered them.
+        """
+        if not story_ids:
+            return 0
+        return cls.objects.filter(pk__in=story_ids).update(**cls.counter_expressions(fields))
 
-    def get_story_framework_context(self):
+    def get_framework_sections(self):
+        """
+        The story bible as (key, heading, text) sections, in display order
+
+        Empty sections are left out.
+        """
+        sections = [
+            ('premise', 'STORY PREMISE', self.description),
+            ('characters', 'MAIN CHARACTERS', self.characters),
+            ('outline', 'STORY OUTLINE', self.story_outline),
+            ('world_building', 'WORLD BUILDING', self.world_building),
+            ('themes', 'THEMES & TONE', self.themes),
+            ('writing_style', 'WRITING STYLE', self.writing_style_notes),
+        ]
+        return [(key, heading, text) for key, heading, text in sections if text]
+
+    def get_story_framework_context(self, sections=None):
         """
         Generate formatted story framework for AI context
         This ensures AI maintains consistency across chapters
+
+        Args:
+            sections: Optional {key: text} overriding the section texts
+                (e.g. trimmed to a token budget)
         """
         context_parts = []
 
@@ -168,40 +242,17 @@ class Story(models.Model):
         context_parts.append(f"LANGUAGE: {self.get_language_display()}")
         context_parts.append("")
 
-        context_parts.append("STORY PREMISE:")
-        context_parts.append(self.description)
-        context_parts.append("")
-
-        if self.characters:
-            context_parts.append("MAIN CHARACTERS:")
-            context_parts.append(self.characters)
-            context_parts.append("")
-
-        if self.story_outline:
-            context_parts.append("STORY OUTLINE:")
-            context_parts.append(self.story_outline)
-            context_parts.append("")
-
-        if self.world_building:
-            context_parts.append("WORLD BUILDING:")
-            context_parts.append(self.world_building)
-            context_parts.append("")
-
-        if self.themes:
-            context_parts.append("THEMES & TONE:")
-            context_parts.append(self.themes)
-            context_parts.append("")
-
-        if self.writing_style_notes:
-            context_parts.append("WRITING STYLE:")
-            context_parts.append(self.writing_style_notes)
-            context_parts.append("")
-
-        if self.planned_chapters:
-            current_progress = (self.total_chapters / self.planned_chapters) * 100 if self.planned_chapters > 0 else 0
-            context_parts.append(f"STORY PROGRESS: Chapter {self.current_chapter_number} of {self.planned_chapters} ({current_progress:.0f}%)")
+        for key, heading, text in self.get_framework_sections():
+            if sections is not None:
+                text = sections.get(key)
+                if not text:
+                    continue
+            context_parts.append(f"{heading}:")
+            context_parts.append(text)
             context_parts.append("")
 
+        # Chapter progress is left to the per-chapter part of the prompt, so
+        # this block stays the same from one chapter to the next
         return "\n".join(context_parts)
 
     @property
@@ -223,6 +274,7 @@ class Chapter(models.Model):
     chapter_number = models.PositiveIntegerField()
     title = models.CharField(max_length=200)
     content = models.TextField(help_text="AI-generated chapter content")
+    summary = models.TextField(blank=True, help_text="Short recap used as context when generating later chapters")
 
     prompt_used = models.ForeignKey('Prompt', on_delete=models.SET_NULL, null=True, blank=True, related_name='generated_chapter')
 
@@ -233,6 +285,7 @@ class Chapter(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
     published_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, help_text="Last edit; drives ETags and the rendered-body cache")
 
     class Meta:
         ordering = ['story', 'chapter_number']
@@ -285,41 +338,156 @@ class Prompt(models.Model):
     class Meta:
         ordering = ['-vote_count', 'created_at']
         unique_together = ['story', 'chapter_number', 'user']  # One prompt per user per chapter
+        indexes = [
+            # Finding voting rounds whose deadline has passed
+            models.Index(fields=['status', 'voting_ends_at'], name='prompt_status_deadline_idx'),
+        ]
 
     def __str__(self):
         return f"{self.story.title} Ch.{self.chapter_number} by {self.user.username}: {self.prompt_text[:50]}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the status as loaded so transitions can be detected on save
+        # without re-reading the row
+        if 'status' in field_names:
+            instance._loaded_status = values[field_names.index('status')]
+        return instance
+
+    @property
+    def previous_status(self):
+        """Status as last loaded from or saved to the database (None for unsaved prompts)"""
+        if not hasattr(self, '_loaded_status'):
+            if self.pk is None:
+                return None
+            # Only happens when status was deferred at load time
+            self._loaded_status = Prompt.objects.filter(pk=self.pk).values_list('status', flat=True).first()
+        return self._loaded_status
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'status' in update_fields:
+            self._loaded_status = self.status
+
     def update_vote_count(self):
-        """Update cached vote count"""
+        """Recount votes from the Vote table (see reconcile_vote_counts for the bulk version)"""
         self.vote_count = self.votes.count()
-        self.save(update_fields=['vote_count'])
+        Prompt.objects.filter(pk=self.pk).update(vote_count=self.vote_count)
+
+    @classmethod
+    def vote_count_expression(cls):
+        """Subquery computing the true vote count of each prompt"""
+        return Coalesce(
+            Subquery(
+                Vote.objects.filter(prompt=OuterRef('pk')).order_by().values('prompt')
+                .annotate(c=Count('*')).values('c')[:1]
+            ),
+            0,
+        )
 
 
 class Vote(models.Model):
-    """User vote on a prompt"""
+    """
+    User vote on a prompt
+
+    story and chapter_number are copied from the prompt so that "one vote per
+    user per voting round" is enforced by the database. Use stories.voting to
+    cast or move votes; it keeps Prompt.vote_count in step with atomic updates.
+    Deleted votes are taken off the count by stories.signals.
+    """
 
     prompt = models.ForeignKey(Prompt, on_delete=models.CASCADE, related_name='votes')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='votes')
 
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='votes', help_text="Copied from prompt")
+    chapter_number = models.PositiveIntegerField(help_text="Copied from prompt")
+
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ['prompt', 'user']  # One vote per user per prompt
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['story', 'chapter_number', 'user'], name='one_vote_per_round'),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} voted for prompt {self.prompt.id}"
+        return f"{self.user.username} voted for prompt {self.prompt_id}"
 
     def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if adding and not self.story_id:
+            self.story_id = self.prompt.story_id
+            self.chapter_number = self.prompt.chapter_number
         super().save(*args, **kwargs)
-        # Update prompt vote count
-        self.prompt.update_vote_count()
+        if adding:
+            Prompt.objects.filter(pk=self.prompt_id).update(vote_count=F('vote_count') + 1)
 
-    def delete(self, *args, **kwargs):
-        prompt = self.prompt
-        super().delete(*args, **kwargs)
-        # Update prompt vote count after deletion
-        prompt.update_vote_count()
+
+class SearchDocument(models.Model):
+    """
+    Search index row for a story (chapter is null) or one of its published chapters
+
+    Maintained by stories.signals; the full-text index over title/body is created
+    per database backend in the migration (see stories.search).
+    """
+
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='search_documents')
+    chapter = models.ForeignKey(Chapter, on_delete=models.CASCADE, null=True, blank=True, related_name='search_documents')
+
+    # Text as indexed (CJK runs are pre-segmented on backends that need it)
+    title = models.CharField(max_length=500)
+    body = models.TextField()
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['story', 'chapter']),
+        ]
+
+    def __str__(self):
+        if self.chapter_id:
+            return f"Search document for {self.story_id} chapter {self.chapter_id}"
+        return f"Search document for story {self.story_id}"
+
+
+class StoryRanking(models.Model):
+    """
+    Precomputed trending score for a public story
+
+    Rebuilt in bulk by the refresh_story_rankings Celery beat task (see
+    stories.ranking) so listings can read pre-sorted story ids instead of
+    aggregating votes and reads on every request.
+    """
+
+    story = models.OneToOneField(Story, on_delete=models.CASCADE, primary_key=True, related_name='ranking')
+
+    # Copied from the story so listings can filter and sort on this table alone
+    status = models.CharField(max_length=20)
+    language = models.CharField(max_length=5)
+
+    score = models.FloatField(default=0, help_text="Time-decayed trending score")
+
+    # Score components, kept for debugging and admin display
+    upvotes = models.PositiveIntegerField(default=0)
+    subscribers = models.PositiveIntegerField(default=0)
+    recent_reads = models.FloatField(default=0, help_text="Decay-weighted chapter reads")
+    recent_chapters = models.FloatField(default=0, help_text="Decay-weighted chapter publishes")
+
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-score']
+        indexes = [
+            models.Index(fields=['status', '-score'], name='ranking_status_score_idx'),
+            models.Index(fields=['status', 'language', '-score'], name='ranking_status_lang_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.story_id}: {self.score:.2f}"
 
 
 class Comment(models.Model):
@@ -397,6 +565,8 @@ class SiteSettings(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     updated_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
+    CACHE_KEY = 'site_settings'
+
     class Meta:
         verbose_name = 'Site Settings'
         verbose_name_plural = 'Site Settings'
@@ -405,6 +575,7 @@ class SiteSettings(models.Model):
         # Ensure only one instance exists
         self.pk = 1
         super().save(*args, **kwargs)
+        transaction.on_commit(lambda: cache.delete(self.CACHE_KEY))
 
     def delete(self, *args, **kwargs):
         # Prevent deletion
@@ -412,9 +583,210 @@ class SiteSettings(models.Model):
 
     @classmethod
     def get_settings(cls):
-        """Get or create the singleton settings instance"""
-        settings, created = cls.objects.get_or_create(pk=1)
+        """Get or create the singleton settings instance (cached, read on every page)"""
+        settings = cache.get(cls.CACHE_KEY)
+        if settings is None:
+            settings, created = cls.objects.get_or_create(pk=1)
+            cache.set(cls.CACHE_KEY, settings, None)
         return settings
 
     def __str__(self):
         return "Site Settings"
+
+
+class OutboxMessage(models.Model):
+    """
+    A Celery task waiting to be published
+
+    Written in the same transaction as the change that calls for the task, so
+    the task is only sent if that change commits, and sending never happens
+    inside a request. stories.outbox.relay publishes pending messages.
+    """
+
+    task_name = models.CharField(max_length=200, help_text="Registered Celery task name")
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+
+    # Unique while pending; cleared once sent so the same work can be queued again later
+    dedupe_key = models.CharField(max_length=200, unique=True, null=True, blank=True,
+                                  help_text="Pending messages with the same key are only queued once")
+
+    attempts = models.PositiveIntegerField(default=0, help_text="Failed publish attempts")
+    last_error = models.TextField(blank=True)
+    available_at = models.DateTimeField(default=timezone.now, help_text="Not published before this time (retry backoff)")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['sent_at', 'available_at'], name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task_name}{tuple(self.args)} ({'sent' if self.sent_at else 'pending'})"
+
+
+class GenerationJob(models.Model):
+    """
+    Durable record of one chapter generation
+
+    Created when generation is queued and moved through its states with
+    transition(), which only succeeds from an allowed source state so two
+    workers can never both run the same job. stories.generation_jobs.reap_stale_jobs
+    re-queues or fails jobs that stop making progress.
+    """
+
+    KIND_CHOICES = [
+        ('prompt', 'Winning prompt'),
+        ('personal', 'Personal story'),
+    ]
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    RETRYING = 'retrying'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (RETRYING, 'Retrying'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = (QUEUED, RUNNING, RETRYING)
+
+    # Allowed source states for each target state
+    TRANSITIONS = {
+        RUNNING: (QUEUED, RETRYING),
+        RETRYING: (QUEUED, RUNNING, RETRYING),
+        SUCCEEDED: (RUNNING,),
+        FAILED: (QUEUED, RUNNING, RETRYING),
+    }
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='generation_jobs')
+    chapter_number = models.PositiveIntegerField()
+    prompt = models.ForeignKey(Prompt, on_delete=models.SET_NULL, null=True, blank=True, related_name='generation_jobs',
+                               help_text="Winning prompt being written up (prompt jobs)")
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='generation_jobs',
+                             help_text="Who asked for the chapter (personal jobs)")
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0, help_text="Times the job has started running")
+    worker = models.CharField(max_length=255, blank=True, help_text="Celery worker that ran the last attempt")
+    task_id = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    credits_charged = models.PositiveIntegerField(default=0, help_text="Credits deducted and not yet refunded")
+    chapter = models.ForeignKey(Chapter, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    cached_tokens = models.PositiveIntegerField(null=True, blank=True, help_text="Prompt tokens the provider served from its prompt cache")
+    completion_tokens = models.PositiveIntegerField(null=True, blank=True)
+    latency_ms = models.PositiveIntegerField(null=True, blank=True, help_text="Model call duration")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(default=timezone.now, help_text="Last state change; drives the stale-job reaper")
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Stuck-job queries: status = X and updated_at < cutoff
+            models.Index(fields=['status', 'updated_at'], name='generation_job_stale_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} job for {self.story} ch.{self.chapter_number} ({self.status})"
+
+    def transition(self, status, from_status=None, **fields):
+        """
+        Move the job to a new state if it is in an allowed source state
+
+        The check and the update are a single UPDATE, so concurrent callers
+        cannot both win the same transition.
+
+        Args:
+            status: Target state
+            from_status: Only move from this state (must be an allowed source)
+            **fields: Other fields to set (error, chapter, token figures, ...)
+
+        Returns:
+            bool: False if the job was not in a state that can move to `status`
+        """
+        now = timezone.now()
+        fields.update(status=status, updated_at=now)
+        if status == self.RUNNING:
+            fields['started_at'] = now
+        elif status in (self.SUCCEEDED, self.FAILED):
+            fields['finished_at'] = now
+
+        updates = dict(fields)
+        if status == self.RUNNING:
+            updates['attempts'] = F('attempts') + 1
+
+        sources = self.TRANSITIONS[status]
+        if from_status is not None:
+            sources = [from_status] if from_status in sources else []
+        changed = GenerationJob.objects.filter(pk=self.pk, status__in=sources).update(**updates)
+        if changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            if status == self.RUNNING:
+                self.attempts += 1
+        return bool(changed)
+
+
+class StoryArcSummary(models.Model):
+    """
+    Recap of a run of consecutive chapters
+
+    Level 1 arcs merge the summaries of stories.summaries.ARC_SIZE chapters,
+    level 2 arcs merge that many level 1 arcs, and so on, so the recap of a
+    story's past stays a handful of paragraphs however long the story gets.
+    """
+
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='arc_summaries')
+    level = models.PositiveSmallIntegerField(help_text="1 = merged chapter summaries, 2 = merged level 1 arcs, ...")
+    first_chapter = models.PositiveIntegerField()
+    last_chapter = models.PositiveIntegerField()
+    summary = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['story', 'first_chapter', '-level']
+        constraints = [
+            models.UniqueConstraint(fields=['story', 'level', 'first_chapter'], name='one_arc_per_span_start'),
+        ]
+
+    def __str__(self):
+        return f"{self.story.title} - Chapters {self.first_chapter}-{self.last_chapter} (level {self.level})"
+
+
+class ChapterDraft(models.Model):
+    """
+    Lock and idempotency record for generating one chapter
+
+    Whoever holds the lock (locked_by, until locked_until) calls the model;
+    the draft it gets back is kept with a hash of the prompt it was written
+    from, so other callers asking for the same chapter from the same prompt
+    reuse it. See stories.generation_lock.
+    """
+
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='+')
+    chapter_number = models.PositiveIntegerField()
+    locked_by = models.CharField(max_length=32, blank=True, help_text="Token of the caller generating the chapter")
+    locked_until = models.DateTimeField(null=True, blank=True, help_text="A crashed holder's lock is free after this")
+    prompt_hash = models.CharField(max_length=64, blank=True, help_text="SHA-256 of the prompt the draft was written from")
+    draft = models.JSONField(null=True, blank=True)
+    drafted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['story', 'chapter_number'], name='one_draft_per_chapter'),
+        ]
+
+    def __str__(self):
+        return f"Draft of {self.story} ch.{self.chapter_number}"
@@ -0,0 +1,111 @@
+"""
+Transactional outbox for Celery tasks
+
+Calling task.delay() from a signal talks to the broker in the middle of a
+database transaction: a slow broker stalls the save, a dead one breaks it, and
+a fast worker can pick up the task before the row it needs is committed.
+Instead, enqueue() writes an OutboxMessage in the caller's transaction and
+relay() (run every few seconds by stories.tasks.relay_outbox) publishes
+pending messages in batches, backing off and retrying when the broker fails.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+
+logger = logging.getLogger(__name__)
+
+# Messages published per relay run
+RELAY_BATCH_SIZE = 100
+
+# Retry backoff after a failed publish: doubles per attempt up to the maximum
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 300
+
+# Sent messages are kept this long for debugging
+SENT_RETENTION = timedelta(days=7)
+
+
+def enqueue(task, args=(), kwargs=None, dedupe_key=None):
+    """
+    Queue a Celery task as part of the current transaction
+
+    Args:
+        task: Celery task or registered task name
+        args: Positional task arguments (JSON-serializable)
+        kwargs: Keyword task arguments (JSON-serializable)
+        dedupe_key: Optional key; while a message with the same key is
+            pending, further enqueues are ignored
+
+    Returns:
+        bool: False if a pending message with the same dedupe_key already exists
+    """
+    message = OutboxMessage(
+        task_name=getattr(task, 'name', task),
+        args=list(args),
+        kwargs=kwargs or {},
+        dedupe_key=dedupe_key,
+    )
+    try:
+        with transaction.atomic():
+            message.save()
+    except IntegrityError:
+        if dedupe_key is None:
+            raise
+        return False
+    return True
+
+
+def _retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+def relay(batch_size=RELAY_BATCH_SIZE):
+    """
+    Publish pending outbox messages to Celery
+
+    Rows are claimed with SKIP LOCKED, so several relays can run at once
+    without publishing a message twice. When the broker fails the message is
+    rescheduled with backoff and the rest of the batch waits for the next run.
+
+    Returns:
+        int: Number of messages published
+    """
+    from plotvote.celery import app
+
+    now = timezone.now()
+    sent = []
+    with transaction.atomic():
+        pending = OutboxMessage.objects.select_for_update(skip_locked=True).filter(
+            sent_at__isnull=True,
+            available_at__lte=now,
+        ).order_by('id')[:batch_size]
+
+        for message in pending:
+            try:
+                app.send_task(
+                    message.task_name,
+                    args=message.args,
+                    kwargs=message.kwargs,
+                    task_id=f'outbox-{message.id}',
+                )
+            except Exception as e:
+                logger.warning(f"Failed to publish outbox message {message.id}: {e}")
+                message.attempts += 1
+                message.last_error = str(e)
+                message.available_at = timezone.now() + _retry_delay(message.attempts)
+                message.save(update_fields=['attempts', 'last_error', 'available_at'])
+                break
+
+            message.sent_at = timezone.now()
+            message.dedupe_key = None
+            sent.append(message)
+
+        OutboxMessage.objects.bulk_update(sent, ['sent_at', 'dedupe_key'])
+
+    OutboxMessage.objects.filter(sent_at__lt=now - SENT_RETENTION).delete()
+    return len(sent)
@@ -0,0 +1,71 @@
+"""
+Keyset (cursor) pagination for story listings
+
+Stories are listed in (-is_featured, -created_at, id) order. Instead of an
+OFFSET, each page remembers the sort key of its last row and the next page
+asks for rows strictly after it, so page 500 costs the same index range scan
+as page 1.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+STORY_ORDERING = ('-is_featured', '-created_at', 'id')
+
+
+def encode_cursor(story):
+    """Encode a story's sort key as an opaque URL-safe cursor"""
+    raw = f"{int(story.is_featured)}|{story.created_at.isoformat()}|{story.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor
+
+    Returns:
+        tuple: (is_featured, created_at, id) or None if the cursor is malformed
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        is_featured, created_at, story_id = base64.urlsafe_b64decode(padded).decode().split('|')
+        return bool(int(is_featured)), datetime.fromisoformat(created_at), int(story_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(queryset, cursor=None, per_page=12):
+    """
+    Fetch one page of stories after the given cursor
+
+    Args:
+        queryset: Story QuerySet (filters applied, ordering is replaced)
+        cursor: Cursor string from a previous page, or None for the first page
+        per_page: Number of stories per page
+
+    Returns:
+        tuple: (list of stories, next cursor or None)
+    """
+    queryset = queryset.order_by(*STORY_ORDERING)
+
+    position = decode_cursor(cursor)
+    if position:
+        is_featured, created_at, story_id = position
+        queryset = queryset.filter(
+            Q(is_featured__lt=is_featured) |
+            Q(is_featured=is_featured, created_at__lt=created_at) |
+            Q(is_featured=is_featured, created_at=created_at, id__gt=story_id)
+        )
+
+    # Fetch one extra row to learn whether another page exists
+    stories = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(stories) > per_page:
+        stories = stories[:per_page]
+        next_cursor = encode_cursor(stories[-1])
+
+    return stories, next_cursor
@@ -0,0 +1,203 @@
+"""
+Background generation of personal-story chapters
+
+Generating a chapter takes far longer than a web request may, so the
+continue_personal_story view only queues a job (through the outbox). The Celery task
+(stories.tasks.generate_personal_chapter) deducts the credit, streams the
+completion from the model and saves the chapter, refunding the credit if
+anything goes wrong.
+
+Each job is a GenerationJob row, which holds its status, error and finished
+chapter; a story has at most one active job. Only the text generated so far
+is kept in the cache shared by web and worker processes, from where the
+personal_generation_status view hands it to the polling browser.
+"""
+import logging
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Story, GenerationJob
+
+
+logger = logging.getLogger(__name__)
+
+# How long streamed text is kept after the last update
+TEXT_CACHE_TIMEOUT = 60 * 60
+
+# Longest a job may run; well inside generation_jobs.RUNNING_TIMEOUT, so the
+# reaper never fails a job that is still being written
+JOB_TIME_LIMIT = 10 * 60
+
+# Streamed text is published at most this often (seconds)
+PUBLISH_INTERVAL = 0.25
+
+
+def _text_key(job_id):
+    return f'personal_generation_text:{job_id}'
+
+
+def _publish_text(job_id, text):
+    cache.set(_text_key(job_id), text, TEXT_CACHE_TIMEOUT)
+
+
+def get_job(job_id):
+    """
+    Get the state of a generation job
+
+    Returns:
+        dict or None: {'status', 'story_id', 'text', 'error', 'chapter_number'};
+            chapter_number is only set once the chapter has been saved
+    """
+    job = GenerationJob.objects.filter(id=job_id, kind='personal').values(
+        'status', 'story_id', 'error', 'chapter_id', 'chapter_number'
+    ).first()
+    if job is None:
+        return None
+    return {
+        'status': job['status'],
+        'story_id': job['story_id'],
+        'text': cache.get(_text_key(job_id), ''),
+        'error': job['error'],
+        'chapter_number': job['chapter_number'] if job['chapter_id'] else None,
+    }
+
+
+def _active_jobs(story_id):
+    return GenerationJob.objects.filter(
+        story_id=story_id, kind='personal', status__in=GenerationJob.ACTIVE_STATUSES
+    )
+
+
+def get_active_job_id(story):
+    """Id of the job currently generating a chapter for this story, if any"""
+    return _active_jobs(story.id).values_list('id', flat=True).first()
+
+
+def start_job(story, user, prompt_text):
+    """
+    Queue generation of the story's next chapter
+
+    The story row is locked while checking for an active job, so two
+    requests can't both queue one.
+
+    Args:
+        story: Personal Story instance
+        user: Story owner, who pays for the chapter
+        prompt_text: What should happen in the chapter
+
+    Returns:
+        int or None: GenerationJob id, or None if a chapter is already being generated
+    """
+    from .outbox import enqueue
+    from .tasks import generate_personal_chapter
+
+    with transaction.atomic():
+        Story.objects.select_for_update().only('id').get(id=story.id)
+        if _active_jobs(story.id).exists():
+            return None
+        job = GenerationJob.objects.create(
+            kind='personal',
+            story=story,
+            chapter_number=story.current_chapter_number,
+            user=user,
+        )
+        # Published by the outbox relay once the job row is committed
+        enqueue(generate_personal_chapter, args=[job.id, prompt_text], dedupe_key=f'personal-job:{job.id}')
+    return job.id
+
+
+def run_job(job_id, prompt_text, worker='', task_id='', can_retry=False):
+    """
+    Generate, stream and save a queued chapter (runs in the Celery worker)
+
+    Args:
+        can_retry: The task will retry if this raises RateLimited; otherwise
+            a rate-limited job fails like any other
+
+    Returns:
+        dict or None: Final job state (see get_job), None if the job does not exist
+
+    Raises:
+        RateLimited: The model was rate limited and the job was left retrying
+    """
+    from users.models import CreditTransaction
+    from .chapter_engine import stream_chapter, finish_draft, save_draft
+    from .generation_jobs import refund_job
+    from .models import SiteSettings
+    from .rate_limit import RateLimited
+
+    record = GenerationJob.objects.select_related('story', 'user__profile').filter(id=job_id, kind='personal').first()
+    if record is None:
+        return None
+    if not record.transition(GenerationJob.RUNNING, worker=worker, task_id=task_id):
+        return get_job(job_id)
+
+    story = record.story
+    user = record.user
+    # Set when an earlier, rate-limited attempt already took the credit
+    charged = record.credits_charged
+
+    try:
+        if not charged and not SiteSettings.get_settings().beta_mode_enabled:
+            # The spend is recorded with the charge, so a refund always has an entry to cancel
+            with transaction.atomic():
+                if not user.profile.deduct_credits(1):
+                    record.transition(GenerationJob.FAILED, error='Not enough credits! You need 1 credit to generate a chapter.')
+                    return get_job(job_id)
+                charged = 1
+                GenerationJob.objects.filter(pk=record.pk).update(credits_charged=charged)
+                CreditTransaction.objects.create(
+                    user=user,
+                    amount=-charged,
+                    transaction_type='spent',
+                    description=f'Generating chapter {story.current_chapter_number} for "{story.title}"',
+                    story=story,
+                    balance_after=user.profile.credits
+                )
+
+        chapter_number = story.current_chapter_number
+        parts = []
+        usage = {}
+        started = last_publish = time.monotonic()
+        for delta in stream_chapter(story, prompt_text, chapter_number, usage=usage):
+            parts.append(delta)
+            if time.monotonic() - last_publish >= PUBLISH_INTERVAL:
+                _publish_text(job_id, ''.join(parts))
+                last_publish = time.monotonic()
+
+        text = ''.join(parts)
+        _publish_text(job_id, text)
+        draft = finish_draft(text, chapter_number, usage, int((time.monotonic() - started) * 1000))
+        with transaction.atomic():
+            story = Story.objects.select_for_update().get(id=story.id)
+            chapter = save_draft(story, story.current_chapter_number, draft)
+            story.updated_at = timezone.now()
+            story.save(update_fields=['updated_at'])
+
+            record.transition(
+                GenerationJob.SUCCEEDED,
+                chapter=chapter,
+                chapter_number=chapter.chapter_number,
+                latency_ms=draft['latency_ms'],
+                prompt_tokens=draft['prompt_tokens'],
+                cached_tokens=draft['cached_tokens'],
+                completion_tokens=draft['completion_tokens'],
+            )
+
+    except Exception as e:
+        if isinstance(e, RateLimited) and can_retry and record.transition(GenerationJob.RETRYING, error=str(e)):
+            # The job stays active, keeping the story claimed and the credit taken for the next attempt
+            raise
+
+        logger.exception(f"Personal chapter generation failed for story {story.id}")
+        error = f'Error generating chapter: {e}'
+        if charged:
+            error += ' Your credit has been refunded.'
+        # The reaper may have given up on this job already, refunding it
+        if record.transition(GenerationJob.FAILED, error=error, credits_charged=0) and charged:
+            refund_job(record, charged)
+
+    return get_job(job_id)
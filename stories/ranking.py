@@ -0,0 +1,162 @@
+"""
+Trending scores for public stories
+
+Scores combine upvotes, subscribers, recent qualified reads and recent
+chapter publishes. Reads and publishes are time-decayed by bucketing them by
+age, which keeps the whole computation to a few grouped aggregate queries:
+
+    score = UPVOTE_WEIGHT * ln(1 + upvotes)
+          + SUBSCRIBER_WEIGHT * ln(1 + subscribers)
+          + READ_WEIGHT * ln(1 + decayed reads)
+          + CHAPTER_WEIGHT * ln(1 + decayed chapters)
+
+The log keeps one huge story from drowning everything else out. Featured
+stories get FEATURED_BOOST on top so they stay pinned to the front.
+"""
+import math
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Story, Chapter, StoryRanking
+
+
+UPVOTE_WEIGHT = 1.0
+SUBSCRIBER_WEIGHT = 1.5
+READ_WEIGHT = 2.0
+CHAPTER_WEIGHT = 1.0
+FEATURED_BOOST = 1000.0
+
+# (max age, weight) buckets for reads and chapter publishes; older events are ignored
+READ_DECAY = [(timedelta(days=1), 1.0), (timedelta(days=7), 0.5), (timedelta(days=30), 0.1)]
+CHAPTER_DECAY = [(timedelta(days=7), 1.0), (timedelta(days=30), 0.25)]
+
+
+def _decayed_counts(queryset, story_field, time_field, buckets, now):
+    """
+    Count rows per story in each age bucket and combine them with the bucket weights
+
+    Returns:
+        dict: {story_id: decayed count}
+    """
+    oldest = now - buckets[-1][0]
+    aggregates = {}
+    previous_cutoff = None
+    for index, (max_age, weight) in enumerate(buckets):
+        cutoff = now - max_age
+        in_bucket = Q(**{f'{time_field}__gte': cutoff})
+        if previous_cutoff is not None:
+            in_bucket &= Q(**{f'{time_field}__lt': previous_cutoff})
+        aggregates[f'bucket_{index}'] = Count('pk', filter=in_bucket)
+        previous_cutoff = cutoff
+
+    rows = queryset.filter(**{f'{time_field}__gte': oldest}).order_by().values(story_field).annotate(**aggregates)
+    return {
+        row[story_field]: sum(row[f'bucket_{index}'] * weight for index, (_, weight) in enumerate(buckets))
+        for row in rows
+    }
+
+
+def compute_score(upvotes, subscribers, recent_reads, recent_chapters):
+    return (
+        UPVOTE_WEIGHT * math.log1p(upvotes)
+        + SUBSCRIBER_WEIGHT * math.log1p(subscribers)
+        + READ_WEIGHT * math.log1p(recent_reads)
+        + CHAPTER_WEIGHT * math.log1p(recent_chapters)
+    )
+
+
+def refresh_rankings():
+    """
+    Recompute StoryRanking for every public collaborative story
+
+    Returns:
+        int: Number of stories ranked
+    """
+    from users.models import ChapterView
+
+    now = timezone.now()
+
+    stories = list(
+        Story.objects.filter(
+            story_type='collaborative',
+            status__in=Story.PUBLIC_STATUSES,
+        ).values('id', 'status', 'language', 'is_featured', 'upvote_count', 'subscriber_count')
+    )
+
+    reads = _decayed_counts(
+        ChapterView.objects.filter(read_percentage__gte=60),
+        'chapter__story', 'updated_at', READ_DECAY, now,
+    )
+    chapters = _decayed_counts(
+        Chapter.objects.filter(status='published'),
+        'story', 'published_at', CHAPTER_DECAY, now,
+    )
+
+    rankings = []
+    for story in stories:
+        recent_reads = reads.get(story['id'], 0)
+        recent_chapters = chapters.get(story['id'], 0)
+        rankings.append(StoryRanking(
+            story_id=story['id'],
+            status=story['status'],
+            language=story['language'],
+            upvotes=story['upvote_count'],
+            subscribers=story['subscriber_count'],
+            recent_reads=recent_reads,
+            recent_chapters=recent_chapters,
+            score=(
+                compute_score(story['upvote_count'], story['subscriber_count'], recent_reads, recent_chapters)
+                + (FEATURED_BOOST if story['is_featured'] else 0)
+            ),
+            computed_at=now,
+        ))
+
+    upsert_options = {
+        'update_conflicts': True,
+        'update_fields': [
+            'status', 'language', 'score', 'upvotes', 'subscribers',
+            'recent_reads', 'recent_chapters', 'computed_at',
+        ],
+    }
+    if connection.features.supports_update_conflicts_with_target:
+        upsert_options['unique_fields'] = ['story']
+
+    with transaction.atomic():
+        StoryRanking.objects.bulk_create(rankings, batch_size=500, **upsert_options)
+        # Stories that went private or were paused drop out of the rankings
+        StoryRanking.objects.filter(computed_at__lt=now).delete()
+
+    return len(rankings)
+
+
+def ranked_stories(queryset, status, language='', limit=6):
+    """
+    Top stories of a status in trending order, read from StoryRanking
+
+    Stories created since the last refresh have no ranking yet; they fill any
+    remaining slots in the queryset's own order.
+
+    Args:
+        queryset: Story QuerySet with the listing's filters (and select_related)
+        status: Story status the listing shows
+        language: Optional language filter
+        limit: Number of stories to return
+
+    Returns:
+        list: Story instances
+    """
+    rankings = StoryRanking.objects.filter(status=status)
+    if language:
+        rankings = rankings.filter(language=language)
+    ranked_ids = list(rankings.order_by('-score').values_list('story_id', flat=True)[:limit])
+
+    stories_by_id = queryset.in_bulk(ranked_ids) if ranked_ids else {}
+    stories = [stories_by_id[story_id] for story_id in ranked_ids if story_id in stories_by_id]
+
+    if len(stories) < limit:
+        stories += list(queryset.exclude(id__in=ranked_ids)[:limit - len(stories)])
+
+    return stories
@@ -0,0 +1,175 @@
+"""
+Shared rate limiting of model calls
+
+Every gunicorn worker and Celery process used to call OpenAI on its own, so
+under load they overran the account's quota together and chapters failed
+with 429s. Calls now draw from two token buckets per model - requests and
+tokens per minute, from settings.OPENAI_RATE_LIMITS, where models not listed
+get the 'default' entry - that every process
+shares through Redis (OPENAI_RATE_LIMIT_URL). Without a URL each process
+keeps its own buckets (development).
+
+A call that would have to wait longer than MAX_WAIT raises RateLimited
+instead of holding its worker, as does a 429 from the provider; Celery tasks
+then retry after retry_delay().
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+
+
+# Longest a caller sleeps for capacity before giving up with RateLimited (seconds)
+MAX_WAIT = 10.0
+
+# Task retries: exponential backoff from RETRY_BASE_DELAY, capped at RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 5.0
+RETRY_MAX_DELAY = 5 * 60.0
+
+
+class RateLimited(Exception):
+    """A model call could not be made within the rate limit"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_delay(retries, retry_after=None):
+    """
+    Seconds to wait before retry number `retries` + 1
+
+    Exponential backoff with jitter, so throttled tasks do not all come back
+    at the same moment, and never sooner than the provider asked.
+    """
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** retries)
+    return max(retry_after or 0, random.uniform(delay / 2, delay))
+
+
+def _buckets(model):
+    """
+    [(capacity, refill per second)] for the request and token buckets
+
+    Models without an entry of their own share the limits of the 'default'
+    entry (each with its own buckets); without one either they are unlimited.
+    """
+    rate_limits = getattr(settings, 'OPENAI_RATE_LIMITS', {})
+    limits = rate_limits.get(model) or rate_limits.get('default')
+    if not limits:
+        return None
+    return [(limits['rpm'], limits['rpm'] / 60.0), (limits['tpm'], limits['tpm'] / 60.0)]
+
+
+# Runs atomically inside Redis.
+# KEYS: request bucket, token bucket
+# ARGV: capacity, refill per second and cost for each bucket
+# Returns the seconds to wait (as a string), '0' once both costs are taken
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local levels = {}
+local wait = 0
+for i = 1, 2 do
+    local capacity, rate, cost = tonumber(ARGV[i * 3 - 2]), tonumber(ARGV[i * 3 - 1]), tonumber(ARGV[i * 3])
+    local state = redis.call('HMGET', KEYS[i], 'level', 'ts')
+    local level = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    level = math.min(capacity, level + (now - ts) * rate)
+    levels[i] = level
+    local needed = math.min(cost, capacity)
+    if needed > level then wait = math.max(wait, (needed - level) / rate) end
+end
+if wait > 0 then return tostring(wait) end
+for i = 1, 2 do
+    redis.call('HSET', KEYS[i], 'level', levels[i] - tonumber(ARGV[i * 3]), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], 120)
+end
+return '0'
+"""
+
+
+class RedisRateLimiter:
+    """Buckets shared by every process through Redis"""
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._acquire = self._client.register_script(_ACQUIRE_SCRIPT)
+
+    def try_acquire(self, model, tokens):
+        """
+        Take one request and `tokens` tokens for `model` if both are available
+
+        Returns:
+            float: 0 if taken, otherwise seconds until they will be
+        """
+        buckets = _buckets(model)
+        if buckets is None:
+            return 0.0
+        (rpm, rpm_rate), (tpm, tpm_rate) = buckets
+        keys = [f'ratelimit:{model}:requests', f'ratelimit:{model}:tokens']
+        return float(self._acquire(keys=keys, args=[rpm, rpm_rate, 1, tpm, tpm_rate, tokens]))
+
+
+class LocalRateLimiter:
+    """Buckets kept in this process only"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def try_acquire(self, model, tokens):
+        """Same as RedisRateLimiter.try_acquire"""
+        buckets = _buckets(model)
+        if buckets is None:
+            return 0.0
+        now = time.monotonic()
+        costs = [1, tokens]
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for i, (capacity, rate) in enumerate(buckets):
+                level, ts = self._state.get((model, i), (capacity, now))
+                level = min(capacity, level + (now - ts) * rate)
+                levels.append(level)
+                needed = min(costs[i], capacity)
+                if needed > level:
+                    wait = max(wait, (needed - level) / rate)
+            if wait > 0:
+                return wait
+            for i, level in enumerate(levels):
+                self._state[(model, i)] = (level - costs[i], now)
+        return 0.0
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Get the process-wide limiter selected by OPENAI_RATE_LIMIT_URL"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                url = getattr(settings, 'OPENAI_RATE_LIMIT_URL', '')
+                _limiter = RedisRateLimiter(url) if url else LocalRateLimiter()
+    return _limiter
+
+
+def throttle(model, tokens, max_wait=MAX_WAIT):
+    """
+    Wait until a call to `model` using up to `tokens` tokens fits the rate limit
+
+    Raises:
+        RateLimited: If that would take longer than `max_wait` seconds
+    """
+    deadline = time.monotonic() + max_wait
+    while True:
+        wait = get_rate_limiter().try_acquire(model, tokens)
+        if not wait:
+            return
+        if time.monotonic() + wait > deadline:
+            raise RateLimited(f'Rate limit for {model} reached', retry_after=wait)
+        time.sleep(wait)
@@ -0,0 +1,194 @@
+"""
+Full-text search over stories and published chapters
+
+Every searchable story and published chapter has a SearchDocument row. The
+full-text index over those rows depends on the database:
+
+- SQLite (local): an FTS5 external-content table kept in sync by triggers.
+  FTS5's unicode61 tokenizer treats a run of CJK characters as one token, so
+  CJK text is pre-segmented into overlapping bigrams before it is stored.
+- MySQL (production): FULLTEXT indexes using the built-in ngram parser, which
+  already handles Chinese, Japanese and Korean.
+
+Other databases fall back to a (slow) substring match so search still works.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Substr
+
+from .models import Story, Chapter, SearchDocument
+
+
+# Same ranges as models.count_words
+CJK_PATTERN = re.compile(r'[\u4e00-\u9fff\u3400-\u4dbf\u3040-\u309f\u30a0-\u30ff\uac00-\ud7af]+')
+
+FTS_TABLE = 'stories_searchdocument_fts'
+
+# Title matches count this many times more than body matches
+TITLE_WEIGHT = 5.0
+
+# Ignore anything past this many search terms
+MAX_QUERY_TERMS = 10
+
+
+def segment_cjk(text):
+    """
+    Split runs of CJK characters into space-separated overlapping bigrams
+
+    "龙的传人" -> "龙的 的传 传人"; a single character is kept as is.
+    """
+    def bigrams(match):
+        run = match.group(0)
+        if len(run) == 1:
+            return f" {run} "
+        return ' ' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + ' '
+
+    return CJK_PATTERN.sub(bigrams, text)
+
+
+def _index_text(text):
+    """Prepare text for storage in the search index of the current backend"""
+    text = text or ''
+    if connection.vendor == 'sqlite':
+        return segment_cjk(text)
+    return text
+
+
+def _save_document(story_id, chapter_id, title, body):
+    """Insert or update the search document for a story or chapter"""
+    documents = SearchDocument.objects.filter(story_id=story_id, chapter_id=chapter_id)
+    values = {'title': _index_text(title), 'body': _index_text(body)}
+    if not documents.update(**values):
+        SearchDocument.objects.create(story_id=story_id, chapter_id=chapter_id, **values)
+
+
+def index_story(story):
+    """(Re)index a story's title and description"""
+    _save_document(story.id, None, story.title, story.description)
+
+
+def index_chapter(chapter):
+    """(Re)index a chapter, or drop it from the index if it is not published"""
+    if chapter.status != 'published':
+        remove_chapter(chapter)
+        return
+    _save_document(chapter.story_id, chapter.id, chapter.title, chapter.content)
+
+
+def remove_chapter(chapter):
+    """Remove a chapter from the search index"""
+    SearchDocument.objects.filter(chapter=chapter).delete()
+
+
+def rebuild_index():
+    """Rebuild every search document from scratch. Returns the number indexed."""
+    SearchDocument.objects.all().delete()
+
+    count = 0
+    for story in Story.objects.only('id', 'title', 'description').iterator():
+        index_story(story)
+        count += 1
+
+    chapters = Chapter.objects.filter(status='published').only('id', 'story_id', 'title', 'content', 'status')
+    for chapter in chapters.iterator():
+        index_chapter(chapter)
+        count += 1
+
+    return count
+
+
+def _query_terms(query):
+    return re.findall(r'\w+', query or '')[:MAX_QUERY_TERMS]
+
+
+def _fts5_match(terms):
+    """Build an FTS5 MATCH expression requiring every term"""
+    parts = []
+    for term in terms:
+        segments = segment_cjk(term).split()
+        if len(segments) == 1 and CJK_PATTERN.fullmatch(segments[0]) and len(segments[0]) == 1:
+            # A single CJK character is the first half of some indexed bigram
+            parts.append(f'"{segments[0]}"*')
+        else:
+            parts.append('"' + ' '.join(segments) + '"')
+    return ' '.join(parts)
+
+
+def _mysql_match(terms):
+    """Build a MySQL boolean-mode expression requiring every term"""
+    return ' '.join(f'+"{term}"' for term in terms)
+
+
+def _ranked_document_ids(terms, limit, offset):
+    """Return ids of matching public search documents, best match first"""
+    visibility = (
+        "s.story_type = 'collaborative' AND s.status IN ("
+        + ', '.join(['%s'] * len(Story.PUBLIC_STATUSES)) + ")"
+    )
+
+    if connection.vendor == 'sqlite':
+        sql = f"""
+            SELECT d.id FROM {FTS_TABLE} f
+            JOIN stories_searchdocument d ON d.id = f.rowid
+            JOIN stories_story s ON s.id = d.story_id
+            WHERE {FTS_TABLE} MATCH %s AND {visibility}
+            ORDER BY bm25({FTS_TABLE}, {TITLE_WEIGHT}, 1.0), d.id
+            LIMIT %s OFFSET %s
+        """
+        params = [_fts5_match(terms), *Story.PUBLIC_STATUSES, limit, offset]
+    elif connection.vendor == 'mysql':
+        sql = f"""
+            SELECT d.id FROM stories_searchdocument d
+            JOIN stories_story s ON s.id = d.story_id
+            WHERE MATCH(d.title, d.body) AGAINST (%s IN BOOLEAN MODE) AND {visibility}
+            ORDER BY MATCH(d.title) AGAINST (%s IN BOOLEAN MODE) * {TITLE_WEIGHT}
+                + MATCH(d.title, d.body) AGAINST (%s IN BOOLEAN MODE) DESC, d.id
+            LIMIT %s OFFSET %s
+        """
+        match = _mysql_match(terms)
+        params = [match, *Story.PUBLIC_STATUSES, match, match, limit, offset]
+    else:
+        documents = SearchDocument.objects.filter(
+            story__story_type='collaborative',
+            story__status__in=Story.PUBLIC_STATUSES,
+        )
+        for term in terms:
+            documents = documents.filter(Q(title__icontains=term) | Q(body__icontains=term))
+        return list(documents.order_by('chapter_id', 'id').values_list('id', flat=True)[offset:offset + limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search(query, page=1, per_page=10):
+    """
+    Search public stories and chapters
+
+    Args:
+        query: User's search string
+        page: 1-based page number
+        per_page: Results per page
+
+    Returns:
+        tuple: (list of SearchDocument with story/chapter loaded, has_next_page)
+    """
+    terms = _query_terms(query)
+    if not terms:
+        return [], False
+
+    ids = _ranked_document_ids(terms, per_page + 1, (page - 1) * per_page)
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+
+    documents = SearchDocument.objects.filter(id__in=ids).select_related(
+        'story', 'story__created_by', 'chapter'
+    ).defer(
+        'title', 'body', 'chapter__content'
+    ).annotate(
+        excerpt=Substr('chapter__content', 1, 240)
+    )
+    by_id = {document.id: document for document in documents}
+    return [by_id[i] for i in ids if i in by_id], has_next
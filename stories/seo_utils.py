@@ -113,7 +113,7 @@ def get_structured_data_story(story):
         "interactionStatistic": {
             "@type": "InteractionCounter",
             "interactionType": "https://schema.org/LikeAction",
-            "userInteractionCount": story.upvoters.count() if hasattr(story, 'upvoters') else 0
+            "userInteractionCount": story.upvote_count
         },
         "image": get_story_meta(story)['image'],
         "inLanguage": story.language if hasattr(story, 'language') else "en",
@@ -169,7 +169,7 @@ def get_structured_data_organization():
             "@type": "SearchAction",
             "target": {
                 "@type": "EntryPoint",
-                "urlTemplate": f"{settings.SITE_PROTOCOL}://{settings.SITE_DOMAIN}/search?q={{search_term_string}}"
+                "urlTemplate": f"{settings.SITE_PROTOCOL}://{settings.SITE_DOMAIN}/search/?q={{search_term_string}}"
             },
             "query-input": "required name=search_term_string"
         },
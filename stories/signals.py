@@ -1,33 +1,157 @@
 """
 Django signals for stories app
 """
-from django.db.models.signals import post_save, pre_save
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
-from .models import Prompt
-from .tasks import generate_chapter_from_prompt
-
-
-@receiver(pre_save, sender=Prompt)
-def track_status_change(sender, instance, **kwargs):
-    """Track if prompt status is changing to 'winner'"""
-    if instance.pk:
-        try:
-            old_instance = Prompt.objects.get(pk=instance.pk)
-            instance._old_status = old_instance.status
-        except Prompt.DoesNotExist:
-            instance._old_status = None
-    else:
-        instance._old_status = None
+from django.utils import timezone
+from .models import Story, Chapter, Comment, Prompt, Vote
+from .cache_utils import invalidate_homepage
+from .search import index_story, index_chapter
+from .generation_jobs import queue_prompt_generation
+from .generation_lock import forget_draft
 
 
 @receiver(post_save, sender=Prompt)
-def auto_generate_chapter_on_winner(sender, instance, created, **kwargs):
+def auto_generate_chapter_on_winner(sender, instance, created, update_fields=None, **kwargs):
     """
     Automatically trigger chapter generation when a prompt becomes a winner
+
+    The previous status comes from the value loaded with the prompt (see
+    Prompt.previous_status), so this costs no extra query.
+    """
+    if instance.status != 'winner':
+        return
+    if update_fields is not None and 'status' not in update_fields:
+        return
+
+    old_status = None if created else instance.previous_status
+    if old_status != 'winner':
+        # Queue the job through the outbox so the task is only sent once this save commits
+        queue_prompt_generation(instance)
+
+
+@receiver(post_save, sender=Chapter)
+def queue_chapter_summary(sender, instance, created, **kwargs):
+    """
+    Summarize chapters once published; the summaries stand in for them in later generation prompts
+
+    Chapters generated with a summary still get the task, which rolls them up into arcs.
+    """
+    if instance.status != 'published' or (instance.summary and not created):
+        return
+    from .outbox import enqueue
+    from .tasks import summarize_chapter
+
+    enqueue(summarize_chapter, args=[instance.id], dedupe_key=f'summarize-chapter:{instance.id}')
+
+
+@receiver(post_delete, sender=Chapter)
+def forget_chapter_draft(sender, instance, **kwargs):
+    """A deleted chapter is generated afresh, not restored from its stored draft"""
+    forget_draft(instance.story_id, instance.chapter_number)
+
+
+@receiver(post_delete, sender=Comment)
+def touch_chapter_on_comment_delete(sender, instance, **kwargs):
+    """
+    Mark the chapter modified when a comment goes
+
+    Its page's Last-Modified otherwise only moves forward with the latest
+    remaining comment, so a deletion would leave cached copies looking current.
+    """
+    Chapter.objects.filter(pk=instance.chapter_id).update(updated_at=timezone.now())
+
+
+# ===== Story counters =====
+
+def _sync_story_counters(story_ids, fields, instance=None):
+    """Recompute counters in the database and mirror them onto an in-memory story"""
+    Story.refresh_counters(story_ids, fields)
+    if isinstance(instance, Story) and instance.pk in story_ids:
+        instance.refresh_from_db(fields=fields)
+
+    # Counters are shown on the homepage cards of collaborative stories
+    if Story.objects.filter(pk__in=story_ids, story_type='collaborative').exists():
+        invalidate_homepage()
+
+
+@receiver(post_save, sender=Story)
+@receiver(post_delete, sender=Story)
+def invalidate_homepage_on_story_change(sender, instance, **kwargs):
+    """Status changes, edits and publishing of collaborative stories change the homepage"""
+    if instance.story_type == 'collaborative':
+        invalidate_homepage()
+
+
+@receiver(post_save, sender=Chapter)
+@receiver(post_delete, sender=Chapter)
+def update_chapter_count(sender, instance, **kwargs):
     """
-    # Check if status changed to 'winner'
-    old_status = getattr(instance, '_old_status', None)
+    Keep Story.total_chapters in sync when chapters are published, edited or removed
+
+    The story counts as modified too: every chapter page links to its
+    neighbours, and its Last-Modified includes story.updated_at.
+    """
+    story = instance.story if Chapter.story.is_cached(instance) else None
+    now = timezone.now()
+    Story.objects.filter(pk=instance.story_id).update(updated_at=now)
+    if story is not None:
+        story.updated_at = now
+    _sync_story_counters([instance.story_id], ['total_chapters'], story)
+
+
+def _story_m2m_changed(field, counter_field, action, instance, reverse, pk_set, **kwargs):
+    """Shared m2m_changed handler for the subscribers/upvoters relations"""
+    if action == 'pre_clear' and reverse:
+        # Remember which stories lose this user before the rows disappear
+        instance._cleared_story_ids = list(
+            Story.objects.filter(**{field: instance}).values_list('pk', flat=True)
+        )
+        return
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        story_ids = [instance.pk]
+    elif action == 'post_clear':
+        story_ids = getattr(instance, '_cleared_story_ids', [])
+    else:
+        story_ids = list(pk_set or [])
+
+    _sync_story_counters(story_ids, [counter_field], instance)
+
+
+@receiver(m2m_changed, sender=Story.subscribers.through)
+def update_subscriber_count(sender, **kwargs):
+    """Keep Story.subscriber_count in sync on subscribe/unsubscribe"""
+    _story_m2m_changed('subscribers', 'subscriber_count', **kwargs)
+
+
+@receiver(m2m_changed, sender=Story.upvoters.through)
+def update_upvote_count(sender, **kwargs):
+    """Keep Story.upvote_count in sync on upvote/un-upvote"""
+    _story_m2m_changed('upvoters', 'upvote_count', **kwargs)
+
+
+# ===== Prompt vote counts =====
+
+@receiver(post_delete, sender=Vote)
+def update_vote_count(sender, instance, **kwargs):
+    """Take deleted votes off Prompt.vote_count, including queryset and cascade deletes"""
+    Prompt.objects.filter(pk=instance.prompt_id).update(vote_count=F('vote_count') - 1)
+
+
+# ===== Search index =====
+
+@receiver(post_save, sender=Story)
+def update_story_search_document(sender, instance, **kwargs):
+    """Reindex a story's title and description whenever it is saved"""
+    index_story(instance)
+
 
-    if instance.status == 'winner' and old_status != 'winner':
-        # Trigger Celery task to generate chapter
-        generate_chapter_from_prompt.delay(instance.id)
+@receiver(post_save, sender=Chapter)
+def update_chapter_search_document(sender, instance, **kwargs):
+    """Index chapters as they are published or edited (deletes cascade to the index)"""
+    index_chapter(instance)
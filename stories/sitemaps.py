@@ -63,8 +63,8 @@ class ChapterSitemap(Sitemap):
         ).select_related('story').order_by('-created_at')
 
     def lastmod(self, obj):
-        """Return creation date (chapters don't get modified)"""
-        return obj.created_at
+        """Return last edit date"""
+        return obj.updated_at
 
     def location(self, obj):
         """Return the URL for each chapter"""
@@ -0,0 +1,180 @@
+"""
+Rolling chapter summaries
+
+Generation context used to include text from every previous chapter, so
+prompts grew with the story. Instead, each chapter gets a short summary once
+it is published (stories.tasks.summarize_chapter, queued through the outbox),
+and every ARC_SIZE consecutive summaries are merged into an arc summary,
+every ARC_SIZE arcs into a higher-level arc, and so on.
+
+story_so_far() then describes everything before the chapter being written
+with at most a few arcs and summaries plus the closing text of the last
+RECENT_CHAPTERS chapters, whatever the chapter count.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Length, Right, Substr
+
+from .models import Chapter, StoryArcSummary
+
+
+# Summaries merged into one arc (and arcs into one higher-level arc)
+ARC_SIZE = 10
+
+# The closing text of this many preceding chapters is included verbatim, up to
+# RECENT_CHAPTER_CHARS each (stories.context_budget then trims it to tokens)
+RECENT_CHAPTERS = 2
+RECENT_CHAPTER_CHARS = 4000
+
+# Stand-in for a summary that has not been written yet
+EXCERPT_CHARS = 600
+
+CHAPTER_SUMMARY_MAX_TOKENS = 250
+ARC_SUMMARY_MAX_TOKENS = 400
+
+
+def _summarize(instructions, text, max_tokens, backend=None):
+    from .chapter_engine import get_backend
+
+    backend = backend or get_backend()
+    result = backend.complete(
+        [
+            {"role": "system", "content": instructions},
+            {"role": "user", "content": text},
+        ],
+        max_tokens=max_tokens,
+        temperature=0.3,
+    )
+    return result['text'].strip()
+
+
+def summarize_chapter(chapter, backend=None):
+    """
+    Write a chapter's summary and roll it up into arcs
+
+    Args:
+        chapter: Published Chapter instance
+        backend: Generation backend (default: the configured one)
+
+    Returns:
+        str: The summary
+    """
+    summary = _summarize(
+        "Summarize this story chapter in at most 120 words for a writer continuing the story. "
+        "Cover the key events, changes to characters and relationships, and unresolved threads. "
+        "Write plain prose in the chapter's language; no headings.",
+        f"Chapter {chapter.chapter_number}: {chapter.title}\n\n{chapter.content}",
+        CHAPTER_SUMMARY_MAX_TOKENS,
+        backend,
+    )
+    Chapter.objects.filter(pk=chapter.pk).update(summary=summary)
+    chapter.summary = summary
+    roll_up_arcs(chapter.story_id, backend)
+    return summary
+
+
+def _units(story_id, level, after):
+    """Consecutive summaries at a level (0 = chapters) starting after chapter `after`"""
+    if level == 0:
+        rows = Chapter.objects.filter(
+            story_id=story_id, status='published', chapter_number__gt=after
+        ).order_by('chapter_number').values_list('chapter_number', 'chapter_number', 'summary')
+    else:
+        rows = StoryArcSummary.objects.filter(
+            story_id=story_id, level=level, first_chapter__gt=after
+        ).order_by('first_chapter').values_list('first_chapter', 'last_chapter', 'summary')
+
+    units = []
+    expected = after + 1
+    for first, last, summary in rows[:ARC_SIZE]:
+        # Stop at a gap or a summary that has not been written yet
+        if first != expected or not summary:
+            break
+        units.append((first, last, summary))
+        expected = last + 1
+    return units
+
+
+def roll_up_arcs(story_id, backend=None):
+    """
+    Merge every complete run of ARC_SIZE summaries into an arc, at every level
+
+    Returns:
+        int: Number of arcs created
+    """
+    created = 0
+    level = 1
+    while True:
+        last_arc = StoryArcSummary.objects.filter(story_id=story_id, level=level).order_by('-last_chapter').first()
+        units = _units(story_id, level - 1, last_arc.last_chapter if last_arc else 0)
+        if len(units) < ARC_SIZE:
+            if not last_arc:
+                return created
+            level += 1
+            continue
+
+        summary = _summarize(
+            "Merge these consecutive summaries of a story into one summary of at most 200 words. "
+            "Keep the events that matter for what comes next, and every character who is still relevant. "
+            "Write plain prose in the story's language; no headings.",
+            '\n\n'.join(f"Chapters {first}-{last}: {text}" if first != last else f"Chapter {first}: {text}"
+                        for first, last, text in units),
+            ARC_SUMMARY_MAX_TOKENS,
+            backend,
+        )
+        try:
+            with transaction.atomic():
+                StoryArcSummary.objects.create(
+                    story_id=story_id,
+                    level=level,
+                    first_chapter=units[0][0],
+                    last_chapter=units[-1][1],
+                    summary=summary,
+                )
+        except IntegrityError:
+            # Another worker rolled up the same span
+            pass
+        else:
+            created += 1
+
+
+def story_so_far(story, chapter_number):
+    """
+    Compact context describing the chapters before `chapter_number`
+
+    Returns:
+        dict: {
+            'recaps': [(label, text)] arc and chapter summaries, oldest first,
+            'recent': [(chapter_number, title, closing text)] for the last RECENT_CHAPTERS chapters,
+        }
+    """
+    recent_from = chapter_number - RECENT_CHAPTERS
+
+    # Widest arcs first, so the fewest recaps cover the past
+    covered = 0
+    recaps = []
+    for arc in StoryArcSummary.objects.filter(
+        story=story, last_chapter__lt=recent_from
+    ).order_by('first_chapter', '-level').only('first_chapter', 'last_chapter', 'summary'):
+        if arc.first_chapter == covered + 1:
+            recaps.append((f"Chapters {arc.first_chapter}-{arc.last_chapter}", arc.summary))
+            covered = arc.last_chapter
+
+    chapters = Chapter.objects.filter(
+        story=story, status='published', chapter_number__gt=covered, chapter_number__lt=chapter_number
+    ).order_by('chapter_number').annotate(
+        excerpt=Substr('content', 1, EXCERPT_CHARS),
+        tail=Right('content', RECENT_CHAPTER_CHARS),
+        length=Length('content'),
+    ).values('chapter_number', 'title', 'summary', 'excerpt', 'tail', 'length')
+
+    recent = []
+    for chapter in chapters:
+        if chapter['chapter_number'] >= recent_from:
+            tail = chapter['tail']
+            if chapter['length'] > RECENT_CHAPTER_CHARS:
+                tail = '...' + tail
+            recent.append((chapter['chapter_number'], chapter['title'], tail))
+        else:
+            text = chapter['summary'] or chapter['excerpt'] + '...'
+            recaps.append((f"Chapter {chapter['chapter_number']}: {chapter['title']}", text))
+    return {'recaps': recaps, 'recent': recent}
@@ -1,23 +1,53 @@
 """
 Celery tasks for stories app
 """
+import os
+
 from celery import shared_task
-from django.utils import timezone
-from .models import Story, Chapter, Prompt
-from .ai_service import ChapterGenerator
+from .models import Chapter, Prompt, GenerationJob
+from .generation_lock import GenerationInProgress, generate_chapter_once, save_draft_once
+from .personal_generation import JOB_TIME_LIMIT
+from .rate_limit import RateLimited, retry_delay
 
 
-@shared_task
-def generate_chapter_from_prompt(prompt_id):
+def _worker_name(task):
+    return f"{task.request.hostname or 'local'}:{os.getpid()}"
+
+
+@shared_task(bind=True, max_retries=6)
+def generate_chapter_from_prompt(self, prompt_id, job_id=None, rate_limited=0):
     """
     Generate a chapter from a winning prompt using AI
+
+    Progress is recorded on the prompt's GenerationJob (job_id), which is
+    created here for messages queued without one. When the model is rate
+    limited the task retries with backoff instead of losing the chapter, and
+    when someone else is already generating the chapter it retries to pick up
+    their draft.
+
+    Args:
+        prompt_id: Winning prompt to write the chapter from
+        job_id: GenerationJob tracking the chapter
+        rate_limited: Rate-limited attempts so far; set by the task's own retries
     """
     try:
-        prompt = Prompt.objects.get(id=prompt_id)
-        story = prompt.story
+        prompt = Prompt.objects.select_related('story').get(id=prompt_id)
+    except Prompt.DoesNotExist:
+        if job_id:
+            GenerationJob(id=job_id).transition(GenerationJob.FAILED, error='Prompt not found')
+        return f"Prompt {prompt_id} not found"
+    story = prompt.story
+
+    job = GenerationJob.objects.filter(id=job_id).first() if job_id else None
+    if job is None:
+        job = GenerationJob.objects.create(kind='prompt', story=story, chapter_number=prompt.chapter_number, prompt=prompt)
+    if not job.transition(GenerationJob.RUNNING, worker=_worker_name(self), task_id=self.request.id or ''):
+        return f"Generation job {job.id} is already {job.status}"
 
+    try:
         # Double-check prompt is a winner
         if prompt.status != 'winner':
+            job.transition(GenerationJob.FAILED, error=f'Prompt is not a winner (status: {prompt.status})')
             return f"Prompt {prompt_id} is not a winner (status: {prompt.status})"
 
         # Check if chapter already exists
@@ -27,32 +57,150 @@ def generate_chapter_from_prompt(prompt_id):
         ).first()
 
         if existing_chapter:
+            job.transition(GenerationJob.SUCCEEDED, chapter=existing_chapter)
             return f"Chapter {prompt.chapter_number} already exists for story {story.title}"
 
-        # Generate chapter using AI
-        generator = ChapterGenerator()
-        chapter_data = generator.generate_chapter(
-            story=story,
-            prompt_text=prompt.prompt_text,
-            chapter_number=prompt.chapter_number
-        )
-
-        # Create chapter
-        chapter = Chapter.objects.create(
-            story=story,
-            chapter_number=prompt.chapter_number,
-            title=chapter_data['title'],
-            content=chapter_data['content'],
-            prompt_used=prompt,
-            word_count=chapter_data['word_count'],
-            read_time_minutes=chapter_data['read_time_minutes'],
-            status='published',
-            published_at=timezone.now()
-        )
+        # Generate chapter using AI, or reuse the draft of a caller already generating it
+        draft, reused = generate_chapter_once(story, prompt.prompt_text, prompt.chapter_number)
+        chapter, created = save_draft_once(story, prompt.chapter_number, draft, prompt=prompt)
+        usage = {} if reused else {
+            'latency_ms': draft['latency_ms'],
+            'prompt_tokens': draft['prompt_tokens'],
+            'cached_tokens': draft['cached_tokens'],
+            'completion_tokens': draft['completion_tokens'],
+        }
+        job.transition(GenerationJob.SUCCEEDED, chapter=chapter, **usage)
 
+        if not created:
+            return f"Chapter {prompt.chapter_number} already exists for story {story.title}"
         return f"Successfully generated chapter {chapter.chapter_number} for {story.title}"
 
-    except Prompt.DoesNotExist:
-        return f"Prompt {prompt_id} not found"
+    except GenerationInProgress as e:
+        # Another worker or the generate_chapter command is writing this chapter;
+        # come back for its draft rather than holding this worker. Its lock
+        # expires, so these retries are bounded; they raise Celery's retry limit
+        # each time, and leave the rate-limit attempt count as it was.
+        job.transition(GenerationJob.RETRYING, error=str(e))
+        raise self.retry(countdown=e.retry_after, max_retries=self.request.retries + 1)
+
+    except RateLimited as e:
+        # Counted apart from self.request.retries, which the retries above also advance
+        if rate_limited >= self.max_retries:
+            job.transition(GenerationJob.FAILED, error=str(e))
+            return f"Error generating chapter: {str(e)}"
+        countdown = retry_delay(rate_limited, e.retry_after)
+        job.transition(GenerationJob.RETRYING, error=f'{e}; retrying in {countdown:.0f}s')
+        raise self.retry(
+            countdown=countdown,
+            kwargs={**self.request.kwargs, 'rate_limited': rate_limited + 1},
+            max_retries=self.request.retries + 1,
+        )
+
     except Exception as e:
+        job.transition(GenerationJob.FAILED, error=str(e))
         return f"Error generating chapter: {str(e)}"
+
+
+@shared_task
+def refresh_story_rankings():
+    """
+    Recompute trending scores for all public stories (run periodically by Celery beat)
+    """
+    from .ranking import refresh_rankings
+    from .cache_utils import invalidate_homepage
+
+    count = refresh_rankings()
+
+    # Homepage listings are ordered by ranking
+    invalidate_homepage()
+
+    return f"Ranked {count} stories"
+
+
+@shared_task
+def flush_vote_ledger():
+    """
+    Write votes recorded in the Redis vote ledger to the database (run periodically by Celery beat)
+
+    Does nothing with the default database vote backend.
+    """
+    from .voting import get_vote_backend
+
+    written = get_vote_backend().flush()
+    return f"Flushed {written} votes"
+
+
+@shared_task
+def close_expired_voting_rounds():
+    """
+    Pick winners for voting rounds past their deadline and queue their chapters (run periodically by Celery beat)
+    """
+    from .voting import close_expired_rounds
+
+    winners = close_expired_rounds()
+    return f"Closed {len(winners)} voting rounds"
+
+
+@shared_task
+def relay_outbox():
+    """
+    Publish tasks queued in the outbox (run periodically by Celery beat)
+    """
+    from .outbox import relay
+
+    sent = relay()
+    return f"Published {sent} outbox messages"
+
+
+# Stopping at the soft limit lets the failure handler refund the credit and
+# release the story before the reaper steps in
+@shared_task(bind=True, soft_time_limit=JOB_TIME_LIMIT, max_retries=3)
+def generate_personal_chapter(self, job_id, prompt_text):
+    """
+    Generate the next chapter of a personal story, streaming it to the browser as it is written
+    """
+    from .personal_generation import run_job
+
+    try:
+        job = run_job(job_id, prompt_text, worker=_worker_name(self), task_id=self.request.id or '',
+                      can_retry=self.request.retries < self.max_retries)
+    except RateLimited as e:
+        raise self.retry(countdown=retry_delay(self.request.retries, e.retry_after))
+    if job is None:
+        return f"Generation job {job_id} not found"
+    return f"Generation job {job_id} {job['status']}"
+
+
+@shared_task
+def reap_stale_generation_jobs():
+    """
+    Re-queue or fail chapter generation jobs that stopped making progress (run periodically by Celery beat)
+    """
+    from .generation_jobs import reap_stale_jobs
+
+    result = reap_stale_jobs()
+    return f"Re-queued {result['requeued']} and failed {result['failed']} stale generation jobs"
+
+
+@shared_task(bind=True, max_retries=6)
+def summarize_chapter(self, chapter_id):
+    """
+    Summarize a newly published chapter and roll the story's summaries up into arcs
+
+    Arcs only roll up over consecutive summaries, so a rate-limited summary is
+    retried with backoff rather than dropped.
+    """
+    from .summaries import summarize_chapter as write_summary, roll_up_arcs
+
+    chapter = Chapter.objects.filter(id=chapter_id, status='published').first()
+    if chapter is None:
+        return f"Chapter {chapter_id} not found"
+    try:
+        if chapter.summary:
+            # Written with the chapter (structured generation)
+            roll_up_arcs(chapter.story_id)
+            return f"Chapter {chapter_id} already summarized"
+        write_summary(chapter)
+    except RateLimited as e:
+        raise self.retry(countdown=retry_delay(self.request.retries, e.retry_after))
+    return f"Summarized chapter {chapter_id}"
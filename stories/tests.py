@@ -1,3 +1,1198 @@
-from django.test import TestCase
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Story, Chapter
+
+
+def make_story(user, **kwargs):
+    defaults = {
+        'title': 'The Dragon Quest',
+        'description': 'A story about dragons.',
+        'created_by': user,
+        'status': 'active',
+    }
+    defaults.update(kwargs)
+    return Story.objects.create(**defaults)
+
+
+class StoryCounterTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pw')
+        self.reader = User.objects.create_user('reader', password='pw')
+        self.story = make_story(self.author)
+
+    def test_chapter_publish_updates_total_chapters(self):
+        chapter = Chapter.objects.create(story=self.story, chapter_number=1, title='One', content='Hello world')
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.total_chapters, 0)
+
+        chapter.status = 'published'
+        chapter.published_at = timezone.now()
+        chapter.save()
+        self.assertEqual(self.story.total_chapters, 1)
+
+        chapter.delete()
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.total_chapters, 0)
+
+    def test_subscribe_and_upvote_update_counters(self):
+        self.story.subscribers.add(self.reader)
+        self.story.upvoters.add(self.reader, self.author)
+        self.story.upvoters.add(self.reader)  # duplicate add is a no-op
+        self.assertEqual(self.story.subscriber_count, 1)
+        self.assertEqual(self.story.upvote_count, 2)
+
+        self.reader.upvoted_stories.clear()
+        self.reader.subscribed_stories.remove(self.story)
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.subscriber_count, 0)
+        self.assertEqual(self.story.upvote_count, 1)
+
+    def test_stale_instance_save_does_not_clobber_counters(self):
+        stale = Story.objects.get(pk=self.story.pk)
+        self.story.upvoters.add(self.reader)
+        stale.title = 'Renamed'
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual(stale.upvote_count, 1)
+        self.assertEqual(stale.title, 'Renamed')
+
+
+class HomepageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author', password='pw')
+        self.story = make_story(self.author, title='Skyfall Chronicles')
+
+    def test_repeat_anonymous_hits_do_no_sql(self):
+        self.client.get(reverse('stories:homepage'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('stories:homepage'))
+        self.assertContains(response, 'Skyfall Chronicles')
+
+    def test_chapter_publish_invalidates_cached_sections(self):
+        self.client.get(reverse('stories:homepage'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Chapter.objects.create(
+                story=self.story, chapter_number=1, title='One', content='Hello',
+                status='published', published_at=timezone.now(),
+            )
+        response = self.client.get(reverse('stories:homepage'))
+        self.assertContains(response, '1 chapter<')
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pw')
+        self.stories = [make_story(self.author, title=f'Story {i}', genre='mystery') for i in range(5)]
+        Story.objects.filter(pk=self.stories[2].pk).update(is_featured=True)
+
+    def test_pages_walk_every_story_once_in_order(self):
+        from .pagination import keyset_page
+
+        expected = list(Story.objects.order_by('-is_featured', '-created_at', 'id').values_list('id', flat=True))
+        seen, cursor = [], None
+        while True:
+            page, cursor = keyset_page(Story.objects.all(), cursor, per_page=2)
+            seen.extend(story.id for story in page)
+            if not cursor:
+                break
+        self.assertEqual(seen, expected)
+        self.assertEqual(seen[0], self.stories[2].pk)
+
+    def test_browse_genre_view(self):
+        response = self.client.get(reverse('stories:browse_genre', args=['mystery']))
+        self.assertContains(response, 'Mystery Stories')
+        self.assertEqual(self.client.get(reverse('stories:browse_genre', args=['nope'])).status_code, 404)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pw')
+        self.story = make_story(self.author, title='Moonlit Harbor', description='Smugglers and lighthouses.')
+        self.zh_story = make_story(self.author, title='龙的传人', description='一个关于修仙的故事', language='zh')
+        Chapter.objects.create(
+            story=self.story, chapter_number=1, title='The Keeper', content='The lighthouse keeper found a dragon egg.',
+            status='published', published_at=timezone.now(),
+        )
+        make_story(self.author, title='Private Dragon', description='Hidden.', story_type='personal')
+
+    def search(self, query):
+        from .search import search
+        results, has_next = search(query)
+        return [(r.story.title, r.chapter.title if r.chapter else None) for r in results]
+
+    def test_ranks_titles_and_indexes_published_chapters(self):
+        self.assertEqual(self.search('moonlit'), [('Moonlit Harbor', None)])
+        self.assertEqual(self.search('dragon eggs'), [('Moonlit Harbor', 'The Keeper')])
+
+    def test_cjk_queries(self):
+        self.assertEqual(self.search('修仙'), [('龙的传人', None)])
+        self.assertEqual(self.search('龙'), [('龙的传人', None)])
+        self.assertEqual(self.search('仙修'), [])
+
+    def test_chapter_edits_update_index(self):
+        chapter = self.story.chapters.get()
+        chapter.content = 'A storm rolled in.'
+        chapter.save()
+        self.assertEqual(self.search('dragon'), [])
+        self.assertEqual(self.search('storm'), [('Moonlit Harbor', 'The Keeper')])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('stories:search'), {'q': 'harbor'})
+        self.assertContains(response, 'Moonlit Harbor')
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pw')
+        self.quiet = make_story(self.author, title='Quiet')
+        self.popular = make_story(self.author, title='Popular')
+        self.popular.upvoters.add(self.author)
+        Chapter.objects.create(
+            story=self.popular, chapter_number=1, title='One', content='Hi',
+            status='published', published_at=timezone.now(),
+        )
+
+    def test_refresh_orders_by_score_and_drops_private_stories(self):
+        from .models import StoryRanking
+        from .ranking import refresh_rankings, ranked_stories
+
+        self.assertEqual(refresh_rankings(), 2)
+        fresh = make_story(self.author, title='Brand New')
+        top = ranked_stories(Story.objects.filter(status='active').order_by('-created_at'), 'active', limit=3)
+        self.assertEqual([s.title for s in top], ['Popular', 'Quiet', 'Brand New'])
+
+        Story.objects.filter(pk=fresh.pk).update(story_type='personal')
+        Story.objects.filter(pk=self.quiet.pk).update(status='paused')
+        refresh_rankings()
+        self.assertEqual(list(StoryRanking.objects.values_list('story__title', flat=True)), ['Popular'])
+
+
+class StoryDetailQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author', password='pw')
+        self.story = make_story(self.author)
+
+    def add_chapters_and_prompts(self, count):
+        from .models import Prompt, Vote
+        start = self.story.total_chapters + 1
+        for number in range(start, start + count):
+            Chapter.objects.create(
+                story=self.story, chapter_number=number, title=f'Ch {number}', content='Text',
+                status='published', published_at=timezone.now(),
+            )
+        self.story.refresh_from_db()
+        for i in range(count):
+            user = User.objects.create_user(f'voter{self.story.total_chapters}-{i}')
+            prompt = Prompt.objects.create(
+                story=self.story, user=user, chapter_number=self.story.current_chapter_number,
+                prompt_text=f'Idea {i}', status='voting',
+                voting_ends_at=timezone.now() + timezone.timedelta(days=7),
+            )
+            Vote.objects.create(prompt=prompt, user=user)
+
+    def test_query_count_is_independent_of_story_size(self):
+        url = self.story.get_absolute_url()
+        self.add_chapters_and_prompts(2)
+        self.client.get(url)  # warm the site settings cache
+
+        # story, chapter list, one page of prompts
+        with self.assertNumQueries(3):
+            self.client.get(url)
+
+        self.add_chapters_and_prompts(15)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertTrue(response.context['has_more_prompts'])
+
+    def test_logged_in_query_count_is_constant(self):
+        url = self.story.get_absolute_url()
+        self.client.force_login(self.author)
+        self.add_chapters_and_prompts(2)
+        self.client.get(url)
+        with self.assertNumQueries(6) as small:
+            self.client.get(url)
+        self.add_chapters_and_prompts(12)
+        with self.assertNumQueries(len(small.captured_queries)):
+            self.client.get(url)
+
+
+class ChapterConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author', password='pw')
+        self.reader = User.objects.create_user('reader', password='pw')
+        self.story = make_story(self.author)
+        self.chapter = Chapter.objects.create(
+            story=self.story, chapter_number=1, title='One', content='First line\n\nSecond <b>line</b>',
+            status='published', published_at=timezone.now(),
+        )
+        self.url = self.chapter.get_absolute_url()
+
+    def test_anonymous_revalidation_returns_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<p>Second &lt;b&gt;line&lt;/b&gt;</p>', html=False)
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_comment_and_edit_change_etag(self):
+        from .models import Comment
+        etag = self.client.get(self.url)['ETag']
+
+        Comment.objects.create(chapter=self.chapter, user=self.reader, content='Nice')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        self.chapter.content = 'Rewritten'
+        self.chapter.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<p>Rewritten</p>')
+
+    def test_next_chapter_and_deleted_comment_change_last_modified(self):
+        from .models import Comment, Story
+        comment = Comment.objects.create(chapter=self.chapter, user=self.reader, content='Nice')
+        Comment.objects.create(chapter=self.chapter, user=self.author, content='Thanks')
+        # Age every timestamp so later changes land in a later second
+        earlier = timezone.now() - timezone.timedelta(hours=1)
+        Story.objects.filter(pk=self.story.pk).update(updated_at=earlier)
+        Chapter.objects.filter(pk=self.chapter.pk).update(updated_at=earlier)
+        Comment.objects.update(updated_at=earlier)
+
+        def revalidate():
+            last_modified = self.client.get(self.url)['Last-Modified']
+            return lambda: self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code
+
+        status = revalidate()
+        self.assertEqual(status(), 304)
+        Chapter.objects.create(story=self.story, chapter_number=2, title='Two', content='Next', status='published')
+        self.assertEqual(status(), 200)
+
+        Chapter.objects.filter(pk=self.chapter.pk).update(updated_at=earlier)
+        Story.objects.filter(pk=self.story.pk).update(updated_at=earlier)
+        status = revalidate()
+        comment.delete()
+        self.assertEqual(status(), 200)
+
+    def test_logged_in_304_still_records_view(self):
+        from users.models import ChapterView
+        self.client.force_login(self.reader)
+        response = self.client.get(self.url)
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('private', response['Cache-Control'])
+
+        ChapterView.objects.all().delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(ChapterView.objects.filter(reader=self.reader, chapter=self.chapter).exists())
+
+        # Another user never matches the reader's ETag
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class VotingRoundMixin:
+    def setUp(self):
+        from .models import Prompt
+        cache.clear()
+        self.author = User.objects.create_user('author', password='pw')
+        self.voter = User.objects.create_user('voter', password='pw')
+        self.story = make_story(self.author)
+        self.prompts = [
+            Prompt.objects.create(
+                story=self.story, user=User.objects.create_user(f'writer{i}'), chapter_number=1,
+                prompt_text=f'Idea {i}', status='voting',
+                voting_ends_at=timezone.now() + timezone.timedelta(days=1),
+            )
+            for i in range(2)
+        ]
+
+    def counts(self):
+        from .models import Prompt
+        return list(Prompt.objects.filter(pk__in=[p.pk for p in self.prompts]).order_by('pk').values_list('vote_count', flat=True))
+
+
+class VotingServiceTests(VotingRoundMixin, TestCase):
+
+    def test_cast_and_move_vote(self):
+        from .voting import cast_vote, VOTE_CREATED, VOTE_MOVED, VOTE_UNCHANGED
+        self.assertEqual(cast_vote(self.voter, self.prompts[0]), VOTE_CREATED)
+        self.assertEqual(cast_vote(self.voter, self.prompts[0]), VOTE_UNCHANGED)
+        self.assertEqual(self.counts(), [1, 0])
+        self.assertEqual(cast_vote(self.voter, self.prompts[1]), VOTE_MOVED)
+        self.assertEqual(self.counts(), [0, 1])
+
+    def test_one_vote_per_round_is_a_constraint(self):
+        from django.db import IntegrityError, transaction
+        from .models import Vote
+        Vote.objects.create(prompt=self.prompts[0], user=self.voter)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Vote.objects.create(prompt=self.prompts[1], user=self.voter)
+
+    def test_closed_round_rejects_votes(self):
+        from .voting import cast_vote, VotingClosed
+        self.prompts[0].voting_ends_at = timezone.now() - timezone.timedelta(minutes=1)
+        with self.assertRaises(VotingClosed):
+            cast_vote(self.voter, self.prompts[0])
+
+    def test_deleted_votes_are_uncounted(self):
+        from .models import Vote
+        other = User.objects.create_user('other')
+        for user in (self.voter, other):
+            Vote.objects.create(prompt=self.prompts[0], user=user)
+        Vote.objects.create(prompt=self.prompts[1], user=User.objects.create_user('third'))
+        self.assertEqual(self.counts(), [2, 1])
+
+        Vote.objects.filter(user=self.voter).delete()
+        other.delete()
+        self.assertEqual(self.counts(), [0, 1])
+
+    def test_reconcile_vote_counts(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import Prompt, Vote
+        Vote.objects.create(prompt=self.prompts[0], user=self.voter)
+        Prompt.objects.filter(pk=self.prompts[0].pk).update(vote_count=5)
+        call_command('reconcile_vote_counts', stdout=StringIO())
+        self.assertEqual(self.counts(), [1, 0])
+
+    def test_sync_round_votes_applies_ballots(self):
+        from .models import Vote
+        from .voting import sync_round_votes
+        other = User.objects.create_user('other')
+        Vote.objects.create(prompt=self.prompts[0], user=self.voter)
+
+        ballots = {self.voter.id: self.prompts[1].id, other.id: self.prompts[1].id, 999999: self.prompts[0].id}
+        self.assertEqual(sync_round_votes(self.story.id, 1, ballots), 2)
+        self.assertEqual(self.counts(), [0, 2])
+        self.assertEqual(sync_round_votes(self.story.id, 1, ballots), 0)
+
+
+def _redis_available():
+    import redis
+    try:
+        return redis.Redis.from_url('redis://127.0.0.1:6379/15').ping()
+    except redis.RedisError:
+        return False
+
+
+@skipUnless(_redis_available(), 'Redis is not running')
+class RedisVoteLedgerTests(VotingRoundMixin, TestCase):
+    def setUp(self):
+        from .voting import RedisVoteBackend
+        super().setUp()
+        self.backend = RedisVoteBackend('redis://127.0.0.1:6379/15')
+        self.backend._client.flushdb()
+
+    def test_votes_are_tallied_in_redis_and_flushed(self):
+        from .models import Vote
+        Vote.objects.create(prompt=self.prompts[0], user=self.voter)
+        other = User.objects.create_user('other')
+
+        self.assertEqual(self.backend.cast_vote(other, self.prompts[0]), 'created')
+        self.assertEqual(self.backend.cast_vote(self.voter, self.prompts[1]), 'moved')
+        self.assertEqual(self.backend.round_tallies(self.story.id, 1), {self.prompts[0].id: 1, self.prompts[1].id: 1})
+        self.assertEqual(self.counts(), [1, 0])
+
+        self.assertEqual(self.backend.flush(), 2)
+        self.assertEqual(self.counts(), [1, 1])
+
+    def test_closed_round_rejects_votes(self):
+        from .voting import VotingClosed
+        self.backend.cast_vote(self.voter, self.prompts[0])
+        self.assertEqual(self.backend.close_round(self.story.id, 1), 1)
+        with self.assertRaises(VotingClosed):
+            self.backend.cast_vote(User.objects.create_user('late'), self.prompts[1])
+        self.assertEqual(self.counts(), [1, 0])
+
+
+class CloseVotingRoundTests(VotingRoundMixin, TestCase):
+    def expire(self):
+        from .models import Prompt
+        Prompt.objects.filter(pk=self.prompts[0].pk).update(voting_ends_at=timezone.now() - timezone.timedelta(minutes=1))
+
+    def statuses(self):
+        from .models import Prompt
+        return list(Prompt.objects.filter(pk__in=[p.pk for p in self.prompts]).order_by('pk').values_list('status', flat=True))
+
+    def test_open_rounds_are_left_alone(self):
+        from .voting import close_expired_rounds
+        self.assertEqual(close_expired_rounds(), [])
+        self.assertEqual(self.statuses(), ['voting', 'voting'])
+
+    def test_most_voted_prompt_wins_once(self):
+        from .models import OutboxMessage
+        from .voting import cast_vote, close_expired_rounds
+        cast_vote(self.voter, self.prompts[1])
+        self.expire()
+
+        self.assertEqual(close_expired_rounds(), [self.prompts[1].pk])
+        self.assertEqual(self.statuses(), ['rejected', 'winner'])
+        self.assertEqual(close_expired_rounds(), [])
+        self.assertEqual(OutboxMessage.objects.get().args, [self.prompts[1].pk])
+
+    def test_ledger_is_flushed_after_the_round_is_locked(self):
+        from unittest import mock
+        from .voting import _cast_db_vote, close_expired_rounds
+        self.expire()
+        # A vote the ledger took just before the closer locked the story
+        ledger = mock.Mock(live_tallies=True)
+        ledger.flush_round.side_effect = lambda story_id, chapter_number: _cast_db_vote(self.voter, self.prompts[1])
+        with mock.patch('stories.voting.get_vote_backend', return_value=ledger):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.assertEqual(close_expired_rounds(), [self.prompts[1].pk])
+        ledger.flush_round.assert_called_once_with(self.story.id, 1)
+
+        # The round only stops taking votes once the close has committed
+        ledger.close_round.assert_not_called()
+        for callback in callbacks:
+            callback()
+        ledger.close_round.assert_called_once_with(self.story.id, 1)
+
+    def test_round_with_existing_winner_only_rejects(self):
+        from .models import Prompt
+        from .voting import close_expired_rounds
+        Prompt.objects.filter(pk=self.prompts[1].pk).update(status='winner')
+        self.expire()
+        self.assertEqual(close_expired_rounds(), [])
+        self.assertEqual(self.statuses(), ['rejected', 'winner'])
+
+
+class VoteTallyPollTests(VotingRoundMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+    def test_snapshot_is_shared_until_interval_passes(self):
+        from .voting import cast_vote, get_tally_snapshot
+        first = get_tally_snapshot(self.story.id, 1)
+        cast_vote(self.voter, self.prompts[0])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_tally_snapshot(self.story.id, 1), first)
+
+        cache.set(f'vote_tallies:{self.story.id}:1', dict(first, computed_at=0), 60)
+        refreshed = get_tally_snapshot(self.story.id, 1)
+        self.assertEqual(refreshed['tallies'][str(self.prompts[0].id)], 1)
+        self.assertNotEqual(refreshed['version'], first['version'])
+
+    def test_poll_returns_current_tallies(self):
+        url = reverse('stories:vote_tallies', args=[self.story.slug])
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {'chapter_number': 1, 'tallies': {str(p.id): 0 for p in self.prompts}})
+
+        with self.assertNumQueries(1):
+            unchanged = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(unchanged.status_code, 304)
+
+    def test_story_page_polls_only_with_open_prompts(self):
+        from .models import Prompt
+        url = reverse('stories:vote_tallies', args=[self.story.slug])
+        self.assertContains(self.client.get(self.story.get_absolute_url()), url)
+        Prompt.objects.update(status='rejected')
+        self.assertNotContains(self.client.get(self.story.get_absolute_url()), url)
+
+
+class PromptStatusTransitionTests(VotingRoundMixin, TestCase):
+    def test_winner_transition_triggers_generation_once(self):
+        from .models import OutboxMessage, Prompt
+        prompt = Prompt.objects.get(pk=self.prompts[0].pk)
+
+        # Saving without a status change reads nothing back
+        with self.assertNumQueries(1):
+            prompt.save()
+        prompt.status = 'winner'
+        prompt.save()
+        prompt.save()
+        Prompt.objects.get(pk=prompt.pk).save()
+
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.task_name, message.args), ('stories.tasks.generate_chapter_from_prompt', [prompt.pk]))
+
+    def test_votes_do_not_save_prompts(self):
+        from .voting import cast_vote
+        with self.assertNumQueries(5):
+            # savepoint, round lookup, vote insert, vote_count increment, release
+            cast_vote(self.voter, self.prompts[0])
+
+
+class OutboxTests(TestCase):
+    def test_pending_messages_are_deduplicated(self):
+        from .models import OutboxMessage
+        from .outbox import enqueue
+        self.assertTrue(enqueue('stories.tasks.refresh_story_rankings', dedupe_key='rankings'))
+        self.assertFalse(enqueue('stories.tasks.refresh_story_rankings', dedupe_key='rankings'))
+        self.assertTrue(enqueue('stories.tasks.refresh_story_rankings'))
+        self.assertEqual(OutboxMessage.objects.count(), 2)
+
+    def test_relay_backs_off_when_broker_fails(self):
+        from unittest import mock
+        from .models import OutboxMessage
+        from .outbox import enqueue, relay
+        enqueue('stories.tasks.refresh_story_rankings', dedupe_key='rankings')
+        enqueue('stories.tasks.relay_outbox')
+
+        with mock.patch('plotvote.celery.app.send_task', side_effect=ConnectionError('broker down')):
+            self.assertEqual(relay(), 0)
+        failed = OutboxMessage.objects.get(dedupe_key='rankings')
+        self.assertEqual(failed.attempts, 1)
+        self.assertGreater(failed.available_at, timezone.now())
+
+        # The failed message waits for its backoff; the rest go out
+        with mock.patch('plotvote.celery.app.send_task') as send_task:
+            self.assertEqual(relay(), 1)
+        send_task.assert_called_once_with('stories.tasks.relay_outbox', args=[], kwargs={}, task_id=mock.ANY)
+        self.assertEqual(OutboxMessage.objects.filter(sent_at__isnull=True).count(), 1)
+
+
+class HttpClientRegistryTests(TestCase):
+    def setUp(self):
+        from plotvote import http_clients
+        http_clients._reset_after_fork()
+        self.addCleanup(http_clients._reset_after_fork)
+
+    def test_clients_are_shared_per_service(self):
+        from plotvote.http_clients import get_http_client, get_openai_client
+        self.assertIs(get_http_client('download'), get_http_client('download'))
+        self.assertIsNot(get_http_client('download'), get_http_client('stripe'))
+        self.assertIs(get_openai_client(), get_openai_client())
+        self.assertIs(get_openai_client()._client, get_http_client('openai'))
+
+    def test_forked_child_gets_fresh_clients(self):
+        from plotvote import http_clients
+        parent = http_clients.get_http_client('download')
+        http_clients._reset_after_fork()
+        self.assertIsNot(http_clients.get_http_client('download'), parent)
+
+    def test_transport_records_latency_and_errors(self):
+        import httpx
+        from unittest import mock
+        from plotvote.http_clients import get_http_client, get_metrics
+        with mock.patch('httpx.HTTPTransport.handle_request', return_value=httpx.Response(503)):
+            get_http_client('download').get('https://images.example.com/cover.png')
+        stats = get_metrics()['download']
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['errors'], 1)
+
+    def test_stripe_uses_pooled_client(self):
+        import stripe
+        from plotvote.http_clients import configure_stripe, get_http_client
+        configure_stripe()
+        self.assertIs(stripe.default_http_client._client, get_http_client('stripe'))
+
+
+class PersonalChapterGenerationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('writer', password='pw')
+        self.user.profile.credits = 2
+        self.user.profile.save()
+        self.story = make_story(self.user, title='My Tale', story_type='personal', status='draft')
+        self.client.force_login(self.user)
+
+    def _queue(self):
+        from .models import OutboxMessage
+        response = self.client.post(
+            reverse('stories:continue_personal_story', args=[self.story.slug]),
+            {'prompt_text': 'A storm rolls in.'},
+        )
+        self.assertRedirects(response, reverse('stories:continue_personal_story', args=[self.story.slug]))
+        message = OutboxMessage.objects.get(task_name='stories.tasks.generate_personal_chapter')
+        self.assertEqual(message.dedupe_key, f'personal-job:{message.args[0]}')
+        return message.args
+
+    def test_job_streams_and_saves_chapter(self):
+        from unittest import mock
+        from .personal_generation import run_job
+
+        job_id, prompt_text = self._queue()
+        # Nothing is charged until the job runs
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.credits, 2)
+
+        deltas = ['TITLE: The Storm\n', 'CONTENT:\n', 'Rain fell.']
+        with mock.patch('stories.chapter_engine.stream_chapter', return_value=iter(deltas)):
+            job = run_job(job_id, prompt_text)
+        self.assertEqual(job['status'], 'succeeded')
+
+        from .models import GenerationJob
+        chapter = Chapter.objects.get(story=self.story, chapter_number=1)
+        self.assertEqual(GenerationJob.objects.get(id=job_id).chapter, chapter)
+        self.assertEqual((chapter.title, chapter.content), ('The Storm', 'Rain fell.'))
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.credits, 1)
+
+        text = ''.join(deltas)
+        response = self.client.get(
+            reverse('stories:personal_generation_status', args=[self.story.slug, job_id]), {'offset': 6},
+        )
+        self.assertEqual(response.json(), {
+            'status': 'succeeded', 'text': text[6:], 'offset': len(text),
+            'url': reverse('stories:chapter_detail', args=[self.story.slug, 1]),
+        })
+
+    def test_state_comes_from_the_job_row(self):
+        from .models import GenerationJob
+        from .personal_generation import get_active_job_id, get_job
+
+        job_id, prompt_text = self._queue()
+        # Another process's cache knows nothing about the job
+        cache.clear()
+        self.assertEqual(get_active_job_id(self.story), job_id)
+        self.assertEqual(get_job(job_id)['status'], 'queued')
+
+        # One active job per story
+        response = self.client.post(
+            reverse('stories:continue_personal_story', args=[self.story.slug]), {'prompt_text': 'Again.'},
+        )
+        self.assertRedirects(response, reverse('stories:continue_personal_story', args=[self.story.slug]))
+        self.assertEqual(GenerationJob.objects.count(), 1)
+
+    def test_failed_generation_refunds_credit(self):
+        from unittest import mock
+        from users.models import CreditTransaction
+        from .personal_generation import run_job, get_active_job_id
+
+        job_id, prompt_text = self._queue()
+        self.assertEqual(get_active_job_id(self.story), job_id)
+        with mock.patch('stories.chapter_engine.stream_chapter', side_effect=RuntimeError('rate limited')):
+            job = run_job(job_id, prompt_text)
+
+        self.assertEqual(job['status'], 'failed')
+        self.assertFalse(self.story.chapters.exists())
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.credits, 2)
+        # The spend and its refund cancel out in the credit history
+        entries = CreditTransaction.objects.filter(user=self.user, story=self.story)
+        self.assertEqual(sorted(entries.values_list('transaction_type', 'amount')), [('refund', 1), ('spent', -1)])
+        self.assertIsNone(get_active_job_id(self.story))
+
+    def test_rate_limited_job_retries_without_charging_twice(self):
+        from unittest import mock
+        from users.models import CreditTransaction
+        from .models import GenerationJob
+        from .personal_generation import run_job, get_active_job_id
+        from .rate_limit import RateLimited
+
+        job_id, prompt_text = self._queue()
+        with mock.patch('stories.chapter_engine.stream_chapter', side_effect=RateLimited('busy')):
+            with self.assertRaises(RateLimited):
+                run_job(job_id, prompt_text, can_retry=True)
+        self.assertEqual(GenerationJob.objects.get(id=job_id).status, 'retrying')
+        self.assertEqual(get_active_job_id(self.story), job_id)
+
+        with mock.patch('stories.chapter_engine.stream_chapter', return_value=iter(['TITLE: T\nCONTENT:\nBody'])):
+            self.assertEqual(run_job(job_id, prompt_text)['status'], 'succeeded')
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.credits, 1)
+        self.assertEqual(GenerationJob.objects.get(id=job_id).attempts, 2)
+        self.assertEqual(CreditTransaction.objects.filter(user=self.user, transaction_type='spent').count(), 1)
+
+
+class SharedCacheCheckTests(TestCase):
+    def test_worker_refuses_process_local_cache(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from plotvote.celery import require_shared_cache
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://x/1'}}
+        with self.assertRaisesMessage(ImproperlyConfigured, 'not shared between processes'):
+            require_shared_cache()
+        with override_settings(CACHES=redis):
+            require_shared_cache()
+
+
+class GenerationJobTests(VotingRoundMixin, TestCase):
+    def make_winner(self):
+        from .models import Prompt
+        prompt = Prompt.objects.get(pk=self.prompts[0].pk)
+        prompt.status = 'winner'
+        prompt.save()
+        return prompt
+
+    def test_winner_gets_one_queued_job(self):
+        from .generation_jobs import queue_prompt_generation
+        from .models import GenerationJob, OutboxMessage
+        prompt = self.make_winner()
+        self.assertIsNone(queue_prompt_generation(prompt))
+
+        job = GenerationJob.objects.get()
+        self.assertEqual((job.kind, job.status, job.chapter_number), ('prompt', 'queued', 1))
+        self.assertEqual(OutboxMessage.objects.get().kwargs, {'job_id': job.id})
+
+    @override_settings(CHAPTER_GENERATION_BACKEND='fake')
+    def test_task_records_outcome_and_runs_once(self):
+        from unittest import mock
+        from .chapter_engine import FakeBackend
+        from .models import GenerationJob
+        from .tasks import generate_chapter_from_prompt
+        prompt = self.make_winner()
+        job = GenerationJob.objects.get()
+
+        with mock.patch('stories.chapter_engine.FakeBackend.complete', autospec=True,
+                        side_effect=FakeBackend.complete) as complete:
+            generate_chapter_from_prompt.apply(args=[prompt.id], kwargs={'job_id': job.id})
+            result = generate_chapter_from_prompt.apply(args=[prompt.id], kwargs={'job_id': job.id})
+
+        self.assertEqual(complete.call_count, 1)
+        self.assertIn('already succeeded', result.result)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('succeeded', 1))
+        self.assertGreater(job.prompt_tokens, 0)
+        self.assertEqual(job.chapter, Chapter.objects.get(story=self.story, chapter_number=1))
+        self.assertIsNotNone(job.latency_ms)
+
+    def test_reaper_requeues_then_fails_stalled_jobs(self):
+        from .generation_jobs import reap_stale_jobs, MAX_ATTEMPTS, RUNNING_TIMEOUT
+        from .models import GenerationJob, OutboxMessage
+        self.make_winner()
+        job = GenerationJob.objects.get()
+        OutboxMessage.objects.update(sent_at=timezone.now(), dedupe_key=None)
+
+        stalled = timezone.now() - RUNNING_TIMEOUT - timezone.timedelta(minutes=1)
+        GenerationJob.objects.filter(pk=job.pk).update(status='running', attempts=1, updated_at=stalled)
+        self.assertEqual(reap_stale_jobs(), {'requeued': 1, 'failed': 0})
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'retrying')
+        self.assertEqual(OutboxMessage.objects.filter(sent_at__isnull=True).get().kwargs, {'job_id': job.id})
+
+        # Fresh jobs are left alone; jobs out of attempts are failed
+        self.assertEqual(reap_stale_jobs(), {'requeued': 0, 'failed': 0})
+        GenerationJob.objects.filter(pk=job.pk).update(status='running', attempts=MAX_ATTEMPTS, updated_at=stalled)
+        self.assertEqual(reap_stale_jobs(), {'requeued': 0, 'failed': 1})
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNotNone(job.finished_at)
+
+    def test_reaper_refunds_stalled_personal_job(self):
+        from .generation_jobs import reap_stale_jobs, RUNNING_TIMEOUT
+        from .models import GenerationJob
+        self.author.profile.credits = 0
+        self.author.profile.save()
+        GenerationJob.objects.create(
+            kind='personal', story=self.story, chapter_number=1, user=self.author, status='running',
+            attempts=1, credits_charged=1,
+            updated_at=timezone.now() - RUNNING_TIMEOUT - timezone.timedelta(minutes=1),
+        )
+        self.assertEqual(reap_stale_jobs(), {'requeued': 0, 'failed': 1})
+        self.author.profile.refresh_from_db()
+        self.assertEqual(self.author.profile.credits, 1)
+        self.assertEqual(GenerationJob.objects.get().credits_charged, 0)
+
+    @override_settings(CHAPTER_GENERATION_BACKEND='fake', CHAPTER_GENERATION_STRUCTURED_OUTPUT=True)
+    def test_malformed_output_is_regenerated_before_publishing(self):
+        from unittest import mock
+        from .chapter_engine import FakeBackend
+        from .models import GenerationJob
+        from .tasks import generate_chapter_from_prompt
+        prompt = self.make_winner()
+        job = GenerationJob.objects.get()
+        text = FakeBackend._text
+
+        def malformed_json(backend, messages, max_tokens, response_format=None):
+            if response_format:
+                return '{"title": "Storm", "content": "Rain fe'
+            return text(backend, messages, max_tokens)
+
+        with mock.patch.object(FakeBackend, '_text', autospec=True, side_effect=malformed_json):
+            generate_chapter_from_prompt.apply(args=[prompt.id], kwargs={'job_id': job.id})
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+        chapter = Chapter.objects.get(story=self.story)
+        self.assertNotIn('{', chapter.content)
+
+    @override_settings(CHAPTER_GENERATION_BACKEND='fake')
+    def test_rate_limited_task_retries_instead_of_failing(self):
+        from unittest import mock
+        from .chapter_engine import generate_chapter, FakeBackend
+        from .models import GenerationJob
+        from .rate_limit import RateLimited
+        from .tasks import generate_chapter_from_prompt
+        prompt = self.make_winner()
+        job = GenerationJob.objects.get()
+
+        draft = generate_chapter(self.story, 'Idea 0', 1, backend=FakeBackend())
+        with mock.patch('stories.generation_lock.generate_chapter', side_effect=[RateLimited('busy', 3), draft]):
+            generate_chapter_from_prompt.apply(args=[prompt.id], kwargs={'job_id': job.id})
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('succeeded', 2))
+        self.assertTrue(Chapter.objects.filter(story=self.story, chapter_number=1).exists())
+
+    @override_settings(CHAPTER_GENERATION_BACKEND='fake')
+    def test_task_retries_while_chapter_is_generated_elsewhere(self):
+        from unittest import mock
+        from .chapter_engine import generate_chapter, FakeBackend
+        from .generation_lock import GenerationInProgress
+        from .models import GenerationJob
+        from .tasks import generate_chapter_from_prompt
+        prompt = self.make_winner()
+        job = GenerationJob.objects.get()
+
+        draft = generate_chapter(self.story, 'Idea 0', 1, backend=FakeBackend())
+        with mock.patch('stories.tasks.generate_chapter_once',
+                        side_effect=[GenerationInProgress('busy', 30), (draft, True)]) as once:
+            generate_chapter_from_prompt.apply(args=[prompt.id], kwargs={'job_id': job.id})
+
+        self.assertEqual(once.call_count, 2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+
+    @override_settings(CHAPTER_GENERATION_BACKEND='fake')
+    def test_waiting_for_another_generation_does_not_use_up_rate_limit_retries(self):
+        from unittest import mock
+        from .chapter_engine import generate_chapter, FakeBackend
+        from .generation_lock import GenerationInProgress
+        from .models import GenerationJob
+        from .rate_limit import RateLimited
+        from .tasks import generate_chapter_from_prompt
+        prompt = self.make_winner()
+        job = GenerationJob.objects.get()
+
+        # Rate-limit retries are still capped
+        capped = GenerationJob.objects.create(kind='prompt', story=self.story, chapter_number=1, prompt=prompt)
+        with mock.patch('stories.tasks.generate_chapter_once', side_effect=RateLimited('busy', 3)) as once:
+            generate_chapter_from_prompt.apply(args=[prompt.id], kwargs={'job_id': capped.id, 'rate_limited': 5})
+        self.assertEqual(once.call_count, 2)
+        capped.refresh_from_db()
+        self.assertEqual(capped.status, 'failed')
+
+        draft = generate_chapter(self.story, 'Idea 0', 1, backend=FakeBackend())
+        outcomes = [GenerationInProgress('busy', 30)] * 8 + [RateLimited('busy', 3), (draft, False)]
+        with mock.patch('stories.tasks.generate_chapter_once', side_effect=outcomes), \
+                mock.patch('stories.tasks.retry_delay', return_value=1) as delay:
+            generate_chapter_from_prompt.apply(args=[prompt.id], kwargs={'job_id': job.id})
+
+        # The rate-limited attempt was the first, whatever came before it
+        delay.assert_called_once_with(0, 3)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+        self.assertTrue(Chapter.objects.filter(story=self.story, chapter_number=1).exists())
+
+
+class ChapterEngineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('author', password='pw')
+        self.story = make_story(self.user)
+
+    def test_fake_backend_is_deterministic_and_streams_the_same_text(self):
+        from .chapter_engine import FakeBackend, build_messages, generate_chapter, stream_chapter, finish_draft
+        backend = FakeBackend()
+        first = generate_chapter(self.story, 'A storm rolls in.', backend=backend, structured=False)
+        self.assertEqual(generate_chapter(self.story, 'A storm rolls in.', backend=backend, structured=False)['content'],
+                         first['content'])
+        self.assertNotEqual(generate_chapter(self.story, 'Calm seas.', backend=backend, structured=False)['content'],
+                            first['content'])
+
+        usage = {}
+        text = ''.join(stream_chapter(self.story, 'A storm rolls in.', usage=usage, backend=backend))
+        streamed = finish_draft(text, 1, usage, 0)
+        self.assertEqual((streamed['title'], streamed['content']), (first['title'], first['content']))
+        self.assertEqual(usage['completion_tokens'], first['completion_tokens'])
+        self.assertIn('Direction for chapter 1: A storm rolls in.', build_messages(self.story, 'A storm rolls in.', 1)[1]['content'])
+
+    @override_settings(CHAPTER_GENERATION_BACKEND='openai-compatible', CHAPTER_GENERATION_BASE_URL='http://localhost:8001/v1')
+    def test_backend_follows_settings(self):
+        from .chapter_engine import get_backend, OpenAICompatibleBackend
+        backend = get_backend()
+        self.assertIsInstance(backend, OpenAICompatibleBackend)
+        self.assertIs(get_backend(), backend)
+        self.assertEqual(str(backend._client().base_url), 'http://localhost:8001/v1/')
+        with override_settings(CHAPTER_GENERATION_BACKEND='fake'):
+            self.assertEqual(get_backend().name, 'fake')
+
+    def test_prompt_prefix_is_stable_across_chapters(self):
+        from .chapter_engine import build_messages
+        self.story.planned_chapters = 10
+        self.story.save()
+        first = build_messages(self.story, 'Begin.', 1)
+        Chapter.objects.create(story=self.story, chapter_number=1, title='One', content='It began.', status='published')
+        second = build_messages(self.story, 'Continue.', 2)
+        self.assertEqual(first[0], second[0])
+        self.assertNotIn('PROGRESS', first[0]['content'])
+        self.assertIn('STORY PROGRESS: Chapter 2 of 10', second[1]['content'])
+        self.assertTrue(second[1]['content'].rstrip().endswith('compelling title and engaging content.'))
+
+    def test_openai_backend_records_cached_tokens(self):
+        from types import SimpleNamespace
+        from unittest import mock
+        from .chapter_engine import OpenAIBackend, OpenAICompatibleBackend
+        response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='TITLE: T\nCONTENT:\nBody'), finish_reason='stop')],
+            usage=SimpleNamespace(prompt_tokens=2000, completion_tokens=900,
+                                  prompt_tokens_details=SimpleNamespace(cached_tokens=1536)),
+        )
+        client = mock.Mock()
+        client.chat.completions.create.return_value = response
+        for backend, sends_key in ((OpenAIBackend('gpt-4o'), True), (OpenAICompatibleBackend('m', 'http://x/v1'), False)):
+            with mock.patch.object(backend, '_client', return_value=client):
+                result = backend.complete([], cache_key='story-1')
+            self.assertEqual((result['cached_tokens'], result['finish_reason']), (1536, 'stop'))
+            self.assertEqual('prompt_cache_key' in client.chat.completions.create.call_args.kwargs, sends_key)
+
+    def test_structured_generation_returns_title_body_and_summary_in_one_call(self):
+        from unittest import mock
+        from .chapter_engine import CHAPTER_SCHEMA, FakeBackend, generate_chapter, save_draft
+        backend = FakeBackend()
+        with mock.patch.object(backend, 'complete', wraps=backend.complete) as complete:
+            draft = generate_chapter(self.story, 'A storm rolls in.', backend=backend, structured=True)
+        complete.assert_called_once()
+        self.assertEqual(complete.call_args.kwargs['response_format'], CHAPTER_SCHEMA)
+        self.assertTrue(draft['title'].startswith('Chapter '))
+        self.assertNotIn('{', draft['content'])
+        self.assertTrue(draft['summary'])
+        self.assertEqual(save_draft(self.story, 1, draft).summary, draft['summary'])
+
+    def test_malformed_structured_output_is_an_error(self):
+        from .chapter_engine import InvalidChapterOutput, parse_structured_response
+        self.assertEqual(parse_structured_response('{"title": "", "content": "Rain.", "summary": null}', 2),
+                         {'title': 'Chapter 2', 'content': 'Rain.', 'summary': ''})
+        for output in ('TITLE: Storm\nCONTENT:\nRain fell.', '{"title": "Storm", "content": "Rain fe',
+                       '{"title": "Storm", "content": " ", "summary": ""}'):
+            with self.assertRaises(InvalidChapterOutput):
+                parse_structured_response(output, 2)
+
+    def test_truncated_structured_output_is_regenerated_as_text(self):
+        from unittest import mock
+        from .chapter_engine import CHAPTER_MAX_TOKENS, FakeBackend, generate_chapter
+        backend = FakeBackend()
+        # Valid JSON that only parses because the cut fell between fields still counts as cut off
+        truncated = {'text': '{"title": "Storm", "content": "Rain.", "summary": ""}', 'finish_reason': 'length'}
+        plain = {'text': 'TITLE: Storm\nCONTENT:\nRain fell all night.', 'finish_reason': 'stop'}
+        with mock.patch.object(backend, 'complete', side_effect=[truncated, plain]) as complete:
+            draft = generate_chapter(self.story, 'A storm rolls in.', backend=backend, structured=True)
+
+        self.assertEqual((draft['title'], draft['content'], draft['summary']), ('Storm', 'Rain fell all night.', ''))
+        retry = complete.call_args_list[1].kwargs
+        self.assertIsNone(retry['response_format'])
+        self.assertGreater(retry['max_tokens'], CHAPTER_MAX_TOKENS)
+
+    def test_parse_falls_back_without_markers(self):
+        from .chapter_engine import parse_chapter_response
+        self.assertEqual(
+            parse_chapter_response('The Long Night\n\nIt was dark.', 4),
+            {'title': 'The Long Night', 'content': 'It was dark.'},
+        )
+        self.assertEqual(parse_chapter_response('It was dark.', 4)['title'], 'Chapter 4')
+
+
+class ChapterSummaryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('author', password='pw')
+        self.story = make_story(self.user)
+
+    def _publish(self, count, summarized=True):
+        for number in range(1, count + 1):
+            Chapter.objects.create(
+                story=self.story, chapter_number=number, title=f'Part {number}', status='published',
+                content=f'OPENING{number} ' + 'filler ' * 1000 + f'ENDING{number}',
+                summary=f'Summary {number}' if summarized else '',
+            )
+
+    def test_publishing_queues_summary_once(self):
+        from .models import OutboxMessage
+        self._publish(1, summarized=False)
+        chapter = Chapter.objects.get()
+        chapter.save()
+        self.assertEqual(OutboxMessage.objects.filter(dedupe_key=f'summarize-chapter:{chapter.id}').count(), 1)
+
+    @override_settings(CHAPTER_GENERATION_BACKEND='fake')
+    def test_summaries_roll_up_into_arcs(self):
+        from unittest import mock
+        from .models import StoryArcSummary
+        from .tasks import summarize_chapter
+        self._publish(9)
+        Chapter.objects.filter(chapter_number=9).update(summary='')
+        with mock.patch('stories.summaries.ARC_SIZE', 3):
+            summarize_chapter(Chapter.objects.get(chapter_number=9).id)
+        self.assertNotEqual(Chapter.objects.get(chapter_number=9).summary, '')
+        self.assertEqual(
+            list(StoryArcSummary.objects.values_list('level', 'first_chapter', 'last_chapter')),
+            [(2, 1, 9), (1, 1, 3), (1, 4, 6), (1, 7, 9)],
+        )
+
+    @override_settings(CHAPTER_GENERATION_BACKEND='fake')
+    def test_rate_limited_summary_is_retried(self):
+        from unittest import mock
+        from .rate_limit import RateLimited
+        from .tasks import summarize_chapter
+        self._publish(1, summarized=False)
+        chapter = Chapter.objects.get()
+        with mock.patch('stories.summaries._summarize', side_effect=[RateLimited('busy', 2), 'Recap.']) as summarize:
+            result = summarize_chapter.apply(args=[chapter.id])
+        self.assertEqual(result.get(), f'Summarized chapter {chapter.id}')
+        self.assertEqual(summarize.call_count, 2)
+        self.assertEqual(Chapter.objects.get().summary, 'Recap.')
+
+    def test_context_uses_widest_arcs_and_recent_endings(self):
+        from .models import StoryArcSummary
+        from .chapter_engine import build_messages
+        self._publish(12)
+        StoryArcSummary.objects.create(story=self.story, level=1, first_chapter=1, last_chapter=5, summary='Arc one')
+        StoryArcSummary.objects.create(story=self.story, level=2, first_chapter=1, last_chapter=9, summary='Saga')
+
+        context = build_messages(self.story, 'Next.', 13)[1]['content']
+        self.assertIn('Chapters 1-9\nSaga', context)
+        self.assertNotIn('Arc one', context)
+        self.assertIn('Summary 10', context)
+        self.assertNotIn('Summary 11', context)
+        self.assertIn('ENDING11', context)
+        self.assertIn('ENDING12', context)
+        self.assertNotIn('OPENING', context)
+
+
+class ContextBudgetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('author', password='pw')
+
+    def test_cjk_text_counts_more_tokens_per_character(self):
+        from .context_budget import count_tokens, truncate_tokens
+        english = 'The dragon slept. ' * 100
+        chinese = '龙在山洞里睡觉。' * 100
+        self.assertGreater(count_tokens(chinese) / len(chinese), count_tokens(english) / len(english))
+        for text in (english, chinese):
+            self.assertLessEqual(count_tokens(truncate_tokens(text, 50)), 50)
+            self.assertTrue(truncate_tokens(text, 50, keep='end').startswith('...'))
+
+    def test_encoding_that_fails_to_load_falls_back_to_estimates(self):
+        from unittest import mock
+        from . import context_budget
+        tiktoken = mock.Mock()
+        tiktoken.get_encoding.side_effect = OSError('no network')
+        with mock.patch.multiple(context_budget, tiktoken=tiktoken, _encoding=None, _encoding_failed=False):
+            self.assertEqual(context_budget.count_tokens('abcdefgh'), 2)
+            self.assertEqual(context_budget.count_tokens('龙在'), 2)
+        tiktoken.get_encoding.assert_called_once_with(context_budget.TIKTOKEN_ENCODING)
+
+    def test_allocate_gives_leftovers_by_priority(self):
+        from .context_budget import allocate
+        self.assertEqual(
+            allocate(100, [('a', 80, 40), ('b', 10, 40), ('c', 80, 40)]),
+            {'a': 50, 'b': 10, 'c': 40},
+        )
+
+    def test_framework_is_trimmed_and_cached_per_version(self):
+        from unittest import mock
+        from . import context_budget
+        story = make_story(self.user, characters='Aria. ' * 5000, themes='Courage')
+        sections = context_budget.framework_sections(story)
+        self.assertLessEqual(context_budget.count_tokens(sections['characters']), context_budget.FRAMEWORK_TOKENS)
+        self.assertEqual(sections['themes'], 'Courage')
+
+        with mock.patch.object(context_budget, 'truncate_tokens', side_effect=context_budget.truncate_tokens) as truncate:
+            context_budget.framework_sections(story)
+            truncate.assert_not_called()
+            story.themes = 'Hope'
+            context_budget.framework_sections(story)
+            truncate.assert_called()
+
+        with self.assertNumQueries(2):
+            # Framework from the cache; history is two queries (arcs, chapters)
+            from .chapter_engine import build_messages
+            build_messages(story, 'Next.', 4)
+
+
+class GenerationLockTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('author', password='pw')
+        self.story = make_story(self.user)
+
+    def test_caller_finding_the_lock_taken_comes_back_later(self):
+        from unittest import mock
+        from .chapter_engine import FakeBackend
+        from .generation_lock import GenerationInProgress, generate_chapter_once
+        from .models import ChapterDraft
+
+        backend = FakeBackend()
+        lock = ChapterDraft.objects.create(
+            story=self.story, chapter_number=1, locked_by='other-worker',
+            locked_until=timezone.now() + timezone.timedelta(minutes=5),
+        )
+        with mock.patch.object(backend, 'complete') as complete:
+            with self.assertRaises(GenerationInProgress) as raised:
+                generate_chapter_once(self.story, 'Go.', 1, backend=backend)
+        complete.assert_not_called()
+        self.assertEqual(raised.exception.retry_after, 30)
+
+        # A crashed holder's lock expires
+        ChapterDraft.objects.filter(pk=lock.pk).update(locked_until=timezone.now() - timezone.timedelta(seconds=1))
+        self.assertFalse(generate_chapter_once(self.story, 'Go.', 1, backend=backend)[1])
+        lock.refresh_from_db()
+        self.assertEqual((lock.locked_by, lock.draft['title'][:8]), ('', 'Chapter '))
+
+    def test_draft_is_reused_only_for_the_same_prompt(self):
+        from .generation_lock import generate_chapter_once, save_draft_once
+        from .chapter_engine import FakeBackend
+
+        first, reused = generate_chapter_once(self.story, 'Go.', 1, backend=FakeBackend())
+        self.assertFalse(reused)
+        self.assertEqual(generate_chapter_once(self.story, 'Go.', 1, backend=FakeBackend()), (first, True))
+        other, reused = generate_chapter_once(self.story, 'Something else.', 1, backend=FakeBackend())
+        self.assertFalse(reused)
+        self.assertNotEqual(other['content'], first['content'])
+
+        chapter, created = save_draft_once(self.story, 1, other)
+        self.assertTrue(created)
+        self.assertEqual(save_draft_once(self.story, 1, other), (chapter, False))
+
+        chapter.delete()
+        self.assertFalse(generate_chapter_once(self.story, 'Something else.', 1, backend=FakeBackend())[1])
+
+
+class RateLimitTests(TestCase):
+    @override_settings(OPENAI_RATE_LIMITS={'gpt-test': {'rpm': 2, 'tpm': 1000}})
+    def test_buckets_limit_requests_and_tokens(self):
+        from .rate_limit import LocalRateLimiter, RateLimited, throttle
+        limiter = LocalRateLimiter()
+        self.assertEqual(limiter.try_acquire('gpt-test', 400), 0)
+        self.assertGreater(limiter.try_acquire('gpt-test', 700), 0)
+        self.assertEqual(limiter.try_acquire('gpt-test', 500), 0)
+        # Two requests a minute: the next one waits about 30 seconds
+        self.assertAlmostEqual(limiter.try_acquire('gpt-test', 0), 30, delta=1)
+        self.assertEqual(limiter.try_acquire('unlimited-model', 10 ** 6), 0)
+
+        from unittest import mock
+        with mock.patch('stories.rate_limit.get_rate_limiter', return_value=limiter):
+            with self.assertRaises(RateLimited) as raised:
+                throttle('gpt-test', 0, max_wait=1)
+        self.assertGreater(raised.exception.retry_after, 1)
+
+    @override_settings(OPENAI_RATE_LIMITS={'gpt-test': {'rpm': 100, 'tpm': 10 ** 6}, 'default': {'rpm': 1, 'tpm': 1000}})
+    def test_unlisted_models_get_the_default_limits(self):
+        from .rate_limit import LocalRateLimiter
+        limiter = LocalRateLimiter()
+        self.assertEqual(limiter.try_acquire('other-model', 10), 0)
+        self.assertGreater(limiter.try_acquire('other-model', 10), 0)
+        # Each model has buckets of its own
+        self.assertEqual(limiter.try_acquire('another-model', 10), 0)
+        self.assertEqual(limiter.try_acquire('gpt-test', 10), 0)
+
+    def test_retry_delay_backs_off_with_jitter(self):
+        from .rate_limit import retry_delay, RETRY_MAX_DELAY
+        self.assertTrue(2.5 <= retry_delay(0) <= 5)
+        self.assertTrue(20 <= retry_delay(3) <= 40)
+        self.assertLessEqual(retry_delay(20), RETRY_MAX_DELAY)
+        self.assertEqual(retry_delay(0, retry_after=60), 60)
+
+
+@skipUnless(_redis_available(), 'Redis is not running')
+@override_settings(OPENAI_RATE_LIMITS={'gpt-test': {'rpm': 2, 'tpm': 1000}})
+class RedisRateLimiterTests(TestCase):
+    def test_buckets_are_shared_between_limiters(self):
+        from .rate_limit import RedisRateLimiter
+        first, second = RedisRateLimiter('redis://127.0.0.1:6379/15'), RedisRateLimiter('redis://127.0.0.1:6379/15')
+        first._client.flushdb()
+        self.assertEqual(first.try_acquire('gpt-test', 600), 0)
+        self.assertGreater(second.try_acquire('gpt-test', 600), 0)
+        self.assertEqual(second.try_acquire('gpt-test', 400), 0)
+        self.assertGreater(first.try_acquire('gpt-test', 0), 0)
@@ -10,6 +10,13 @@ urlpatterns = [
     # Homepage and collaborative stories
     path('', views.homepage, name='homepage'),
     path('create-story/', views.create_story_pitch, name='create_story_pitch'),
+
+    # Browse (keyset paginated)
+    path('genre/<slug:value>/', views.browse_stories, {'facet': 'genre'}, name='browse_genre'),
+    path('language/<slug:value>/', views.browse_stories, {'facet': 'language'}, name='browse_language'),
+    path('browse/<slug:value>/', views.browse_stories, {'facet': 'status'}, name='browse_status'),
+    path('search/', views.search_stories, name='search'),
+
     path('story/<slug:slug>/', views.story_detail, name='story_detail'),
     path('story/<slug:slug>/chapter/<int:chapter_number>/', views.chapter_detail, name='chapter_detail'),
     path('story/<slug:slug>/chapter/<int:chapter_number>/edit/', views.edit_chapter, name='edit_chapter'),
@@ -18,11 +25,13 @@ urlpatterns = [
     path('story/<slug:slug>/subscribe/', views.subscribe_story, name='subscribe_story'),
     path('story/<slug:slug>/upvote/', views.upvote_story, name='upvote_story'),
     path('prompt/<int:prompt_id>/vote/', views.vote_prompt, name='vote_prompt'),
+    path('story/<slug:slug>/tallies/', views.vote_tallies, name='vote_tallies'),
 
     # Personal stories
     path('my-stories/', views.my_stories, name='my_stories'),
     path('create-personal-story/', views.create_personal_story, name='create_personal_story'),
     path('personal/<slug:slug>/continue/', views.continue_personal_story, name='continue_personal_story'),
+    path('personal/<slug:slug>/generation/<int:job_id>/', views.personal_generation_status, name='personal_generation_status'),
     path('personal/<slug:slug>/publish/', views.publish_story, name='publish_story'),
     path('story/<slug:slug>/mark-complete/', views.mark_complete, name='mark_complete'),
     path('story/<slug:slug>/publish-to-community/', views.publish_to_community, name='publish_to_community'),
@@ -1,20 +1,42 @@
 """
 Views for PlotVote stories app
 """
+import logging
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.urls import reverse
 from django.utils import timezone
-from django.db.models import Count, Q
+from django.db.models import Exists, OuterRef, Q, Value
 from .models import Story, Chapter, Prompt, Vote, Comment, Feedback, SiteSettings
-from .ai_generator import generate_chapter
-from users.models import CreditTransaction
+from .personal_generation import start_job, get_job, get_active_job_id
+
+
+logger = logging.getLogger(__name__)
+
+# Number of active stories shown on the homepage (the rest are on the browse pages)
+HOMEPAGE_ACTIVE_LIMIT = 9
+
+# Stories per page on the genre/language/status browse pages
+BROWSE_PAGE_SIZE = 12
+
+# Prompts shown per page on the story detail voting panel
+PROMPTS_PER_PAGE = 10
 
 
 def homepage(request):
     """Homepage showing active stories, completed stories, and pitched stories (collaborative only)"""
-    # Get language filter from query params
+    from django.core.cache import cache
+    from django.utils.functional import SimpleLazyObject
+    from .cache_utils import get_homepage_version, HOMEPAGE_CACHE_TIMEOUT
+    from .ranking import ranked_stories
+
+    # Get language filter from query params (unknown values fall back to all languages
+    # so arbitrary query strings can't fill the cache)
     language_filter = request.GET.get('language', '')
+    if language_filter not in dict(Story.LANGUAGE_CHOICES):
+        language_filter = ''
 
     # Base querysets - only show collaborative stories on homepage
     active_stories_qs = Story.objects.filter(status='active', story_type='collaborative')
@@ -27,54 +49,181 @@ def homepage(request):
         completed_stories_qs = completed_stories_qs.filter(language=language_filter)
         pitched_stories_qs = pitched_stories_qs.filter(language=language_filter)
 
-    # Active stories (ready for chapter prompts)
-    active_stories = active_stories_qs.annotate(
-        subscriber_count_annotated=Count('subscribers')
-    ).order_by('-is_featured', '-created_at')
+    # Active and completed sections are rendered inside {% cache %} fragments keyed by
+    # homepage_version, so these lazy querysets only hit the database on a cache miss
+    homepage_version = get_homepage_version()
 
-    # Completed stories (finished stories for reading)
-    completed_stories = completed_stories_qs.annotate(
-        subscriber_count_annotated=Count('subscribers')
-    ).order_by('-updated_at')[:6]  # Latest 6 completed stories
+    # Active stories (ready for chapter prompts), in trending order. Wrapped lazily so the
+    # ranking lookup only runs when the cached fragment has to be re-rendered
+    active_stories = SimpleLazyObject(lambda: ranked_stories(
+        active_stories_qs.select_related('created_by').order_by('-is_featured', '-created_at'),
+        'active', language_filter, HOMEPAGE_ACTIVE_LIMIT,
+    ))
 
-    # Pitched stories (community voting)
-    pitched_stories = pitched_stories_qs.annotate(
-        upvote_count_annotated=Count('upvoters')
-    ).order_by('-upvote_count_annotated', '-created_at')[:6]  # Top 6
+    # Completed stories (finished stories for reading)
+    completed_stories = completed_stories_qs.select_related('created_by').order_by('-updated_at')[:6]  # Latest 6 completed stories
+
+    # Pitched stories (community voting) - the upvote buttons are per-user, so cache the
+    # stories themselves rather than the rendered section
+    pitched_stories = cache.get_or_set(
+        f'homepage:pitched:{homepage_version}:{language_filter or "all"}',
+        lambda: ranked_stories(
+            pitched_stories_qs.select_related('created_by').order_by('-upvote_count', '-created_at'),
+            'pitch', language_filter, 6,  # Top 6
+        ),
+        HOMEPAGE_CACHE_TIMEOUT,
+    )
+
+    upvoted_story_ids = set()
+    if request.user.is_authenticated and pitched_stories:
+        upvoted_story_ids = set(
+            request.user.upvoted_stories.filter(
+                id__in=[story.id for story in pitched_stories]
+            ).values_list('id', flat=True)
+        )
 
     context = {
         'active_stories': active_stories,
         'completed_stories': completed_stories,
         'pitched_stories': pitched_stories,
+        'upvoted_story_ids': upvoted_story_ids,
+        'homepage_version': homepage_version,
+        'homepage_cache_timeout': HOMEPAGE_CACHE_TIMEOUT,
         'language_choices': Story.LANGUAGE_CHOICES,
         'selected_language': language_filter,
     }
     return render(request, 'stories/homepage.html', context)
 
 
+def browse_stories(request, facet, value):
+    """
+    Browse collaborative stories by genre, language or status
+
+    Uses keyset pagination (?cursor=...) so deep pages stay as cheap as the first.
+    """
+    from .pagination import keyset_page
+    from .seo_utils import get_structured_data_breadcrumbs
+    from django.conf import settings
+    from django.http import Http404
+    import json
+
+    if facet == 'genre':
+        choices = dict(Story.GENRE_CHOICES)
+        heading = f"{choices.get(value)} Stories"
+    elif facet == 'language':
+        choices = dict(Story.LANGUAGE_CHOICES)
+        heading = f"Stories in {choices.get(value)}"
+    else:
+        choices = {status: label for status, label in Story.STATUS_CHOICES if status in Story.PUBLIC_STATUSES}
+        heading = {'active': 'Active Stories', 'completed': 'Completed Stories', 'pitch': 'Story Pitches'}.get(value)
+
+    if value not in choices:
+        raise Http404(f"Unknown {facet}: {value}")
+
+    stories_qs = Story.objects.filter(
+        story_type='collaborative',
+        status__in=Story.PUBLIC_STATUSES,
+        **{facet: value}
+    ).select_related('created_by')
+
+    stories, next_cursor = keyset_page(stories_qs, request.GET.get('cursor'), BROWSE_PAGE_SIZE)
+
+    site_url = f"{settings.SITE_PROTOCOL}://{settings.SITE_DOMAIN}"
+    breadcrumbs = get_structured_data_breadcrumbs([
+        ("Home", f"{site_url}/"),
+        (heading, f"{site_url}{request.path}"),
+    ])
+
+    context = {
+        'stories': stories,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+        'facet': facet,
+        'value': value,
+        'heading': heading,
+        'structured_data_json': json.dumps(breadcrumbs),
+    }
+    return render(request, 'stories/browse.html', context)
+
+
+def search_stories(request):
+    """Full-text search over public stories and chapters"""
+    from .search import search
+
+    query = request.GET.get('q', '').strip()[:200]
+    try:
+        page = min(max(int(request.GET.get('page', 1)), 1), 50)
+    except ValueError:
+        page = 1
+
+    results, has_next = search(query, page=page) if query else ([], False)
+
+    context = {
+        'query': query,
+        'results': results,
+        'page': page,
+        'has_next': has_next,
+    }
+    return render(request, 'stories/search.html', context)
+
+
 def story_detail(request, slug):
-    """Story detail page showing all chapters and current voting"""
+    """
+    Story detail page showing all chapters and current voting
+
+    Runs a fixed number of queries regardless of how many chapters or prompts
+    the story has: the story (with author and subscription flag), the chapter
+    list, and one page of prompts annotated with the user's vote.
+    """
     from .seo_utils import get_story_meta, get_structured_data_story
+    from .voting import apply_live_tallies, order_by_live_tallies
     import json
 
-    story = get_object_or_404(Story, slug=slug)
-    chapters = story.chapters.filter(status='published').order_by('chapter_number')
+    stories = Story.objects.select_related('created_by')
+    if request.user.is_authenticated:
+        stories = stories.annotate(
+            is_subscribed=Exists(Story.subscribers.through.objects.filter(story=OuterRef('pk'), user=request.user))
+        )
+    else:
+        stories = stories.annotate(is_subscribed=Value(False))
+    story = get_object_or_404(stories, slug=slug)
 
-    # Get current voting prompts
-    current_prompts = story.prompts.filter(
-        status__in=['active', 'voting'],
-        chapter_number=story.current_chapter_number
-    ).order_by('-vote_count', 'created_at')
+    # Chapter list only needs the headings, not the (large) chapter text
+    chapters = story.chapters.filter(status='published').defer('content').order_by('chapter_number')
 
-    # Check if user has voted
-    user_voted_prompt = None
+    # Get current voting prompts, one page at a time, most voted first
+    try:
+        prompts_page = max(int(request.GET.get('prompts_page', 1)), 1)
+    except ValueError:
+        prompts_page = 1
+
+    # With the Redis vote ledger, tallies in the database lag until the next
+    # flush, so prompts are ordered by the live tallies before paginating
+    current_prompts = order_by_live_tallies(
+        story.prompts.filter(
+            status__in=['active', 'voting'],
+            chapter_number=story.current_chapter_number
+        ).select_related('user'),
+        story.id,
+        story.current_chapter_number,
+    )
+
+    # Flag the prompt the current user voted for
     if request.user.is_authenticated:
-        user_vote = Vote.objects.filter(
-            user=request.user,
-            prompt__in=current_prompts
-        ).first()
-        if user_vote:
-            user_voted_prompt = user_vote.prompt
+        current_prompts = current_prompts.annotate(
+            user_voted=Exists(Vote.objects.filter(prompt=OuterRef('pk'), user=request.user))
+        )
+    else:
+        current_prompts = current_prompts.annotate(user_voted=Value(False))
+
+    # Fetch one extra prompt to know whether there is another page
+    offset = (prompts_page - 1) * PROMPTS_PER_PAGE
+    current_prompts = list(current_prompts[offset:offset + PROMPTS_PER_PAGE + 1])
+    has_more_prompts = len(current_prompts) > PROMPTS_PER_PAGE
+    current_prompts = current_prompts[:PROMPTS_PER_PAGE]
+
+    # Show the live tallies and the user's live vote on this page
+    apply_live_tallies(current_prompts, story.id, story.current_chapter_number, request.user)
 
     # SEO metadata
     seo_meta = get_story_meta(story)
@@ -84,8 +233,9 @@ def story_detail(request, slug):
         'story': story,
         'chapters': chapters,
         'current_prompts': current_prompts,
-        'user_voted_prompt': user_voted_prompt,
-        'is_subscribed': request.user.is_authenticated and story.subscribers.filter(id=request.user.id).exists(),
+        'prompts_page': prompts_page,
+        'has_more_prompts': has_more_prompts,
+        'is_subscribed': story.is_subscribed,
         # SEO data
         'seo_meta': seo_meta,
         'structured_data_json': json.dumps(structured_data),
@@ -93,52 +243,117 @@ def story_detail(request, slug):
     return render(request, 'stories/story_detail.html', context)
 
 
+def _chapter_validators(request, chapter):
+    """
+    ETag and Last-Modified for a chapter page
+
+    The page changes when the chapter is edited, the story is edited, a chapter
+    is published after it (the "next" link) or its comments change; stories.signals
+    bumps story.updated_at for chapter changes and chapter.updated_at for deleted
+    comments, so Last-Modified moves forward with all of them. Logged-in
+    users also see their own name and credit balance, so their ETag includes
+    those and they get no Last-Modified (which can't express them).
+
+    Returns:
+        tuple: (quoted ETag, Last-Modified timestamp or None)
+    """
+    import hashlib
+    from django.utils.http import quote_etag
+
+    story = chapter.story
+    modified = [chapter.updated_at, story.updated_at]
+    if chapter.last_comment_at:
+        modified.append(chapter.last_comment_at)
+
+    parts = [
+        chapter.id, chapter.updated_at.timestamp(), story.updated_at.timestamp(),
+        story.total_chapters, chapter.comment_count,
+        chapter.last_comment_at.timestamp() if chapter.last_comment_at else '',
+    ]
+    last_modified = int(max(modified).timestamp())
+    if request.user.is_authenticated:
+        parts += [request.user.id, request.user.profile.credits]
+        last_modified = None
+
+    etag = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return quote_etag(etag), last_modified
+
+
+def _set_validators(request, response, etag, last_modified):
+    """Attach validators and make caches revalidate a chapter response every time"""
+    from django.utils.cache import patch_cache_control, patch_vary_headers
+    from django.utils.http import http_date
+
+    response.headers['ETag'] = etag
+    if last_modified:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
 def chapter_detail(request, slug, chapter_number):
     """Individual chapter reading view"""
+    from django.db.models import Count, Max, Subquery
+    from django.db.models.functions import Coalesce
+    from django.utils.cache import get_conditional_response
+    from .cache_utils import get_rendered_chapter_body
     from .seo_utils import get_chapter_meta, get_structured_data_chapter
     import json
 
-    story = get_object_or_404(Story, slug=slug)
-    chapter = get_object_or_404(Chapter, story=story, chapter_number=chapter_number, status='published')
-
-    # Record chapter view for logged-in users (assume 100% read for now)
-    reward_info = None
-    if request.user.is_authenticated and request.user != story.created_by:
-        from users.credit_rewards import record_chapter_view
-        view, reward = record_chapter_view(chapter, request.user, read_percentage=100)
-        reward_info = reward
+    # Chapter, story, author and the comment summary used for the validators in one query
+    chapter_comments = Comment.objects.filter(chapter=OuterRef('pk')).order_by().values('chapter')
+    chapter = get_object_or_404(
+        Chapter.objects.select_related('story', 'story__created_by').annotate(
+            comment_count=Coalesce(Subquery(chapter_comments.annotate(count=Count('pk')).values('count')), 0),
+            last_comment_at=Subquery(chapter_comments.annotate(latest=Max('updated_at')).values('latest')),
+        ),
+        story__slug=slug,
+        chapter_number=chapter_number,
+        status='published',
+    )
+    story = chapter.story
+
+    # Record chapter view and ad impression for logged-in users (assume 100% read for now).
+    # Both are buffered and written in batches, with reading rewards checked by the
+    # flush. This happens before the conditional check so a 304 still counts as a read.
+    if request.user.is_authenticated:
+        from users.engagement import record_view_event, record_ad_impression
 
-    # Show reward notification if earned
-    if reward_info and reward_info['awarded']:
-        messages.success(request, f'🎉 "{story.title}" reached {reward_info["milestone"]} readers! You earned {reward_info["credits"]} credits!')
+        if request.user != story.created_by:
+            record_view_event(chapter, request.user, read_percentage=100)
 
-    # Track ad impression for non-subscribers
-    if request.user.is_authenticated:
+        # Track ad impression for non-subscribers
         if not request.user.profile.has_active_subscription():
-            # Record ad view
-            from users.models import AdView
-            AdView.objects.create(
-                user=request.user,
-                chapter=chapter,
-                ad_duration_seconds=0,  # Banner ads don't have duration
-                watched_full=True,  # Banner ads are always "watched"
-                skipped_with_credits=False,
+            record_ad_impression(
+                chapter,
+                request.user,
                 ip_address=request.META.get('REMOTE_ADDR'),
-                user_agent=request.META.get('HTTP_USER_AGENT', '')[:255]
+                user_agent=request.META.get('HTTP_USER_AGENT', ''),
             )
 
-    # Get previous and next chapters
-    prev_chapter = Chapter.objects.filter(
-        story=story,
-        chapter_number=chapter_number - 1,
-        status='published'
-    ).first()
+    # Answer 304 when the client's copy is current, unless there are flash
+    # messages waiting to be shown on this page
+    etag, last_modified = _chapter_validators(request, chapter)
+    if not len(messages.get_messages(request)):
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return _set_validators(request, not_modified, etag, last_modified)
 
-    next_chapter = Chapter.objects.filter(
-        story=story,
-        chapter_number=chapter_number + 1,
-        status='published'
-    ).first()
+    # Get previous and next chapters
+    neighbours = {
+        neighbour.chapter_number: neighbour
+        for neighbour in Chapter.objects.filter(
+            story=story,
+            chapter_number__in=[chapter_number - 1, chapter_number + 1],
+            status='published'
+        ).only('id', 'story_id', 'chapter_number')
+    }
+    prev_chapter = neighbours.get(chapter_number - 1)
+    next_chapter = neighbours.get(chapter_number + 1)
 
     comments = chapter.comments.select_related('user').order_by('created_at')
 
@@ -149,6 +364,7 @@ def chapter_detail(request, slug, chapter_number):
     context = {
         'story': story,
         'chapter': chapter,
+        'chapter_body': get_rendered_chapter_body(chapter),
         'prev_chapter': prev_chapter,
         'next_chapter': next_chapter,
         'comments': comments,
@@ -156,7 +372,8 @@ def chapter_detail(request, slug, chapter_number):
         'seo_meta': seo_meta,
         'structured_data_json': json.dumps(structured_data),
     }
-    return render(request, 'stories/chapter_detail.html', context)
+    response = render(request, 'stories/chapter_detail.html', context)
+    return _set_validators(request, response, etag, last_modified)
 
 
 @login_required
@@ -215,42 +432,59 @@ def submit_prompt(request, slug):
 @login_required
 def vote_prompt(request, prompt_id):
     """Vote on a prompt"""
-    prompt = get_object_or_404(Prompt, id=prompt_id, status='voting')
+    from .voting import cast_vote, VotingClosed, VOTE_CREATED, VOTE_MOVED
 
-    # Check if voting is still open
-    if timezone.now() > prompt.voting_ends_at:
-        messages.error(request, 'Voting has ended for this prompt.')
-        return redirect('stories:story_detail', slug=prompt.story.slug)
+    prompt = get_object_or_404(Prompt.objects.select_related('story'), id=prompt_id, status='voting')
 
-    # Check if user already voted for this chapter
-    existing_vote = Vote.objects.filter(
-        user=request.user,
-        prompt__story=prompt.story,
-        prompt__chapter_number=prompt.chapter_number
-    ).first()
+    try:
+        result = cast_vote(request.user, prompt)
+    except VotingClosed as e:
+        messages.error(request, str(e))
+        return redirect('stories:story_detail', slug=prompt.story.slug)
 
-    if existing_vote:
-        # Change vote
-        if existing_vote.prompt != prompt:
-            existing_vote.delete()
-            Vote.objects.create(user=request.user, prompt=prompt)
-            messages.success(request, 'Your vote has been changed!')
-        else:
-            messages.info(request, 'You already voted for this prompt.')
-    else:
-        # New vote
-        Vote.objects.create(user=request.user, prompt=prompt)
+    if result == VOTE_CREATED:
         messages.success(request, 'Vote recorded!')
+    elif result == VOTE_MOVED:
+        messages.success(request, 'Your vote has been changed!')
+    else:
+        messages.info(request, 'You already voted for this prompt.')
 
     return redirect('stories:story_detail', slug=prompt.story.slug)
 
 
+def vote_tallies(request, slug):
+    """
+    Live vote counts for a story's current round, polled by the story page
+
+    Answers straight from the shared cached snapshot (see
+    voting.get_tally_snapshot), so a poll costs no queries most of the time
+    and never holds a worker. The snapshot version is the ETag, and a client
+    that already has it gets an empty 304.
+    """
+    from django.http import HttpResponseNotModified, JsonResponse
+    from django.utils.http import quote_etag
+    from .voting import get_tally_snapshot
+
+    story = get_object_or_404(Story.objects.only('id', 'total_chapters'), slug=slug)
+    chapter_number = story.current_chapter_number
+    snapshot = get_tally_snapshot(story.id, chapter_number)
+
+    etag = quote_etag(snapshot['version'])
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse({'chapter_number': chapter_number, 'tallies': snapshot['tallies']})
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 @login_required
 def subscribe_story(request, slug):
     """Subscribe/unsubscribe to story updates"""
     story = get_object_or_404(Story, slug=slug)
 
-    if request.user in story.subscribers.all():
+    if story.subscribers.filter(id=request.user.id).exists():
         story.subscribers.remove(request.user)
         messages.success(request, f'Unsubscribed from "{story.title}"')
     else:
@@ -325,7 +559,7 @@ def upvote_story(request, slug):
     """Upvote/remove upvote from a story pitch"""
     story = get_object_or_404(Story, slug=slug)
 
-    if request.user in story.upvoters.all():
+    if story.upvoters.filter(id=request.user.id).exists():
         story.upvoters.remove(request.user)
         messages.success(request, f'Removed upvote from "{story.title}"')
     else:
@@ -379,8 +613,6 @@ def my_stories(request):
     ).filter(
         Q(story_type='personal') |
         Q(story_type='collaborative', created_by=request.user)
-    ).annotate(
-        chapter_count=Count('chapters', filter=Q(chapters__status='published'))
     ).order_by('-updated_at')
 
     context = {
@@ -457,7 +689,7 @@ def continue_personal_story(request, slug):
     last_chapter = story.chapters.filter(status='published').order_by('-chapter_number').first()
     next_chapter_number = story.current_chapter_number
 
-    # Handle POST request - generate new chapter
+    # Handle POST request - queue generation of the next chapter
     if request.method == 'POST':
         prompt_text = request.POST.get('prompt_text', '').strip()
 
@@ -465,76 +697,67 @@ def continue_personal_story(request, slug):
             messages.error(request, 'Prompt cannot be empty.')
         elif len(prompt_text) > 3000:
             messages.error(request, 'Prompt must be 3000 characters or less.')
+        elif not SiteSettings.get_settings().beta_mode_enabled and not request.user.profile.has_credits(1):
+            # The credit itself is deducted by the generation job
+            messages.error(request, 'Not enough credits! You need 1 credit to generate a chapter.')
+            return redirect('stories:credits_dashboard')
         else:
-            # Check beta mode
-            settings = SiteSettings.get_settings()
-            beta_mode = settings.beta_mode_enabled
-
-            # Check if user has enough credits (skip during beta)
-            profile = request.user.profile
-            if not beta_mode:
-                if not profile.has_credits(1):
-                    messages.error(request, 'Not enough credits! You need 1 credit to generate a chapter.')
-                    return redirect('stories:credits_dashboard')
-
-                # Deduct credit before generation
-                if not profile.deduct_credits(1):
-                    messages.error(request, 'Failed to deduct credits. Please try again.')
-                    return redirect('stories:continue_personal_story', slug=story.slug)
-
-            # Generate chapter using AI
-            previous_chapters = story.chapters.filter(status='published').order_by('-chapter_number')
-            result = generate_chapter(story, prompt_text, previous_chapters)
-
-            if 'error' in result:
-                # Refund credit on error (only if not in beta mode)
-                if not beta_mode:
-                    profile.add_credits(1, source='earned')
-                    CreditTransaction.objects.create(
-                        user=request.user,
-                        amount=1,
-                        transaction_type='refund',
-                        description=f'Refund for failed chapter generation: {result["error"][:100]}',
-                        story=story,
-                        balance_after=profile.credits
-                    )
-                messages.error(request, result['error'])
+            try:
+                job_id = start_job(story, request.user, prompt_text)
+            except Exception:
+                logger.exception(f"Failed to queue chapter generation for story {story.id}")
+                messages.error(request, 'Chapter generation is unavailable right now. Please try again.')
             else:
-                # Create and publish the chapter
-                chapter = Chapter.objects.create(
-                    story=story,
-                    chapter_number=next_chapter_number,
-                    title=result['title'],
-                    content=result['content'],
-                    status='published',
-                    published_at=timezone.now()
-                )
-                story.updated_at = timezone.now()
-                story.save()
-
-                # Record transaction
-                CreditTransaction.objects.create(
-                    user=request.user,
-                    amount=-1,
-                    transaction_type='spent',
-                    description=f'Generated chapter {next_chapter_number} for "{story.title}"',
-                    story=story,
-                    chapter=chapter,
-                    balance_after=profile.credits
-                )
-
-                messages.success(request, f'Chapter {next_chapter_number} has been generated! You have {profile.credits} credits remaining.')
-                return redirect('stories:chapter_detail', slug=story.slug, chapter_number=next_chapter_number)
+                if job_id is None:
+                    messages.info(request, 'A chapter is already being generated for this story.')
+                return redirect('stories:continue_personal_story', slug=story.slug)
 
     context = {
         'story': story,
         'last_chapter': last_chapter,
         'next_chapter_number': next_chapter_number,
         'user_credits': request.user.profile.credits,
+        'active_job_id': get_active_job_id(story),
     }
     return render(request, 'stories/continue_personal_story.html', context)
 
 
+@login_required
+def personal_generation_status(request, slug, job_id):
+    """
+    State of a personal chapter generation, polled by the page while it is written
+
+    ?offset=N is the number of characters the browser already has, so each
+    poll only returns new text. Answers straight away rather than waiting
+    for more, so it never holds a worker.
+    """
+    from django.http import Http404, JsonResponse
+    from .models import GenerationJob
+
+    story = get_object_or_404(Story.objects.only('id', 'slug'), slug=slug, story_type='personal', created_by=request.user)
+    job = get_job(job_id)
+    if job is None or job['story_id'] != story.id:
+        raise Http404('Generation job not found')
+
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+    except ValueError:
+        offset = 0
+
+    data = {
+        'status': job['status'],
+        'text': job['text'][offset:],
+        'offset': max(len(job['text']), offset),
+    }
+    if job['status'] == GenerationJob.SUCCEEDED:
+        data['url'] = reverse('stories:chapter_detail', args=[story.slug, job['chapter_number']])
+    elif job['status'] == GenerationJob.FAILED:
+        data['error'] = job['error']
+    response = JsonResponse(data)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 @login_required
 def publish_story(request, slug):
     """Publish a personal story to the community"""
@@ -0,0 +1,537 @@
+"""
+Voting service for prompt rounds
+
+A voting round is the set of prompts competing for one chapter of a story.
+Each user has at most one vote per round (enforced by the one_vote_per_round
+constraint). Votes go through one of two backends:
+
+- DatabaseVoteBackend (default): Vote rows are written straight away and
+  Prompt.vote_count is maintained with atomic F() updates, so concurrent
+  voters never overwrite each other's counts. Moving a vote to another prompt
+  in the same round happens in a single transaction.
+- RedisVoteBackend (VOTE_LEDGER_URL set): each round is a hash of
+  user -> prompt plus a sorted set of prompt tallies, updated atomically by a
+  Lua script. Live tallies come from Redis and the stories.tasks.flush_vote_ledger
+  beat task writes the ballots of changed rounds to the Vote table in batches.
+"""
+import hashlib
+import json
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Prompt, Vote
+
+
+# cast_vote results
+VOTE_CREATED = 'created'
+VOTE_MOVED = 'moved'
+VOTE_UNCHANGED = 'unchanged'
+
+
+class VotingClosed(Exception):
+    """The prompt is not open for voting"""
+
+
+def check_voting_open(prompt):
+    """Raise VotingClosed unless the prompt is in an open voting round"""
+    if prompt.status != 'voting':
+        raise VotingClosed('This prompt is not open for voting.')
+    if timezone.now() > prompt.voting_ends_at:
+        raise VotingClosed('Voting has ended for this prompt.')
+
+
+def cast_vote(user, prompt):
+    """
+    Vote for a prompt, moving the user's existing vote in the round if there is one
+
+    Args:
+        user: Voting user
+        prompt: Prompt being voted for
+
+    Returns:
+        str: VOTE_CREATED, VOTE_MOVED or VOTE_UNCHANGED
+
+    Raises:
+        VotingClosed: If the prompt is not accepting votes
+    """
+    check_voting_open(prompt)
+    return get_vote_backend().cast_vote(user, prompt)
+
+
+def _cast_db_vote(user, prompt):
+    """Create or move a vote in the database, retrying once if a concurrent insert wins"""
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                return _cast_vote(user, prompt)
+        except IntegrityError:
+            # A concurrent request inserted this user's vote for the round
+            # first; the retry will find it and move it instead
+            if attempt:
+                raise
+
+
+def _cast_vote(user, prompt):
+    existing = Vote.objects.select_for_update().filter(
+        story_id=prompt.story_id,
+        chapter_number=prompt.chapter_number,
+        user=user,
+    ).values_list('id', 'prompt_id').first()
+
+    if existing is None:
+        Vote.objects.create(
+            prompt=prompt,
+            user=user,
+            story_id=prompt.story_id,
+            chapter_number=prompt.chapter_number,
+        )
+        return VOTE_CREATED
+
+    vote_id, old_prompt_id = existing
+    if old_prompt_id == prompt.id:
+        return VOTE_UNCHANGED
+
+    Vote.objects.filter(id=vote_id).update(prompt=prompt, created_at=timezone.now())
+    Prompt.objects.filter(id=old_prompt_id).update(vote_count=F('vote_count') - 1)
+    Prompt.objects.filter(id=prompt.id).update(vote_count=F('vote_count') + 1)
+    return VOTE_MOVED
+
+
+def sync_round_votes(story_id, chapter_number, ballots):
+    """
+    Make the Vote rows of a round match a {user_id: prompt_id} ballot map
+
+    Creates missing votes, moves changed ones and recounts the round's prompts.
+    Ballots for prompts outside the round or users that no longer exist are ignored.
+
+    Returns:
+        int: Number of votes created or moved
+    """
+    from django.contrib.auth.models import User
+
+    round_prompts = set(
+        Prompt.objects.filter(story_id=story_id, chapter_number=chapter_number).values_list('id', flat=True)
+    )
+    existing_users = set(User.objects.filter(id__in=ballots).values_list('id', flat=True))
+    ballots = {
+        user_id: prompt_id for user_id, prompt_id in ballots.items()
+        if prompt_id in round_prompts and user_id in existing_users
+    }
+
+    with transaction.atomic():
+        current = {
+            user_id: (vote_id, prompt_id)
+            for vote_id, user_id, prompt_id in Vote.objects.select_for_update().filter(
+                story_id=story_id, chapter_number=chapter_number
+            ).values_list('id', 'user_id', 'prompt_id')
+        }
+
+        new_votes = []
+        moves = {}
+        for user_id, prompt_id in ballots.items():
+            if user_id not in current:
+                new_votes.append(Vote(
+                    prompt_id=prompt_id, user_id=user_id, story_id=story_id, chapter_number=chapter_number,
+                ))
+            elif current[user_id][1] != prompt_id:
+                moves.setdefault(prompt_id, []).append(current[user_id][0])
+
+        Vote.objects.bulk_create(new_votes, batch_size=500)
+        for prompt_id, vote_ids in moves.items():
+            Vote.objects.filter(id__in=vote_ids).update(prompt_id=prompt_id, created_at=timezone.now())
+
+        Prompt.objects.filter(story_id=story_id, chapter_number=chapter_number).update(
+            vote_count=Prompt.vote_count_expression()
+        )
+
+    return len(new_votes) + sum(len(vote_ids) for vote_ids in moves.values())
+
+
+class DatabaseVoteBackend:
+    """Votes are written straight to the database; Prompt.vote_count is the live tally"""
+
+    live_tallies = False
+
+    def cast_vote(self, user, prompt):
+        return _cast_db_vote(user, prompt)
+
+    def round_tallies(self, story_id, chapter_number):
+        """{prompt_id: votes} for a round"""
+        return dict(
+            Prompt.objects.filter(story_id=story_id, chapter_number=chapter_number).values_list('id', 'vote_count')
+        )
+
+    def user_choice(self, user, story_id, chapter_number):
+        """Prompt id the user voted for in a round, or None"""
+        return Vote.objects.filter(
+            story_id=story_id, chapter_number=chapter_number, user=user
+        ).values_list('prompt_id', flat=True).first()
+
+    def flush_round(self, story_id, chapter_number):
+        return 0
+
+    def close_round(self, story_id, chapter_number):
+        return 0
+
+    def flush(self):
+        return 0
+
+
+# Lua scripts run atomically inside Redis.
+# KEYS: ballots hash, tally sorted set, seeded marker, dirty-round set, closed marker
+# ARGV: user id, prompt id, round id, ttl
+_CAST_SCRIPT = """
+if redis.call('EXISTS', KEYS[5]) == 1 then return -2 end
+if redis.call('EXISTS', KEYS[3]) == 0 then return -1 end
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+if old == ARGV[2] then return 0 end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if old then redis.call('ZINCRBY', KEYS[2], -1, old) end
+redis.call('ZINCRBY', KEYS[2], 1, ARGV[2])
+redis.call('SADD', KEYS[4], ARGV[3])
+for i = 1, 3 do redis.call('EXPIRE', KEYS[i], ARGV[4]) end
+if old then return 2 end
+return 1
+"""
+
+# KEYS: ballots hash, tally sorted set, seeded marker
+# ARGV: ttl, then user id / prompt id pairs from the database
+_SEED_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 1 then return 0 end
+redis.call('DEL', KEYS[1], KEYS[2])
+for i = 2, #ARGV - 1, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    redis.call('ZINCRBY', KEYS[2], 1, ARGV[i + 1])
+end
+redis.call('SET', KEYS[3], 1)
+for i = 1, 3 do redis.call('EXPIRE', KEYS[i], ARGV[1]) end
+return 1
+"""
+
+
+class RedisVoteBackend:
+    """
+    Votes are recorded in Redis and flushed to the database in batches
+
+    A round is loaded ("seeded") from the Vote table the first time it is
+    voted on, so the backend can be switched on in the middle of a round.
+    """
+
+    live_tallies = True
+
+    DIRTY_ROUNDS_KEY = 'votes:dirty'
+
+    # Idle rounds are dropped from Redis after this long (the database keeps the votes)
+    ROUND_TTL = 60 * 60 * 24 * 30
+
+    # Rounds written to the database per flush
+    FLUSH_ROUNDS = 100
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._cast = self._client.register_script(_CAST_SCRIPT)
+        self._seed = self._client.register_script(_SEED_SCRIPT)
+
+    @staticmethod
+    def _round_id(story_id, chapter_number):
+        return f'{story_id}:{chapter_number}'
+
+    def _keys(self, round_id):
+        return [f'votes:{round_id}:ballots', f'votes:{round_id}:tally', f'votes:{round_id}:seeded']
+
+    def _seed_round(self, story_id, chapter_number):
+        args = [self.ROUND_TTL]
+        for user_id, prompt_id in Vote.objects.filter(
+            story_id=story_id, chapter_number=chapter_number
+        ).values_list('user_id', 'prompt_id'):
+            args += [user_id, prompt_id]
+        self._seed(keys=self._keys(self._round_id(story_id, chapter_number)), args=args)
+
+    def _closed_key(self, round_id):
+        return f'votes:{round_id}:closed'
+
+    def cast_vote(self, user, prompt):
+        round_id = self._round_id(prompt.story_id, prompt.chapter_number)
+        keys = self._keys(round_id) + [self.DIRTY_ROUNDS_KEY, self._closed_key(round_id)]
+        args = [user.id, prompt.id, round_id, self.ROUND_TTL]
+
+        result = self._cast(keys=keys, args=args)
+        if result == -1:
+            self._seed_round(prompt.story_id, prompt.chapter_number)
+            result = self._cast(keys=keys, args=args)
+        if result == -2:
+            raise VotingClosed('Voting has ended for this prompt.')
+
+        return {0: VOTE_UNCHANGED, 1: VOTE_CREATED, 2: VOTE_MOVED}[result]
+
+    def round_tallies(self, story_id, chapter_number):
+        """{prompt_id: votes} from Redis, or the database if the round isn't loaded"""
+        ballots_key, tally_key, seeded_key = self._keys(self._round_id(story_id, chapter_number))
+        pipe = self._client.pipeline()
+        pipe.exists(seeded_key)
+        pipe.zrange(tally_key, 0, -1, withscores=True)
+        seeded, tallies = pipe.execute()
+        if not seeded:
+            return DatabaseVoteBackend().round_tallies(story_id, chapter_number)
+        return {int(prompt_id): int(votes) for prompt_id, votes in tallies}
+
+    def user_choice(self, user, story_id, chapter_number):
+        ballots_key, _, seeded_key = self._keys(self._round_id(story_id, chapter_number))
+        pipe = self._client.pipeline()
+        pipe.exists(seeded_key)
+        pipe.hget(ballots_key, user.id)
+        seeded, prompt_id = pipe.execute()
+        if not seeded:
+            return DatabaseVoteBackend().user_choice(user, story_id, chapter_number)
+        return int(prompt_id) if prompt_id else None
+
+    def flush_round(self, story_id, chapter_number):
+        """Write one round's ballots to the database"""
+        ballots_key, _, seeded_key = self._keys(self._round_id(story_id, chapter_number))
+        if not self._client.exists(seeded_key):
+            return 0
+        ballots = {int(user_id): int(prompt_id) for user_id, prompt_id in self._client.hgetall(ballots_key).items()}
+        return sync_round_votes(story_id, chapter_number, ballots)
+
+    def close_round(self, story_id, chapter_number):
+        """
+        Stop a round taking votes, then write its final ballots to the database
+
+        Votes arriving after the closed marker is set raise VotingClosed, so
+        the flush that follows sees every vote the round will ever get.
+        """
+        round_id = self._round_id(story_id, chapter_number)
+        self._client.set(self._closed_key(round_id), 1, ex=self.ROUND_TTL)
+        return self.flush_round(story_id, chapter_number)
+
+    def flush(self):
+        """
+        Write every round changed since the last flush to the database
+
+        Returns:
+            int: Number of votes created or moved
+        """
+        written = 0
+        for raw in self._client.spop(self.DIRTY_ROUNDS_KEY, self.FLUSH_ROUNDS) or []:
+            round_id = raw.decode()
+            story_id, chapter_number = (int(part) for part in round_id.split(':'))
+            try:
+                written += self.flush_round(story_id, chapter_number)
+            except Exception:
+                # Keep the round queued so the next flush retries it
+                self._client.sadd(self.DIRTY_ROUNDS_KEY, round_id)
+                raise
+        return written
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_vote_backend():
+    """Get the process-wide vote backend selected by VOTE_LEDGER_URL"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                url = getattr(settings, 'VOTE_LEDGER_URL', '')
+                _backend = RedisVoteBackend(url) if url else DatabaseVoteBackend()
+    return _backend
+
+
+def order_by_live_tallies(prompts, story_id, chapter_number):
+    """
+    Order a round's prompt QuerySet most voted first by the backend's live tallies
+
+    With the Redis ledger Prompt.vote_count lags until the next flush, so
+    ordering by it before paginating would put prompts on the wrong page.
+    The live tallies are annotated as live_vote_count and ordered by instead;
+    the database backend orders by vote_count as before.
+    """
+    backend = get_vote_backend()
+    if not backend.live_tallies:
+        return prompts.order_by('-vote_count', 'created_at')
+
+    tallies = backend.round_tallies(story_id, chapter_number)
+    live_vote_count = Case(
+        *[When(pk=prompt_id, then=Value(votes)) for prompt_id, votes in tallies.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return prompts.annotate(live_vote_count=live_vote_count).order_by('-live_vote_count', 'created_at')
+
+
+def apply_live_tallies(prompts, story_id, chapter_number, user=None):
+    """
+    Overwrite vote_count/user_voted on prompts with the backend's live values
+
+    No-op for the database backend, whose vote_count already is the live tally.
+    Prompts from order_by_live_tallies() keep the tallies they were ordered
+    by; otherwise the list is re-sorted most voted first.
+    """
+    backend = get_vote_backend()
+    if not backend.live_tallies or not prompts:
+        return prompts
+
+    choice = backend.user_choice(user, story_id, chapter_number) if user and user.is_authenticated else None
+    for prompt in prompts:
+        prompt.user_voted = prompt.id == choice
+    if all(hasattr(prompt, 'live_vote_count') for prompt in prompts):
+        for prompt in prompts:
+            prompt.vote_count = prompt.live_vote_count
+        return prompts
+
+    tallies = backend.round_tallies(story_id, chapter_number)
+    for prompt in prompts:
+        prompt.vote_count = tallies.get(prompt.id, 0)
+    prompts.sort(key=lambda prompt: (-prompt.vote_count, prompt.created_at))
+    return prompts
+
+
+def reconcile_vote_counts(prompts=None):
+    """
+    Recompute Prompt.vote_count from the Vote table
+
+    Args:
+        prompts: Prompt QuerySet to reconcile (defaults to all prompts)
+
+    Returns:
+        list: (prompt id, cached count, actual count) for prompts that had drifted
+    """
+    prompts = Prompt.objects.all() if prompts is None else prompts
+    drifted = [
+        (row['id'], row['vote_count'], row['actual'])
+        for row in prompts.annotate(actual=Prompt.vote_count_expression()).values('id', 'vote_count', 'actual')
+        if row['vote_count'] != row['actual']
+    ]
+    if drifted:
+        with transaction.atomic():
+            Prompt.objects.filter(id__in=[prompt_id for prompt_id, _, _ in drifted]).update(
+                vote_count=Prompt.vote_count_expression()
+            )
+    return drifted
+
+
+# Live tally snapshots are recomputed at most once per interval per round,
+# however many clients are watching
+TALLY_SNAPSHOT_INTERVAL = 2
+TALLY_SNAPSHOT_TIMEOUT = 60
+
+
+def get_tally_snapshot(story_id, chapter_number):
+    """
+    Shared, cached snapshot of a round's tallies for live updates
+
+    When the snapshot is older than TALLY_SNAPSHOT_INTERVAL the first caller to
+    grab the refresh lock recomputes it; everyone else keeps getting the
+    previous snapshot in the meantime.
+
+    Returns:
+        dict: {'version': str, 'tallies': {prompt id (str): votes}, 'computed_at': float}
+    """
+    key = f'vote_tallies:{story_id}:{chapter_number}'
+    snapshot = cache.get(key)
+    now = time.time()
+    if snapshot is not None:
+        if now - snapshot['computed_at'] < TALLY_SNAPSHOT_INTERVAL:
+            return snapshot
+        if not cache.add(f'{key}:lock', 1, TALLY_SNAPSHOT_INTERVAL):
+            return snapshot
+
+    tallies = {
+        str(prompt_id): votes
+        for prompt_id, votes in get_vote_backend().round_tallies(story_id, chapter_number).items()
+    }
+    snapshot = {
+        'version': hashlib.md5(json.dumps(tallies, sort_keys=True).encode()).hexdigest()[:12],
+        'tallies': tallies,
+        'computed_at': now,
+    }
+    cache.set(key, snapshot, TALLY_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def close_expired_rounds(now=None):
+    """
+    Close every voting round whose deadline has passed
+
+    A round closes once the deadline of any of its open prompts has passed (the
+    earliest deadline is the one set when the round opened). The most voted
+    prompt wins, with the earliest submission breaking ties. Every other open
+    prompt in the round is rejected. Rounds that already have a winner, e.g.
+    one picked with the generate_chapter command, only have their open prompts
+    rejected.
+
+    Safe to run concurrently: each story is locked (skipping stories another
+    closer holds) and only prompts still open are touched, so a round is
+    closed, and its chapter queued for generation (through the outbox), exactly once.
+    With the Redis ledger, a round is flushed only once its story is locked, so
+    a vote cast while the closer waits is not missed. The round stops taking
+    votes once the transaction commits; a rolled-back close leaves it open for
+    the next run.
+
+    Returns:
+        list: Ids of the winning prompts
+    """
+    from django.db.models import Q
+    from .models import Story
+    from .generation_jobs import queue_prompt_generation
+
+    now = now or timezone.now()
+    open_statuses = ['active', 'voting']
+
+    # One range scan over the (status, voting_ends_at) index
+    expired_rounds = set(
+        Prompt.objects.filter(status__in=open_statuses, voting_ends_at__lte=now)
+        .order_by().values_list('story_id', 'chapter_number').distinct()
+    )
+    if not expired_rounds:
+        return []
+
+    backend = get_vote_backend()
+    winner_ids = []
+    with transaction.atomic():
+        claimed = set(
+            Story.objects.select_for_update(skip_locked=True)
+            .filter(id__in={story_id for story_id, _ in expired_rounds})
+            .values_list('id', flat=True)
+        )
+        rounds = [(story_id, number) for story_id, number in expired_rounds if story_id in claimed]
+        if not rounds:
+            return []
+
+        # Get votes still sitting in the Redis ledger into vote_count first
+        for story_id, chapter_number in rounds:
+            backend.flush_round(story_id, chapter_number)
+            transaction.on_commit(partial(backend.close_round, story_id, chapter_number))
+
+        in_rounds = Q()
+        for story_id, chapter_number in rounds:
+            in_rounds |= Q(story_id=story_id, chapter_number=chapter_number)
+
+        decided = set(
+            Prompt.objects.filter(in_rounds, status='winner').values_list('story_id', 'chapter_number')
+        )
+        candidates = {}
+        for prompt_id, story_id, chapter_number in Prompt.objects.filter(in_rounds, status__in=open_statuses).order_by(
+            '-vote_count', 'created_at', 'id'
+        ).values_list('id', 'story_id', 'chapter_number'):
+            # First row per round is its winner
+            candidates.setdefault((story_id, chapter_number), prompt_id)
+
+        winner_ids = [prompt_id for key, prompt_id in candidates.items() if key not in decided]
+        Prompt.objects.filter(in_rounds, status__in=open_statuses).exclude(id__in=winner_ids).update(status='rejected')
+        Prompt.objects.filter(id__in=winner_ids).update(status='winner')
+
+        for prompt in Prompt.objects.filter(id__in=winner_ids).only('id', 'story_id', 'chapter_number'):
+            queue_prompt_generation(prompt)
+
+    return winner_ids
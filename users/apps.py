@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "users"
+
+    def ready(self):
+        from django.core.signals import request_finished
+        from .engagement import flush_local_buffer
+
+        request_finished.connect(flush_local_buffer, dispatch_uid='users.flush_local_engagement_buffer')
@@ -2,10 +2,12 @@
 Credit reward utilities for PlotVote
 Handles reading rewards, milestone tracking, and credit awards
 """
+from collections import Counter
+
 from django.utils import timezone
-from django.db.models import Count, Q, Sum
-from django.db import models
-from .models import ChapterView, CreditTransaction
+from django.db.models import Count, F, Q, Sum
+from django.db import models, transaction
+from .models import ChapterView, CreditTransaction, StoryReader
 
 
 # Reading reward milestones
@@ -18,10 +20,57 @@ READING_MILESTONES = [
 ]
 
 
+def record_qualified_readers(pairs):
+    """
+    Count readers reaching their first qualified read (60%+) of a story
+
+    Each (story, reader) pair gets one StoryReader row and bumps the story's
+    reader_count, so the unique-reader count never has to be recomputed.
+    The affected story rows are locked while checking for existing readers,
+    so concurrent flushes can't count the same reader twice.
+
+    Args:
+        pairs: Iterable of (story_id, reader_id) with a qualified read
+
+    Returns:
+        dict: {story_id: (previous reader_count, new reader_count)} for stories that gained readers
+    """
+    from stories.models import Story
+
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+
+    story_ids = {story_id for story_id, _ in pairs}
+    with transaction.atomic():
+        counts = dict(
+            Story.objects.select_for_update().filter(id__in=story_ids).order_by('id').values_list('id', 'reader_count')
+        )
+        existing = set(StoryReader.objects.filter(
+            story_id__in=story_ids,
+            reader_id__in={reader_id for _, reader_id in pairs},
+        ).values_list('story_id', 'reader_id'))
+
+        new_readers = [pair for pair in pairs if pair not in existing and pair[0] in counts]
+        StoryReader.objects.bulk_create(
+            [StoryReader(story_id=story_id, reader_id=reader_id) for story_id, reader_id in new_readers],
+            batch_size=500,
+        )
+
+        gained = Counter(story_id for story_id, _ in new_readers)
+        for story_id, added in gained.items():
+            Story.objects.filter(pk=story_id).update(reader_count=F('reader_count') + added)
+
+    return {story_id: (counts[story_id], counts[story_id] + added) for story_id, added in gained.items()}
+
+
 def check_reading_rewards(story):
     """
     Check if a story has reached any reading milestones and award credits
 
+    Reads the story's cached reader_count; call it when award_crossed_milestones()
+    finds a milestone due rather than on every view.
+
     Args:
         story: Story object to check
 
@@ -32,10 +81,7 @@ def check_reading_rewards(story):
         return None
 
     # Only count qualified reads (60%+ completion, unique readers)
-    unique_qualified_readers = ChapterView.objects.filter(
-        chapter__story=story,
-        read_percentage__gte=60
-    ).values('reader').distinct().count()
+    unique_qualified_readers = story.reader_count
 
     # Check each milestone
     for milestone in READING_MILESTONES:
@@ -82,6 +128,58 @@ def check_reading_rewards(story):
     return None
 
 
+def reached_milestones(reader_count):
+    """Number of reading milestones at or below reader_count"""
+    return sum(1 for m in READING_MILESTONES if m['readers'] <= reader_count)
+
+
+def award_crossed_milestones(reader_growth):
+    """
+    Run reward checks for stories that gained readers and have a milestone due
+
+    A milestone is due when the story has reached it but has not been awarded
+    it, whether it was passed just now or earlier while the author was at the
+    monthly cap, so capped rewards are granted on a later flush.
+
+    Args:
+        reader_growth: Result of record_qualified_readers()
+
+    Returns:
+        list: Reward dicts that were awarded
+    """
+    from stories.models import Story
+
+    reached = {
+        story_id: reached_milestones(current)
+        for story_id, (previous, current) in reader_growth.items()
+    }
+    reached = {story_id: count for story_id, count in reached.items() if count}
+    if not reached:
+        return []
+
+    awarded = dict(
+        CreditTransaction.objects.filter(
+            story_id__in=reached,
+            transaction_type='earned',
+            description__startswith='Reading reward:',
+        ).values('story_id').annotate(total=Count('id')).values_list('story_id', 'total')
+    )
+    due = {story_id: count - awarded.get(story_id, 0) for story_id, count in reached.items()}
+    due = {story_id: count for story_id, count in due.items() if count > 0}
+    if not due:
+        return []
+
+    rewards = []
+    for story in Story.objects.filter(id__in=due).select_related('created_by'):
+        # One award per call, so check once for each milestone due
+        for _ in range(due[story.id]):
+            reward = check_reading_rewards(story)
+            if not reward:
+                break
+            rewards.append(reward)
+    return rewards
+
+
 def record_chapter_view(chapter, reader, read_percentage=100, time_spent=0):
     """
     Record or update a chapter view
@@ -106,9 +204,10 @@ def record_chapter_view(chapter, reader, read_percentage=100, time_spent=0):
 
     # Check if this triggered a reading reward milestone
     if view.is_qualified_read:
-        reward = check_reading_rewards(chapter.story)
-        if reward and reward['awarded']:
-            return view, reward
+        growth = record_qualified_readers([(chapter.story_id, reader.id)])
+        rewards = award_crossed_milestones(growth)
+        if rewards:
+            return view, rewards[0]
 
     return view, None
 
@@ -123,10 +222,7 @@ def get_story_reader_count(story):
     Returns:
         int: Number of unique readers who read 60%+ of at least one chapter
     """
-    return ChapterView.objects.filter(
-        chapter__story=story,
-        read_percentage__gte=60
-    ).values('reader').distinct().count()
+    return story.reader_count
 
 
 def get_user_reading_credits_this_month(user):
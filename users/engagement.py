@@ -0,0 +1,332 @@
+"""
+Buffered ingestion of chapter views and ad impressions
+
+Reading a chapter used to write a ChapterView, run the reading-reward checks
+and insert an AdView inside the request. Those events are now appended to a
+buffer and written in batches:
+
+- With ENGAGEMENT_BUFFER_URL set (production), events go onto a Redis list
+  that the users.tasks.flush_engagement_events beat task drains.
+- Without it (local development, tests), events are kept in-process and
+  flushed once the response has been sent.
+
+A flush collapses repeat views of a chapter by the same reader, upserts the
+ChapterViews, bulk inserts the AdViews and then counts first qualified reads,
+checking rewards only for stories with a reading milestone due.
+
+A batch is only claimed, not removed, until it has been written: if the
+write fails it goes back to the front of the buffer, and batches claimed by
+a flush that died are put back after CLAIM_TIMEOUT.
+"""
+import json
+import logging
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import ChapterView, AdView
+
+
+logger = logging.getLogger(__name__)
+
+BUFFER_KEY = 'engagement:events'
+
+# Sorted set of processing lists holding claimed batches, scored by claim time
+CLAIMS_KEY = 'engagement:events:claims'
+
+# Events written per flush batch
+FLUSH_BATCH_SIZE = 1000
+
+# Stop draining after this many batches so one task run can't go on forever
+MAX_BATCHES_PER_FLUSH = 20
+
+# A claimed batch not written or returned within this long is put back (seconds)
+CLAIM_TIMEOUT = 10 * 60
+
+
+class LocalEventBuffer:
+    """In-process buffer for when there is no Redis to share events through"""
+
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+
+    def push(self, event):
+        with self._lock:
+            self._events.append(event)
+
+    def claim_batch(self, size):
+        """
+        Take up to `size` events off the front of the buffer
+
+        Returns:
+            tuple: (claim, events) - pass claim to ack() or requeue()
+        """
+        with self._lock:
+            batch = self._events[:size]
+            del self._events[:size]
+        return batch, batch
+
+    def ack(self, claim):
+        """The claimed batch was written; nothing to clean up in-process"""
+
+    def requeue(self, claim):
+        """Put a claimed batch back at the front of the buffer"""
+        with self._lock:
+            self._events[:0] = claim
+
+    def requeue_stale(self, timeout=CLAIM_TIMEOUT):
+        """Claims never outlive the process that made them"""
+        return 0
+
+
+# Runs atomically inside Redis.
+# KEYS: buffer, processing list, claims
+# ARGV: batch size
+_CLAIM_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items == 0 then return items end
+redis.call('LTRIM', KEYS[1], #items, -1)
+redis.call('RPUSH', KEYS[2], unpack(items))
+redis.call('ZADD', KEYS[3], redis.call('TIME')[1], KEYS[2])
+return items
+"""
+
+# KEYS: buffer, processing list, claims
+_REQUEUE_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[2], 0, -1)
+for i = #items, 1, -1 do
+    redis.call('LPUSH', KEYS[1], items[i])
+end
+redis.call('DEL', KEYS[2])
+redis.call('ZREM', KEYS[3], KEYS[2])
+return #items
+"""
+
+
+class RedisEventBuffer:
+    """Redis list shared by every web worker and drained by Celery"""
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._claim = self._client.register_script(_CLAIM_SCRIPT)
+        self._requeue = self._client.register_script(_REQUEUE_SCRIPT)
+
+    def push(self, event):
+        self._client.rpush(BUFFER_KEY, json.dumps(event))
+
+    def claim_batch(self, size):
+        """
+        Move up to `size` events from the buffer to a processing list of their own
+
+        The move is atomic, so concurrent flushes never see the same events,
+        and the events stay in Redis until ack() or requeue().
+
+        Returns:
+            tuple: (claim, events) - pass claim to ack() or requeue()
+        """
+        claim = f'{BUFFER_KEY}:processing:{uuid.uuid4().hex}'
+        raw = self._claim(keys=[BUFFER_KEY, claim, CLAIMS_KEY], args=[size])
+        return claim, [json.loads(item) for item in raw]
+
+    def ack(self, claim):
+        """Drop a claimed batch once it has been written"""
+        pipe = self._client.pipeline()
+        pipe.delete(claim)
+        pipe.zrem(CLAIMS_KEY, claim)
+        pipe.execute()
+
+    def requeue(self, claim):
+        """Put a claimed batch back at the front of the buffer"""
+        self._requeue(keys=[BUFFER_KEY, claim, CLAIMS_KEY])
+
+    def requeue_stale(self, timeout=CLAIM_TIMEOUT):
+        """
+        Put back batches claimed by flushes that died before writing them
+
+        Returns:
+            int: Number of events put back
+        """
+        now = int(self._client.time()[0])
+        requeued = 0
+        for claim in self._client.zrangebyscore(CLAIMS_KEY, '-inf', now - timeout):
+            requeued += self._requeue(keys=[BUFFER_KEY, claim.decode(), CLAIMS_KEY])
+        return requeued
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_event_buffer():
+    """Get the process-wide event buffer for the configured backend"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                url = getattr(settings, 'ENGAGEMENT_BUFFER_URL', '')
+                _buffer = RedisEventBuffer(url) if url else LocalEventBuffer()
+    return _buffer
+
+
+def _push(event):
+    """Buffer an event, writing it straight away if the buffer is unreachable"""
+    try:
+        get_event_buffer().push(event)
+    except Exception:
+        logger.exception("Engagement buffer unavailable, writing event synchronously")
+        write_events([event])
+
+
+def record_view_event(chapter, reader, read_percentage=100, time_spent=0):
+    """
+    Queue a chapter view for the next flush
+
+    Args:
+        chapter: Chapter that was read
+        reader: User who read it
+        read_percentage: Percentage of chapter read (0-100)
+        time_spent: Time spent reading in seconds
+    """
+    _push({
+        'type': 'view',
+        'chapter_id': chapter.id,
+        'reader_id': reader.id,
+        'read_percentage': min(max(read_percentage, 0), 100),
+        'time_spent_seconds': time_spent,
+    })
+
+
+def record_ad_impression(chapter, user, ip_address=None, user_agent='', ad_duration_seconds=0,
+                         watched_full=True, skipped_with_credits=False):
+    """
+    Queue an ad impression for the next flush
+
+    Defaults describe a banner ad, which has no duration and always counts as watched.
+    """
+    _push({
+        'type': 'ad',
+        'chapter_id': chapter.id,
+        'user_id': user.id if user else None,
+        'ad_duration_seconds': ad_duration_seconds,
+        'watched_full': watched_full,
+        'skipped_with_credits': skipped_with_credits,
+        'ip_address': ip_address,
+        'user_agent': (user_agent or '')[:255],
+    })
+
+
+def write_events(events):
+    """
+    Write a batch of buffered events to the database
+
+    Events for chapters or users deleted since they were buffered are dropped.
+
+    Returns:
+        int: Number of events written
+    """
+    from django.contrib.auth.models import User
+    from stories.models import Chapter
+    from .credit_rewards import record_qualified_readers, award_crossed_milestones
+
+    chapter_stories = dict(
+        Chapter.objects.filter(id__in={event['chapter_id'] for event in events}).values_list('id', 'story_id')
+    )
+    user_ids = {event.get('reader_id') or event.get('user_id') for event in events} - {None}
+    existing_users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+
+    # Later views of the same chapter by the same reader replace earlier ones
+    views = {}
+    ads = []
+    for event in events:
+        if event['chapter_id'] not in chapter_stories:
+            continue
+        if event['type'] == 'view' and event['reader_id'] in existing_users:
+            views[(event['chapter_id'], event['reader_id'])] = event
+        elif event['type'] == 'ad' and (event['user_id'] is None or event['user_id'] in existing_users):
+            ads.append(AdView(
+                chapter_id=event['chapter_id'],
+                user_id=event['user_id'],
+                ad_duration_seconds=event['ad_duration_seconds'],
+                watched_full=event['watched_full'],
+                skipped_with_credits=event['skipped_with_credits'],
+                ip_address=event['ip_address'],
+                user_agent=event['user_agent'],
+            ))
+
+    upsert_options = {
+        'update_conflicts': True,
+        'update_fields': ['read_percentage', 'time_spent_seconds', 'updated_at'],
+    }
+    if connection.features.supports_update_conflicts_with_target:
+        upsert_options['unique_fields'] = ['chapter', 'reader']
+
+    with transaction.atomic():
+        if views:
+            ChapterView.objects.bulk_create(
+                [
+                    ChapterView(
+                        chapter_id=event['chapter_id'],
+                        reader_id=event['reader_id'],
+                        read_percentage=event['read_percentage'],
+                        time_spent_seconds=event['time_spent_seconds'],
+                    )
+                    for event in views.values()
+                ],
+                batch_size=500,
+                **upsert_options,
+            )
+        if ads:
+            AdView.objects.bulk_create(ads, batch_size=500)
+
+    # Count first qualified reads; reward checks only run for stories with a milestone due
+    growth = record_qualified_readers(
+        (chapter_stories[chapter_id], reader_id)
+        for (chapter_id, reader_id), event in views.items()
+        if event['read_percentage'] >= 60
+    )
+    award_crossed_milestones(growth)
+
+    return len(views) + len(ads)
+
+
+def flush_events(batch_size=FLUSH_BATCH_SIZE, max_batches=MAX_BATCHES_PER_FLUSH):
+    """
+    Drain the buffer in batches
+
+    A batch that fails to write is put back in the buffer for the next flush
+    and the error re-raised.
+
+    Returns:
+        int: Number of events written
+    """
+    event_buffer = get_event_buffer()
+    requeued = event_buffer.requeue_stale()
+    if requeued:
+        logger.warning("Put back %d engagement events from an unfinished flush", requeued)
+
+    written = 0
+    for _ in range(max_batches):
+        claim, batch = event_buffer.claim_batch(batch_size)
+        if not batch:
+            break
+        try:
+            written += write_events(batch)
+        except Exception:
+            event_buffer.requeue(claim)
+            raise
+        event_buffer.ack(claim)
+    return written
+
+
+def flush_local_buffer(**kwargs):
+    """request_finished receiver: write events buffered in-process by the request"""
+    if not isinstance(get_event_buffer(), LocalEventBuffer):
+        return
+    try:
+        flush_events()
+    except Exception:
+        logger.exception("Failed to flush engagement events")
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_story_readers(apps, schema_editor):
+    """Create a StoryReader for every existing qualified read and count them per story"""
+    ChapterView = apps.get_model('users', 'ChapterView')
+    StoryReader = apps.get_model('users', 'StoryReader')
+    Story = apps.get_model('stories', 'Story')
+
+    qualified = ChapterView.objects.filter(read_percentage__gte=60)
+    pairs = qualified.order_by().values_list('chapter__story', 'reader').distinct()
+    StoryReader.objects.bulk_create(
+        (StoryReader(story_id=story_id, reader_id=reader_id) for story_id, reader_id in pairs.iterator()),
+        batch_size=1000,
+    )
+
+    # auto_now_add stamped the rows with the migration time; use the earliest read instead
+    StoryReader.objects.update(first_qualified_at=Subquery(
+        qualified.filter(chapter__story=OuterRef('story'), reader=OuterRef('reader'))
+        .order_by().values('reader').annotate(first=Min('updated_at')).values('first')[:1]
+    ))
+    Story.objects.update(reader_count=Coalesce(Subquery(
+        StoryReader.objects.filter(story=OuterRef('pk'))
+        .order_by().values('story').annotate(c=Count('*')).values('c')[:1]
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0014_story_reader_count'),
+        ('users', '0006_add_test_package_remove_ultimate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoryReader',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_qualified_at', models.DateTimeField(auto_now_add=True)),
+                ('reader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='qualified_stories', to=settings.AUTH_USER_MODEL)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='qualified_readers', to='stories.story')),
+            ],
+            options={
+                'unique_together': {('story', 'reader')},
+            },
+        ),
+        migrations.RunPython(backfill_story_readers, migrations.RunPython.noop),
+    ]
@@ -283,6 +283,21 @@ class ChapterView(models.Model):
         return self.read_percentage >= 60
 
 
+class StoryReader(models.Model):
+    """First qualified read of a story by a reader; one row per unique reader"""
+
+    story = models.ForeignKey('stories.Story', on_delete=models.CASCADE, related_name='qualified_readers')
+    reader = models.ForeignKey(User, on_delete=models.CASCADE, related_name='qualified_stories')
+
+    first_qualified_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('story', 'reader')
+
+    def __str__(self):
+        return f"{self.reader.username} read {self.story}"
+
+
 class SocialShare(models.Model):
     """Track social media shares for credit rewards"""
 
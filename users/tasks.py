@@ -0,0 +1,15 @@
+"""
+Celery tasks for users app
+"""
+from celery import shared_task
+
+from .engagement import flush_events
+
+
+@shared_task
+def flush_engagement_events():
+    """
+    Write buffered chapter views and ad impressions (runs every few seconds via beat)
+    """
+    written = flush_events()
+    return f"Wrote {written} engagement events"
@@ -1,3 +1,125 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError
 from django.test import TestCase
 
-# Create your tests here.
+from stories.models import Story, Chapter
+from .credit_rewards import award_crossed_milestones, record_qualified_readers
+from .engagement import LocalEventBuffer, record_view_event, record_ad_impression, flush_events, write_events
+from .models import ChapterView, AdView, CreditTransaction, StoryReader
+
+
+class EngagementBufferTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pw')
+        self.story = Story.objects.create(title='Tale', description='A tale', created_by=self.author, status='active')
+        self.chapter = Chapter.objects.create(story=self.story, chapter_number=1, title='One', content='Text', status='published')
+        self.readers = [User.objects.create_user(f'reader{i}') for i in range(10)]
+
+    def test_events_are_written_in_one_batch(self):
+        for reader in self.readers:
+            record_view_event(self.chapter, reader, read_percentage=30)
+            record_ad_impression(self.chapter, reader, ip_address='127.0.0.1', user_agent='x' * 300)
+        record_view_event(self.chapter, self.readers[0], read_percentage=80)
+        self.assertFalse(ChapterView.objects.exists())
+
+        self.assertEqual(flush_events(), 20)
+        self.assertEqual(ChapterView.objects.count(), 10)
+        self.assertEqual(ChapterView.objects.get(reader=self.readers[0]).read_percentage, 80)
+        self.assertEqual(AdView.objects.count(), 10)
+        self.assertEqual(len(AdView.objects.first().user_agent), 255)
+
+    def test_existing_views_are_updated(self):
+        ChapterView.objects.create(chapter=self.chapter, reader=self.readers[0], read_percentage=10)
+        write_events([{
+            'type': 'view', 'chapter_id': self.chapter.id, 'reader_id': self.readers[0].id,
+            'read_percentage': 100, 'time_spent_seconds': 5,
+        }])
+        view = ChapterView.objects.get()
+        self.assertEqual((view.read_percentage, view.time_spent_seconds), (100, 5))
+
+    def test_flush_checks_reading_rewards(self):
+        for reader in self.readers:
+            record_view_event(self.chapter, reader)
+        flush_events()
+        self.assertEqual(CreditTransaction.objects.filter(user=self.author, story=self.story).count(), 1)
+
+    def test_events_for_deleted_chapters_are_dropped(self):
+        event_buffer = LocalEventBuffer()
+        event_buffer.push({'type': 'ad', 'chapter_id': 999999, 'user_id': None, 'ad_duration_seconds': 0,
+                           'watched_full': True, 'skipped_with_credits': False, 'ip_address': None, 'user_agent': ''})
+        claim, batch = event_buffer.claim_batch(10)
+        self.assertEqual(write_events(batch), 0)
+        self.assertEqual(event_buffer.claim_batch(10), ([], []))
+
+    def test_failed_write_keeps_batch(self):
+        for reader in self.readers[:3]:
+            record_view_event(self.chapter, reader)
+        with mock.patch('users.engagement.write_events', side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError):
+                flush_events()
+        self.assertFalse(ChapterView.objects.exists())
+
+        self.assertEqual(flush_events(), 3)
+        self.assertEqual(ChapterView.objects.count(), 3)
+
+
+class UniqueReaderCounterTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pw')
+        self.story = Story.objects.create(title='Tale', description='A tale', created_by=self.author, status='active')
+        self.chapters = [
+            Chapter.objects.create(story=self.story, chapter_number=n, title=f'Ch {n}', content='Text', status='published')
+            for n in (1, 2)
+        ]
+        self.reader = User.objects.create_user('reader')
+
+    def test_reader_counted_once_per_story(self):
+        for chapter in self.chapters:
+            record_view_event(chapter, self.reader)
+        record_view_event(self.chapters[0], User.objects.create_user('skimmer'), read_percentage=20)
+        flush_events()
+        record_view_event(self.chapters[1], self.reader)
+        flush_events()
+
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.reader_count, 1)
+        self.assertEqual(StoryReader.objects.count(), 1)
+
+    def test_growth_reports_milestone_crossings(self):
+        growth = record_qualified_readers([(self.story.id, self.reader.id)])
+        self.assertEqual(growth, {self.story.id: (0, 1)})
+        self.assertEqual(record_qualified_readers([(self.story.id, self.reader.id)]), {})
+
+        Story.objects.filter(pk=self.story.pk).update(reader_count=9)
+        self.assertEqual(award_crossed_milestones({self.story.id: (1, 9)}), [])
+        Story.objects.filter(pk=self.story.pk).update(reader_count=55)
+        rewards = award_crossed_milestones({self.story.id: (9, 55)})
+        self.assertEqual([reward['milestone'] for reward in rewards], [10, 50])
+
+    def test_milestone_blocked_by_monthly_cap_is_awarded_later(self):
+        cap = CreditTransaction.objects.create(
+            user=self.author, amount=50, transaction_type='earned',
+            description='Reading reward: 500 readers on "Other"', balance_after=50,
+        )
+        self.story.reader_count = 9
+        self.story.save(update_fields=['reader_count'])
+        self.assertEqual(award_crossed_milestones({self.story.id: (9, 10)}), [])
+
+        # Next month the cap has room again; the next reader brings the 10-reader reward
+        cap.delete()
+        self.story.reader_count = 11
+        self.story.save(update_fields=['reader_count'])
+        rewards = award_crossed_milestones({self.story.id: (10, 11)})
+        self.assertEqual([reward['milestone'] for reward in rewards], [10])
+        self.assertEqual(award_crossed_milestones({self.story.id: (11, 12)}), [])
+
+    def test_reconcile_fixes_drift(self):
+        from io import StringIO
+        from django.core.management import call_command
+        record_qualified_readers([(self.story.id, self.reader.id)])
+        Story.objects.filter(pk=self.story.pk).update(reader_count=7)
+        call_command('reconcile_story_counters', stdout=StringIO())
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.reader_count, 1)
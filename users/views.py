@@ -12,7 +12,9 @@ from .models import CreditPackage, Purchase, CreditTransaction, UserProfile, Soc
 import stripe
 import json
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from plotvote.http_clients import configure_stripe
+
+configure_stripe()
 
 
 def register(request):